@@ -31,6 +31,100 @@ flags.DEFINE_list(
     ],
     "File for power flow data.",
 )
+flags.DEFINE_bool(
+    "stream_ingest",
+    False,
+    "Stream the NET_P records instead of loading the whole json file.",
+)
+flags.DEFINE_string(
+    "cache_dir",
+    str(PROJECT_ROOT / ".cache"),
+    "Directory for cached hourly generation data. Empty to disable the cache.",
+)
+flags.DEFINE_integer(
+    "cache_max_mb", 2048, "Size limit of the cache directory (MB)."
+)
+flags.DEFINE_integer(
+    "ingest_workers",
+    1,
+    "Number of processes parsing the period files in parallel.",
+)
+flags.DEFINE_integer(
+    "workers",
+    1,
+    "Number of processes running whole periods in parallel; each worker "
+    "loads its own period files.",
+)
+flags.DEFINE_bool(
+    "csv_outputs",
+    True,
+    "Also write the results as per-period CSV files next to the binary "
+    "result store.",
+)
+flags.DEFINE_integer(
+    "figure_workers",
+    1,
+    "Number of processes rendering figures in parallel. Figures always render "
+    "with the non-interactive Agg backend.",
+)
+flags.DEFINE_bool(
+    "profile",
+    False,
+    "Log wall time, CPU time, peak memory and record counts of every stage.",
+)
+flags.DEFINE_bool(
+    "profile_memory",
+    False,
+    "With --profile, also trace peak Python allocations per stage (slower).",
+)
+flags.DEFINE_bool(
+    "profile_report",
+    False,
+    "With --profile, write the measurements to run_report.json in result_dir.",
+)
+flags.DEFINE_integer(
+    "uncertainty_samples",
+    0,
+    "Number of Monte Carlo draws of the emission and capacity factors; writes "
+    "percentile bands of the emission intensities. 0 disables the uncertainty "
+    "mode.",
+)
+flags.DEFINE_list(
+    "uncertainty_percentiles",
+    ["5", "50", "95"],
+    "Percentiles of the uncertainty bands.",
+)
+flags.DEFINE_integer(
+    "uncertainty_workers",
+    1,
+    "Number of processes evaluating the Monte Carlo draws in parallel.",
+)
+flags.DEFINE_string(
+    "lookup_host", "127.0.0.1", "Interface of the intensity lookup server (serve.py)."
+)
+flags.DEFINE_integer(
+    "lookup_port", 8765, "Port of the intensity lookup server (serve.py)."
+)
+flags.DEFINE_enum(
+    "gap_policy",
+    "positional",
+    ["positional", "nan", "interpolate", "drop"],
+    "Hourly averaging of the 10-minute records: 'positional' averages every six "
+    "records in order; 'nan', 'interpolate' and 'drop' place the records on the "
+    "datetime_range grid by timestamp and handle missing samples accordingly.",
+)
+flags.DEFINE_bool(
+    "adjusted_emission_factor",
+    False,
+    "Use the GHG emission factors adjusted to emission_reference.csv.",
+)
+flags.DEFINE_enum(
+    "flow_scale",
+    "regional",
+    ["regional", "tracing"],
+    "Power flow method: 'regional' moves emissions at the origin's intensity, "
+    "'tracing' uses proportional-sharing flow tracing.",
+)
 flags.DEFINE_list(
     "datetime_range",
     [
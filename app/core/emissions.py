@@ -1,54 +1,74 @@
 from typing import Dict, List, Tuple
+import numpy as np
 import pandas as pd
-from pathlib import Path
 
 from app.data import (
-    get_hourly_pg_data,
-    get_ap_emission_factor,
-    get_emissions_by_region,
+    get_ghg_emission_shares,
+    get_regional_emissions,
     get_selected_pg_data,
-    get_json_file,
+    GenerationCube,
 )
 from app.module import (
     calculate_power_generation_with_target,
-    calculate_air_pollution_intensity,
-    calculate_power_flow,
+    calculate_air_pollution_intensities,
+    calculate_power_flow_balance,
+    balance_intensities,
+    calculate_flow_tracing,
+    sweep_capacity_scenarios,
+    ScenarioSweep,
+    marginal_emission_factors,
+    MarginalEmissionFactors,
+    propagate_uncertainty,
+    IntensityBands,
 )
+from app.core.ingest import load_hourly_flow_data
+from app.core.session import Session
+
+
+def national_intensities(intensities: Dict[str, pd.DataFrame]) -> Dict[str, pd.Series]:
+    """National (全台) column of regional intensities after power flow."""
+    return {
+        emission_type: intensity["全台"] for emission_type, intensity in intensities.items()
+    }
 
 
 class EmissionCalculator:
-    def __init__(self, data_dir: Path, pg_file: str, station_file: str):
+    def __init__(
+        self,
+        session: Session,
+        pg_file: str,
+        datetime_range: str | None = None,
+        pg_data: GenerationCube | None = None,
+        emissions: Dict[str, pd.DataFrame] | None = None,
+    ):
         """Initialize emission calculator with data for a specific period
 
         Args:
-            data_dir: Data directory path
+            session: Reference data and options of the run
             pg_file: Power generation data file for a specific period
-            station_file: Station information file
+            datetime_range: Hourly grid of the period in format 'start|end'
+            pg_data: Preloaded hourly power generation of the period
+            emissions: Precomputed regional emissions of each emission type
         """
-        self.data_dir = data_dir
+        self.session = session
+        self.data_dir = session.data_dir
         self.pg_file = pg_file
-        self.station_file = station_file
+        self.datetime_range = datetime_range
+        self.pg_data = pg_data
+        self.emissions = emissions
+        # Packed zero-generation hours of the last basic intensities
+        self.zero_generation: np.ndarray | None = None
         self._init_data()
 
     def _init_data(self):
         """Initialize required data"""
-        self.pg_data = get_hourly_pg_data(
-            data_dir=self.data_dir,
-            pg_file=self.pg_file,
-            station_file=self.station_file,
-        )
-
-        # Specify CSV files and columns
-        csv_files = {
-            "pg.csv": ["能源別", "電廠名稱", "淨發電量(度)"],
-            "AirpollutantEmission.csv": [
-                "硫氧化物排放量(kg)",
-                "氮氧化物排放量(kg)",
-                "粒狀污染物排放量(kg)",
-            ],
-        }
+        if self.pg_data is None:
+            self.pg_data = self.session.hourly_pg(
+                self.pg_file, datetime_range=self.datetime_range
+            )
 
-        self.ap_ef = get_ap_emission_factor(self.data_dir, csv_files)
+        # Shared by all periods of the session
+        self.ap_ef = self.session.emission_factor_table
         self._calculate_emissions()
 
     def _calculate_emissions(self):
@@ -56,16 +76,14 @@ class EmissionCalculator:
 
         emission_types = ["CO2e", "SOx", "NOx", "PM"]
 
-        for emission_type in emission_types:
-            setattr(
-                self,
-                f"{emission_type}_emissions",
-                get_emissions_by_region(
-                    region_power_generation=self.pg_data,
-                    emission_data=self.ap_ef,
-                    target_emission=emission_type,
-                ),
+        if self.emissions is None:
+            self.emissions = get_regional_emissions(
+                cube=self.pg_data,
+                emission_data=self.ap_ef,
+                target_emissions=emission_types,
             )
+        for emission_type in emission_types:
+            setattr(self, f"{emission_type}_emissions", self.emissions[emission_type])
 
     def _get_power_generation(
         self, generation: pd.Series, fuel_type: List[str]
@@ -83,10 +101,18 @@ class EmissionCalculator:
             pg=self.pg_data, exclude_fuel=fuel_type
         )
 
-        return calculate_power_generation_with_target(
+        power_generation = calculate_power_generation_with_target(
             pg_wo_target=pg_sum_exclude_fuel_type, target_gen_data=generation
         )
 
+        # Index the hours of the period, which every intensity keeps
+        if self.datetime_range is not None:
+            start_time, end_time = self.datetime_range.split("|")
+            hours = pd.date_range(start=start_time, end=end_time, freq="h")
+            if len(hours) == len(power_generation):
+                power_generation.index = hours
+        return power_generation
+
     def _calculate_basic_intensities(
         self, power_generation: pd.DataFrame, scale: str
     ) -> Dict[str, pd.Series]:
@@ -97,18 +123,20 @@ class EmissionCalculator:
             scale: Calculation scale ('regional' or 'national')
 
         Returns:
-            Dictionary of emission intensities
+            Dictionary of emission intensities; the bitmask of the hours with
+            zero generation is kept in `zero_generation`
         """
-        intensities = {}
         emission_types = ["CO2e", "SOx", "NOx", "PM"]
 
-        for emission_type in emission_types:
-            intensities[emission_type] = calculate_air_pollution_intensity(
-                ap_data=getattr(self, f"{emission_type}_emissions"),
-                pg_data=power_generation,
-                scale=scale,
-            )
-
+        # All emission types share one masked division
+        intensities, self.zero_generation = calculate_air_pollution_intensities(
+            ap_data={
+                emission_type: getattr(self, f"{emission_type}_emissions")
+                for emission_type in emission_types
+            },
+            pg_data=power_generation,
+            scale=scale,
+        )
         return intensities
 
     def calculate_emission_intensity(
@@ -133,6 +161,7 @@ class EmissionCalculator:
         fuel_type: List[str],
         flow_file: str,
         scale: str = "regional",
+        flow_data: Dict | None = None,
     ) -> Dict[str, pd.Series]:
         """Calculate emission intensity with power flow consideration
 
@@ -140,30 +169,294 @@ class EmissionCalculator:
             generation: Target power generation data
             fuel_type: List of fuel types
             flow_file: Power flow data file
-            scale: Calculation scale ('regional' or 'national')
+            scale: Calculation scale ('regional', 'national' or 'tracing');
+                'tracing' attributes emissions by proportional-sharing flow
+                tracing instead of moving them at the origin's intensity
+            flow_data: Preloaded hourly power flow, replacing `flow_file`
 
         Returns:
             Dictionary containing various emission intensities with power flow
         """
 
-        flow_data = get_json_file(data_dir=self.data_dir, pg_file=flow_file)
-
+        flow_data = self._get_flow_data(flow_file, flow_data)
         power_generation = self._get_power_generation(generation, fuel_type)
 
-        # Get the basic intensities
-        initial_intensities = self._calculate_basic_intensities(power_generation, scale)
+        if scale == "tracing":
+            return calculate_flow_tracing(
+                pg=power_generation,
+                flow=flow_data,
+                emissions=self._get_emissions(),
+                missing=self.pg_data.missing_hours(),
+            )
 
-        # Consider the impacts of power flow
-        intensities = {}
-        emission_types = ["CO2e", "SOx", "NOx", "PM"]
+        intensities = balance_intensities(
+            *self._calculate_flow_balance(power_generation, flow_data)
+        )
+        return national_intensities(intensities) if scale == "national" else intensities
 
-        for emission_type in emission_types:
-            intensities[emission_type] = calculate_power_flow(
+    def estimate_emission_balance_with_flow(
+        self,
+        generation: pd.Series,
+        fuel_type: List[str],
+        flow_file: str,
+        scale: str = "regional",
+        flow_data: Dict | None = None,
+    ) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+        """Calculate generation and emissions of every region after power flow
+
+        Their ratio is the emission intensity, and their sums over any time
+        window give that window's generation-weighted intensity. With
+        'tracing' the emissions are the traced intensity times the generation
+        after power flow.
+
+        Args:
+            generation: Target power generation data
+            fuel_type: List of fuel types
+            flow_file: Power flow data file
+            scale: 'regional' or 'tracing'
+            flow_data: Preloaded hourly power flow, replacing `flow_file`
+
+        Returns:
+            Tuple of the generation (kWh) and the emissions (g) of each
+            emission type, with the national (全台) total last
+        """
+        balance_generation, balance_emissions, _ = self.estimate_emission_flow(
+            generation, fuel_type, flow_file, scale=scale, flow_data=flow_data
+        )
+        return balance_generation, balance_emissions
+
+    def estimate_emission_flow(
+        self,
+        generation: pd.Series,
+        fuel_type: List[str],
+        flow_file: str,
+        scale: str = "regional",
+        flow_data: Dict | None = None,
+    ) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame], Dict[str, pd.Series]]:
+        """Calculate the power flow balance and the emission intensities at once
+
+        Combines `estimate_emission_balance_with_flow` and
+        `estimate_emission_intensity_with_flow` with one power flow solve:
+        the regional and national intensities come from the balance, and
+        'tracing' solves the tracing once for both.
+
+        Args:
+            generation: Target power generation data
+            fuel_type: List of fuel types
+            flow_file: Power flow data file
+            scale: 'regional', 'national' or 'tracing'
+            flow_data: Preloaded hourly power flow, replacing `flow_file`
+
+        Returns:
+            Tuple of the generation (kWh) and the emissions (g) of every region
+            after power flow, and the emission intensity of each emission type
+            as returned by `estimate_emission_intensity_with_flow`
+        """
+        flow_data = self._get_flow_data(flow_file, flow_data)
+        power_generation = self._get_power_generation(generation, fuel_type)
+        balance_generation, balance_emissions = self._calculate_flow_balance(
+            power_generation, flow_data
+        )
+
+        if scale == "tracing":
+            intensities = calculate_flow_tracing(
                 pg=power_generation,
                 flow=flow_data,
-                intensity=initial_intensities[emission_type],
-                emission=getattr(self, f"{emission_type}_emissions"),
-                scale=scale,
+                emissions=self._get_emissions(),
+                missing=self.pg_data.missing_hours(),
             )
+            balance_emissions = {
+                emission_type: intensity[balance_generation.columns] * balance_generation
+                for emission_type, intensity in intensities.items()
+            }
+            return balance_generation, balance_emissions, intensities
 
-        return intensities
+        intensities = balance_intensities(balance_generation, balance_emissions)
+        if scale == "national":
+            intensities = national_intensities(intensities)
+        return balance_generation, balance_emissions, intensities
+
+    def estimate_marginal_emission_factors(
+        self,
+        generation: pd.Series,
+        fuel_type: List[str],
+        flow_file: str,
+        scale: str = "regional",
+        flow_data: Dict | None = None,
+        by_hour: bool = True,
+        by_season: bool = True,
+        min_samples: int = 10,
+    ) -> MarginalEmissionFactors:
+        """Calculate marginal emission factors of every region after power flow
+
+        The hours are taken from the datetime range of the calculator.
+
+        Args:
+            generation: Target power generation data
+            fuel_type: List of fuel types
+            flow_file: Power flow data file
+            scale: 'regional' or 'tracing'
+            flow_data: Preloaded hourly power flow, replacing `flow_file`
+            by_hour: Group by the hour of the day
+            by_season: Group by meteorological season
+            min_samples: Fewest hourly changes for a factor
+
+        Returns:
+            MarginalEmissionFactors of every group of hours
+        """
+        if self.datetime_range is None:
+            raise ValueError("Marginal emission factors need a datetime_range.")
+        balance_generation, balance_emissions = self.estimate_emission_balance_with_flow(
+            generation, fuel_type, flow_file, scale=scale, flow_data=flow_data
+        )
+        start_time, end_time = self.datetime_range.split("|")
+        datetime_index = pd.date_range(start=start_time, end=end_time, freq="h")
+        balance_generation.index = datetime_index
+        for frame in balance_emissions.values():
+            frame.index = datetime_index
+        return marginal_emission_factors(
+            balance_generation,
+            balance_emissions,
+            by_hour=by_hour,
+            by_season=by_season,
+            min_samples=min_samples,
+        )
+
+    def estimate_emission_intensity_uncertainty(
+        self,
+        fuel_generation: List[pd.DataFrame],
+        fuel_type: List[str],
+        flow_file: str,
+        flow_data: Dict | None = None,
+        n_samples: int = 1000,
+        uncertainty: Dict[str, float] | None = None,
+        percentiles: List[float] = (5, 50, 95),
+        chunk_size: int = 64,
+        workers: int = 1,
+        seed: int = 0,
+        samples_path: str | None = None,
+    ) -> IntensityBands:
+        """Calculate Monte Carlo bands of the emission intensity with power flow
+
+        Emission factors and the capacity factors of the target fuels are
+        perturbed in every draw; see propagate_uncertainty. Power flow moves
+        emissions at the origin's intensity, as with the 'regional' scale.
+
+        Args:
+            fuel_generation: Target power generation of each fuel type
+            fuel_type: List of target fuel types, in the order of the generation
+            flow_file: Power flow data file
+            flow_data: Preloaded hourly power flow, replacing `flow_file`
+            n_samples: Number of draws
+            uncertainty: Standard deviation of the log multiplier of each input
+            percentiles: Percentiles of the bands
+            chunk_size: Number of draws evaluated together
+            workers: Number of processes evaluating draws in parallel
+            seed: Random seed
+            samples_path: Keep the draws in this .npy file instead of in memory
+
+        Returns:
+            IntensityBands of the period
+        """
+        base_generation = get_selected_pg_data(pg=self.pg_data, exclude_fuel=fuel_type)
+        if self.datetime_range is not None:
+            start_time, end_time = self.datetime_range.split("|")
+            hours = pd.date_range(start=start_time, end=end_time, freq="h")
+            if len(hours) == len(base_generation):
+                base_generation.index = hours
+
+        return propagate_uncertainty(
+            cube=self.pg_data,
+            emission_data=self.ap_ef,
+            ghg_shares=get_ghg_emission_shares(self.data_dir),
+            base_generation=base_generation,
+            fuel_generation=fuel_generation,
+            flow=self._get_flow_data(flow_file, flow_data),
+            n_samples=n_samples,
+            uncertainty=uncertainty,
+            percentiles=percentiles,
+            chunk_size=chunk_size,
+            workers=workers,
+            seed=seed,
+            samples_path=samples_path,
+        )
+
+    def _get_flow_data(self, flow_file: str, flow_data: Dict | None) -> Dict:
+        """Hourly power flow, loaded from `flow_file` unless preloaded"""
+        if flow_data is None:
+            flow_data = load_hourly_flow_data(
+                data_dir=self.data_dir,
+                flow_file=flow_file,
+                gap_policy=self.session.gap_policy,
+                datetime_range=self.datetime_range,
+            )
+        return flow_data
+
+    def _get_emissions(self) -> Dict[str, pd.DataFrame]:
+        """Regional emissions of every emission type"""
+        emission_types = ["CO2e", "SOx", "NOx", "PM"]
+        return {
+            emission_type: getattr(self, f"{emission_type}_emissions")
+            for emission_type in emission_types
+        }
+
+    def _calculate_flow_balance(
+        self, power_generation: pd.DataFrame, flow_data: Dict
+    ) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+        """Move generation and emissions of all emission types along the flows"""
+        # Get the basic regional intensities, which the flows carry between regions
+        initial_intensities = self._calculate_basic_intensities(
+            power_generation, "regional"
+        )
+        return calculate_power_flow_balance(
+            pg=power_generation,
+            flow=flow_data,
+            intensities=initial_intensities,
+            emissions=self._get_emissions(),
+            missing=self.pg_data.missing_hours(),
+        )
+
+    def sweep_capacity_targets(
+        self,
+        unit_generation: List[pd.DataFrame],
+        fuel_type: List[str],
+        targets: np.ndarray,
+        flow_data: Dict | None = None,
+        aggregate: str = "mean",
+        chunk_size: int = 256,
+        dtype: np.dtype | str = np.float64,
+        out: np.ndarray | None = None,
+    ) -> ScenarioSweep:
+        """Calculate emission intensity for many capacity targets at once
+
+        Args:
+            unit_generation: Regional generation of each target fuel at 1 GW
+            fuel_type: List of target fuel types, in the order of the targets
+            targets: Capacity of each fuel type (GW), shape (scenarios, fuels)
+            flow_data: Hourly power flow; without it power flow is ignored
+            aggregate: 'hourly', 'mean' or 'weighted' (see sweep_capacity_scenarios)
+            chunk_size: Number of scenarios evaluated together
+            dtype: Data type of the result when `out` is not given
+            out: Array to write the result into, e.g. a memory-mapped file
+
+        Returns:
+            ScenarioSweep with the intensity of every scenario
+        """
+        emission_types = ["CO2e", "SOx", "NOx", "PM"]
+
+        return sweep_capacity_scenarios(
+            base_generation=get_selected_pg_data(
+                pg=self.pg_data, exclude_fuel=fuel_type
+            ),
+            unit_generation=unit_generation,
+            emissions={
+                emission_type: getattr(self, f"{emission_type}_emissions")
+                for emission_type in emission_types
+            },
+            targets=targets,
+            flow=flow_data,
+            aggregate=aggregate,
+            chunk_size=chunk_size,
+            dtype=dtype,
+            out=out,
+        )
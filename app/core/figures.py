@@ -0,0 +1,137 @@
+import concurrent.futures
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import matplotlib
+import pandas as pd
+from absl import logging
+
+from app.core.period import PeriodResult
+from app.core.pipeline import StageStore, data_digest, files_unchanged, written_files
+from app.module import create_figure_CF, create_figure_EI_total
+
+EI_TARGETS = ["CO2e_EI", "SOx_EI", "NOx_EI", "PM_EI"]
+
+
+@dataclass
+class FigureJob:
+    """One figure file and the call that draws it.
+
+    Attributes:
+        path: Output file of the figure
+        render: Figure function
+        kwargs: Arguments of `render`, including the data it plots
+    """
+
+    path: Path
+    render: Callable
+    kwargs: Dict[str, Any]
+
+
+def figure_jobs(
+    result_dir: Path,
+    data_period_list: List[str],
+    fuel_types: List[str],
+    limits: List,
+    results: List[PeriodResult],
+) -> List[FigureJob]:
+    """Figures of one run, drawn from the diurnal profiles of its periods.
+
+    Args:
+        result_dir: Directory of the outputs
+        data_period_list: Periods to plot
+        fuel_types: Target fuel types
+        limits: y-axis bounds of each emission intensity figure row
+        results: PeriodResult of each period
+
+    Returns:
+        FigureJob of each capacity factor figure and the emission intensity
+        figure
+    """
+    figure_dir = result_dir / "figure"
+
+    def profiles(target: str) -> Dict[str, pd.DataFrame]:
+        return {result.period: result.profiles[target] for result in results}
+
+    jobs = [
+        FigureJob(
+            path=figure_dir / f"{fuel_type}_region_capacity_factor.png",
+            render=create_figure_CF,
+            kwargs=dict(
+                result_dir=result_dir,
+                data_period_list=data_period_list,
+                fuel_type=fuel_type,
+                target="region_capacity_factor",
+                profiles=profiles(f"region_capacity_factor_{fuel_type}"),
+            ),
+        )
+        for fuel_type in fuel_types
+    ]
+    jobs.append(
+        FigureJob(
+            path=figure_dir / "total_EI.png",
+            render=create_figure_EI_total,
+            kwargs=dict(
+                result_dir=result_dir,
+                data_period_list=data_period_list,
+                targets=EI_TARGETS,
+                limits=limits,
+                profiles={target: profiles(target) for target in EI_TARGETS},
+            ),
+        )
+    )
+    return jobs
+
+
+def render_figure(job: FigureJob) -> Dict[str, str]:
+    """Draw one figure with the non-interactive Agg backend."""
+    matplotlib.use("Agg")
+    job.render(**job.kwargs)
+    return written_files([job.path])
+
+
+def render_figures(
+    jobs: List[FigureJob], store: StageStore, workers: int = 1
+) -> Dict[str, str]:
+    """Render the figures whose input data changed since the last render.
+
+    Every figure is a 'figures' stage artifact keyed by the hash of its input
+    data, so unchanged figures are skipped when the stage cache is enabled.
+    With `workers` > 1 the remaining figures render in separate processes.
+
+    Args:
+        jobs: Figures to render
+        store: Stage artifact cache
+        workers: Number of worker processes
+
+    Returns:
+        Content hash of every figure file
+    """
+    matplotlib.use("Agg")
+    artifacts = [
+        store.artifact(
+            "figures",
+            job.path.name,
+            compute=lambda job=job: render_figure(job),
+            params=[str(job.path), job.render.__name__, data_digest(job.kwargs)],
+            validate=files_unchanged,
+        )
+        for job in jobs
+    ]
+
+    pending = [
+        (job, artifact) for job, artifact in zip(jobs, artifacts) if not artifact.cached
+    ]
+    if workers > 1 and len(pending) > 1:
+        workers = min(workers, len(pending))
+        logging.info(f"Rendering {len(pending)} figures with {workers} worker processes.")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render_figure, job) for job, _ in pending]
+            for (_, artifact), future in zip(pending, futures):
+                artifact.provide(future.result())
+
+    files = {}
+    for artifact in artifacts:
+        files.update(artifact.value)
+    return files
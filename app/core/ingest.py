@@ -0,0 +1,194 @@
+import concurrent.futures
+import logging
+import logging.handlers
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from absl import logging as absl_logging
+
+from app import profiling
+from app.data import get_hourly_pg_cube, get_json_file, GenerationCube
+from app.module import transform_power_data
+
+
+@dataclass
+class PeriodData:
+    """Hourly inputs of one period.
+
+    Attributes:
+        pg_file: Power generation data file
+        flow_file: Power flow data file
+        pg_data: Hourly power generation of every unit
+        flow_data: Hourly power flow of every corridor
+    """
+
+    pg_file: str
+    flow_file: str
+    pg_data: GenerationCube
+    flow_data: Dict
+
+
+class _RecordBuffer(logging.handlers.QueueHandler):
+    """Keeps log records in memory, made picklable, for replay in the parent."""
+
+    def __init__(self):
+        super().__init__(queue=None)
+        self.records: List[logging.LogRecord] = []
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+def call_buffered(
+    function: Callable, profile: bool = False, trace_memory: bool = False, **kwargs
+) -> Tuple[Any, List[logging.LogRecord], List[profiling.StageRecord]]:
+    """Call `function` in a worker, capturing its log and profiling records.
+
+    Args:
+        function: Module-level function to call
+        profile: Whether profiling is enabled in the parent
+        trace_memory: Whether the parent traces memory
+        **kwargs: Arguments of `function`
+
+    Returns:
+        Tuple of the result, the log records and the stage records
+    """
+    buffer = _RecordBuffer()
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    root.handlers = [buffer]
+    if profile:
+        profiling.reset()
+        profiling.enable(trace_memory=trace_memory)
+    try:
+        return function(**kwargs), buffer.records, profiling.records()
+    finally:
+        root.handlers = handlers
+
+
+def replay_buffered(
+    records: List[logging.LogRecord], stage_records: List[profiling.StageRecord]
+) -> None:
+    """Replay the log and add the stage records captured by `call_buffered`."""
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+    profiling.extend(stage_records)
+
+
+def load_hourly_flow_data(
+    data_dir: Path,
+    flow_file: str,
+    gap_policy: str = "positional",
+    datetime_range: str | None = None,
+) -> Dict:
+    """Load a power flow file and average it to hourly corridor flows."""
+    return transform_power_data(
+        get_json_file(data_dir=data_dir, pg_file=flow_file),
+        gap_policy=gap_policy,
+        datetime_range=datetime_range,
+    )
+
+
+@profiling.profiled("core.load_period_data")
+def load_period_data(
+    data_dir: Path,
+    pg_file: str,
+    flow_file: str,
+    station_file: str,
+    datetime_range: str | None = None,
+    stream: bool = False,
+    cache_dir: str | None = None,
+    cache_max_bytes: int = 2 << 30,
+    gap_policy: str = "positional",
+) -> PeriodData:
+    """Load the hourly power generation and power flow of one period."""
+    pg_data = get_hourly_pg_cube(
+        data_dir=data_dir,
+        pg_file=pg_file,
+        station_file=station_file,
+        stream=stream,
+        cache_dir=cache_dir,
+        cache_max_bytes=cache_max_bytes,
+        gap_policy=gap_policy,
+        datetime_range=datetime_range,
+    )
+    flow_data = load_hourly_flow_data(
+        data_dir=data_dir,
+        flow_file=flow_file,
+        gap_policy=gap_policy,
+        datetime_range=datetime_range,
+    )
+    return PeriodData(
+        pg_file=pg_file, flow_file=flow_file, pg_data=pg_data, flow_data=flow_data
+    )
+
+
+@profiling.profiled("core.load_periods")
+def load_periods(
+    data_dir: Path,
+    pg_files: List[str],
+    flow_files: List[str],
+    station_file: str,
+    datetime_ranges: List[str | None],
+    workers: int = 1,
+    **kwargs,
+) -> List[PeriodData]:
+    """Load the hourly inputs of all periods, in parallel with `workers` > 1.
+
+    Every period file is parsed in its own worker process, which exits after
+    the file so the parser's peak memory is returned to the system. At most
+    `workers` files are parsed at the same time, and only the compact hourly
+    results are sent back, together with the workers' log records and, with
+    profiling enabled, their stage measurements.
+
+    Args:
+        data_dir: Data directory path
+        pg_files: Power generation data file of each period
+        flow_files: Power flow data file of each period
+        station_file: Station information file
+        datetime_ranges: Hourly grid of each period in format 'start|end'
+        workers: Number of worker processes
+        **kwargs: Options passed on to `load_period_data`
+
+    Returns:
+        PeriodData of each period, in the order of `pg_files`
+    """
+    jobs = [
+        dict(
+            data_dir=data_dir,
+            pg_file=pg_file,
+            flow_file=flow_file,
+            station_file=station_file,
+            datetime_range=datetime_range,
+            **kwargs,
+        )
+        for pg_file, flow_file, datetime_range in zip(
+            pg_files, flow_files, datetime_ranges
+        )
+    ]
+
+    if workers <= 1 or len(jobs) <= 1:
+        return [load_period_data(**job) for job in jobs]
+
+    workers = min(workers, len(jobs))
+    absl_logging.info(f"Loading {len(jobs)} periods with {workers} worker processes.")
+    periods = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, max_tasks_per_child=1
+    ) as executor:
+        futures = [
+            executor.submit(
+                call_buffered,
+                load_period_data,
+                profile=profiling.is_enabled(),
+                trace_memory=profiling.is_tracing_memory(),
+                **job,
+            )
+            for job in jobs
+        ]
+        for future in futures:
+            period_data, records, stage_records = future.result()
+            replay_buffered(records, stage_records)
+            periods.append(period_data)
+    return periods
@@ -0,0 +1,320 @@
+import json
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from absl import logging
+
+from app.data import (
+    RESULT_STORE_FILE,
+    ResultStore,
+    convert_csv_results,
+    file_digest,
+    make_cache_key,
+)
+
+SECONDS_PER_HOUR = 3600
+
+# English names accepted for the regions of the results
+REGION_ALIASES = {
+    "South": "南部",
+    "North": "北部",
+    "Center": "中部",
+    "East": "東部",
+    "Island": "離島",
+    "National": "全台",
+}
+
+
+class IntensityLookup:
+    def __init__(self, store: ResultStore):
+        """Hourly emission intensity by timestamp and region, without pandas.
+
+        Every period of the store is placed on one hourly timeline, so a
+        lookup is integer arithmetic on the timestamp and an array index.
+        A store with a single period is used through its memory map as is;
+        several periods are merged once, later periods winning where they
+        overlap.
+
+        Args:
+            store: Result store of the run
+        """
+        self.store = store
+        self.emission_types = list(store.emission_types)
+        self._emission_index = {name: i for i, name in enumerate(self.emission_types)}
+
+        periods = store.periods
+        timestamps = [
+            store.arrays[f"{period}/timestamps"].astype(np.int64) for period in periods
+        ]
+        self.regions: List[str] = []
+        for period in periods:
+            self.regions += [r for r in store.regions(period) if r not in self.regions]
+        self._region_index = {region: i for i, region in enumerate(self.regions)}
+        for alias, region in REGION_ALIASES.items():
+            if region in self._region_index:
+                self._region_index[alias] = self._region_index[region]
+
+        self._start = min(int(seconds[0]) for seconds in timestamps)
+        end = max(int(seconds[-1]) for seconds in timestamps)
+        self.n_hours = (end - self._start) // SECONDS_PER_HOUR + 1
+
+        single = len(periods) == 1 and len(timestamps[0]) == self.n_hours
+        if single:
+            self.values = store.arrays[f"{periods[0]}/intensity"]
+            return
+
+        # (emission types, hours, regions), NaN where no period has data
+        self.values = np.full(
+            (len(self.emission_types), self.n_hours, len(self.regions)), np.nan
+        )
+        for period, seconds in zip(periods, timestamps):
+            rows = (seconds - self._start) // SECONDS_PER_HOUR
+            columns = [self._region_index[r] for r in store.regions(period)]
+            self.values[:, rows[:, None], np.array(columns)[None, :]] = store.arrays[
+                f"{period}/intensity"
+            ]
+
+    @classmethod
+    def from_results(
+        cls, result_dir: str | Path, cache_dir: str | Path | None = None
+    ) -> "IntensityLookup":
+        """Lookup over a result directory.
+
+        Uses the result store of the directory, or builds one from its CSV
+        outputs, e.g. results/2024. The converted store is kept in
+        `cache_dir`, keyed by the content of the CSV files, or written into
+        `result_dir` without a cache directory.
+
+        Args:
+            result_dir: Result directory
+            cache_dir: Directory for stores converted from CSV outputs
+
+        Returns:
+            IntensityLookup of the results
+        """
+        result_dir = Path(result_dir)
+        store_file = result_dir / RESULT_STORE_FILE
+        if not store_file.exists():
+            if cache_dir is not None:
+                csv_files = sorted(result_dir.glob("*.csv"))
+                key = make_cache_key(
+                    "lookup", *(f"{f.name}:{file_digest(f)}" for f in csv_files)
+                )
+                store_file = Path(cache_dir) / f"{key}.eistore"
+            if not store_file.exists():
+                logging.info(f"Converting the CSV outputs of {result_dir}.")
+                convert_csv_results(result_dir, store_file)
+        return cls(ResultStore(store_file))
+
+    @property
+    def start(self) -> np.datetime64:
+        return np.datetime64(self._start, "s")
+
+    @property
+    def end(self) -> np.datetime64:
+        return np.datetime64(self._start + (self.n_hours - 1) * SECONDS_PER_HOUR, "s")
+
+    def rows(self, times: Iterable) -> Tuple[np.ndarray, np.ndarray]:
+        """Hour of the timeline holding each time, and whether it is covered.
+
+        Args:
+            times: ISO 8601 strings or datetime64 values in the local time of
+                the results
+
+        Returns:
+            Tuple of the row of each time and the mask of the times inside
+            the timeline
+        """
+        seconds = np.asarray(times, dtype="datetime64[s]").astype(np.int64)
+        rows = (seconds - self._start) // SECONDS_PER_HOUR
+        return rows, (rows >= 0) & (rows < self.n_hours)
+
+    def point(self, region: str, time, emission_type: str = "CO2e") -> float:
+        """Intensity (g/kWh) of one region in the hour holding `time`; NaN outside."""
+        return float(self.batch([region], [time], emission_type)[0])
+
+    def range(
+        self, region: str, start, end, emission_type: str = "CO2e"
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Hourly intensity of one region from `start` to `end`, both inclusive.
+
+        Returns:
+            Tuple of the hourly timestamps and the intensity (g/kWh) of each
+        """
+        (first, last), _ = self.rows([start, end])
+        first, last = max(first, 0), min(last, self.n_hours - 1)
+        column = self._column(region)
+        if first > last:
+            return np.array([], dtype="datetime64[s]"), np.array([])
+        values = self.values[self._emission(emission_type), first : last + 1, column]
+        hours = np.arange(first, last + 1) * SECONDS_PER_HOUR + self._start
+        return hours.astype("datetime64[s]"), np.array(values)
+
+    def batch(
+        self, regions: str | Iterable[str], times: Iterable, emission_type: str = "CO2e"
+    ) -> np.ndarray:
+        """Intensity (g/kWh) of many (region, time) pairs at once; NaN outside.
+
+        Args:
+            regions: Region of each lookup, or a single region for all of them
+            times: Time of each lookup
+
+        Returns:
+            Intensity of each lookup
+        """
+        rows, inside = self.rows(times)
+        regions = [regions] if isinstance(regions, str) else list(regions)
+        if len(regions) == 1:
+            regions = regions * len(rows)
+        if len(regions) != len(rows):
+            raise ValueError(f"Got {len(regions)} regions for {len(rows)} times.")
+        columns = np.array([self._column(region) for region in regions], dtype=np.intp)
+        rows = np.clip(rows, 0, self.n_hours - 1)
+        values = np.asarray(self.values[self._emission(emission_type), rows, columns])
+        return np.where(inside, values, np.nan)
+
+    def describe(self) -> Dict:
+        """Regions, emission types and time span of the lookup."""
+        return {
+            "regions": self.regions,
+            "emission_types": self.emission_types,
+            "start": str(self.start),
+            "end": str(self.end),
+            "hours": self.n_hours,
+        }
+
+    def _column(self, region: str) -> int:
+        try:
+            return self._region_index[region]
+        except KeyError:
+            raise KeyError(f"Unknown region {region}; choose from {self.regions}")
+
+    def _emission(self, emission_type: str) -> int:
+        try:
+            return self._emission_index[emission_type]
+        except KeyError:
+            raise KeyError(
+                f"Unknown emission type {emission_type}; choose from {self.emission_types}"
+            )
+
+
+def _json_value(value: float) -> float | None:
+    """Float for JSON, with null for NaN."""
+    return None if math.isnan(value) else value
+
+
+def _json_values(values: np.ndarray) -> List[float | None]:
+    return [_json_value(value) for value in values.tolist()]
+
+
+def _batch_request(body: bytes) -> Tuple[str | List[str], List, str]:
+    """Regions, times and emission type of a /batch request body.
+
+    Raises:
+        KeyError: If regions or times are missing
+        ValueError: If the body is not a JSON object of the documented shape
+    """
+    request = json.loads(body or b"{}")
+    if not isinstance(request, dict):
+        raise ValueError("The request body must be a JSON object.")
+    regions, times = request["regions"], request["times"]
+    emission_type = request.get("type", "CO2e")
+    if not isinstance(regions, str) and not (
+        isinstance(regions, list) and all(isinstance(r, str) for r in regions)
+    ):
+        raise ValueError("regions must be a region name or a list of region names.")
+    if not isinstance(times, list) or not all(isinstance(t, str) for t in times):
+        raise ValueError("times must be a list of ISO 8601 times.")
+    if not isinstance(emission_type, str):
+        raise ValueError("type must be an emission type name.")
+    return regions, times, emission_type
+
+
+def _decode_path(path: str) -> str:
+    """Request path with raw UTF-8 bytes decoded.
+
+    http.server decodes the request line as latin-1, so raw UTF-8 such as
+    'region=北部' arrives as mojibake; percent-encoded paths are ASCII and
+    pass through unchanged.
+    """
+    try:
+        return path.encode("latin-1").decode("utf-8")
+    except UnicodeError:
+        return path
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+    """JSON endpoints over the IntensityLookup of the server.
+
+    GET  /meta
+    GET  /point?region=北部&time=2024-07-01T18:00&type=CO2e
+    GET  /range?region=North&start=2024-07-01&end=2024-07-02&type=CO2e
+    POST /batch  {"type": "CO2e", "regions": [...] or "北部", "times": [...]}
+
+    Region names may be sent percent-encoded or as raw UTF-8.
+    """
+
+    server: "LookupServer"
+
+    def do_GET(self):
+        url = urlparse(_decode_path(self.path))
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        lookup = self.server.lookup
+        emission_type = query.get("type", "CO2e")
+        try:
+            if url.path == "/meta":
+                return self._send(200, lookup.describe())
+            if url.path == "/point":
+                value = lookup.point(query["region"], query["time"], emission_type)
+                return self._send(200, {"value": _json_value(value)})
+            if url.path == "/range":
+                times, values = lookup.range(
+                    query["region"], query["start"], query["end"], emission_type
+                )
+                return self._send(
+                    200, {"times": [str(t) for t in times], "values": _json_values(values)}
+                )
+        except (KeyError, ValueError) as e:
+            return self._send(400, {"error": e.args[0] if e.args else str(e)})
+        self._send(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/batch":
+            return self._send(404, {"error": f"Unknown path {self.path}"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            regions, times, emission_type = _batch_request(self.rfile.read(length))
+            values = self.server.lookup.batch(regions, times, emission_type)
+        except (KeyError, ValueError) as e:
+            return self._send(400, {"error": e.args[0] if e.args else str(e)})
+        self._send(200, {"values": _json_values(values)})
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def _send(self, status: int, body: Dict) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class LookupServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, lookup: IntensityLookup, host: str = "127.0.0.1", port: int = 8765):
+        """Local HTTP server answering intensity lookups.
+
+        Args:
+            lookup: Loaded intensity lookup
+            host: Interface to listen on
+            port: Port to listen on; 0 picks a free one
+        """
+        self.lookup = lookup
+        super().__init__((host, port), LookupHandler)
@@ -0,0 +1,500 @@
+import concurrent.futures
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+from absl import logging as absl_logging
+
+from app import profiling
+from app.core.emissions import EmissionCalculator
+from app.core.ingest import (
+    PeriodData,
+    call_buffered,
+    load_period_data,
+    replay_buffered,
+)
+from app.core.pipeline import (
+    Artifact,
+    StageEvent,
+    StageStore,
+    files_unchanged,
+    written_files,
+)
+from app.core.power import PowerGenerator
+from app.core.session import Session
+from app.data import EMISSION_FACTOR_FILES
+from app.module import diurnal_profiles
+
+# Uncertainty options that change how the draws run, not which draws are made;
+# samples_path is not one of them, as it decides where the draws are written.
+UNCERTAINTY_EXECUTION_OPTIONS = ("workers",)
+
+
+@dataclass
+class PeriodResult:
+    """Outputs of one period.
+
+    Attributes:
+        period: Name of the period
+        files: Content hash of each CSV file written for the period
+        intensities: Hourly emission intensity of each emission type
+        generation: Hourly generation of every region after power flow
+        emissions: Hourly emissions of every region after power flow, of each
+            emission type
+        capacity_factors: Hourly regional capacity factor of each fuel type
+        profiles: Diurnal profile of each result, keyed by the CSV file name
+            stem without the period
+        events: Stage cache events of the period
+    """
+
+    period: str
+    files: Dict[str, str] = field(default_factory=dict)
+    intensities: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    generation: pd.DataFrame | None = None
+    emissions: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    capacity_factors: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    profiles: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    events: List[StageEvent] = field(default_factory=list)
+
+
+def build_period_stages(
+    store: StageStore,
+    session: Session,
+    period: str,
+    pg_file: str,
+    flow_file: str,
+    datetime_range: str,
+    fuel_types: List[str],
+    capacity_targets: List[float],
+    result_dir: Path,
+    flow_scale: str = "regional",
+    uncertainty: Dict | None = None,
+) -> Dict[str, Artifact]:
+    """Declare the stage artifacts of one period.
+
+    Nothing is evaluated here; evaluating the 'outputs' artifact pulls in
+    only the upstream stages that miss the cache.
+
+    Args:
+        store: Stage artifact cache
+        session: Reference data and options of the run
+        period: Name of the period
+        pg_file: Power generation data file
+        flow_file: Power flow data file
+        datetime_range: Hourly grid of the period in format 'start|end'
+        fuel_types: Target fuel types
+        capacity_targets: Target capacity of each fuel type (GW)
+        result_dir: Directory of the CSV outputs
+        flow_scale: Power flow method ('regional' or 'tracing')
+        uncertainty: Arguments of `propagate_uncertainty`, e.g. n_samples,
+            percentiles and workers; adds the 'uncertainty' stage
+
+    Returns:
+        Artifact of each stage, with one 'capacity_factor/<fuel>' artifact per
+        profile fuel
+    """
+    reference_digests = session.file_digests(session.station_file, session.capacity_file)
+
+    source_digests = session.file_digests(pg_file, flow_file, session.station_file)
+    ingest = store.artifact(
+        "ingest",
+        period,
+        compute=lambda: source_digests,
+        params=source_digests,
+        persist=False,
+    )
+    hourly = store.artifact(
+        "hourly",
+        period,
+        compute=lambda: load_period_data(
+            data_dir=session.data_dir,
+            pg_file=pg_file,
+            flow_file=flow_file,
+            station_file=session.station_file,
+            datetime_range=datetime_range,
+            stream=session.stream,
+            cache_dir=session.cache_dir,
+            cache_max_bytes=session.cache_max_bytes,
+            gap_policy=session.gap_policy,
+        ),
+        params=[session.gap_policy, datetime_range],
+        upstream=[ingest],
+    )
+    stages = {"ingest": ingest, "hourly": hourly}
+
+    def capacity_factor_stage(fuel_type: str) -> Artifact:
+        return store.artifact(
+            "capacity_factor",
+            f"{period}/{fuel_type}",
+            compute=lambda: session.capacity_factors(
+                pg_file=pg_file,
+                fuel_type=fuel_type,
+                hourly_pg=hourly.value.pg_data,
+            ),
+            params=[fuel_type, *reference_digests],
+            upstream=[hourly],
+        )
+
+    capacity_factors = {}
+    for fuel_type in fuel_types:
+        profile_fuel = session.profile_fuel(fuel_type)
+        if profile_fuel not in capacity_factors:
+            capacity_factors[profile_fuel] = capacity_factor_stage(profile_fuel)
+            stages[f"capacity_factor/{profile_fuel}"] = capacity_factors[profile_fuel]
+
+    def estimate_fuel_generation(
+        power_generator: PowerGenerator, fuel_type: str, capacity_target: float
+    ):
+        return power_generator.estimate_target_power(
+            pg_file=pg_file,
+            fuel_type=fuel_type,
+            capacity_target=capacity_target,
+            datetime_range=datetime_range,
+            capacity_factors=capacity_factors[session.profile_fuel(fuel_type)].value,
+        )
+
+    def estimate_target_generation() -> pd.DataFrame:
+        power_generator = PowerGenerator(session)
+        pg_estimation_total = pd.DataFrame()
+
+        # Process each fuel type
+        for fuel_type, capacity_target in zip(fuel_types, capacity_targets):
+            # Estimate target power generation
+            pg_estimation, _, national_cf, capacity_percentage = (
+                estimate_fuel_generation(power_generator, fuel_type, capacity_target)
+            )
+
+            # Add to total power generation
+            pg_estimation_total = (
+                pg_estimation
+                if pg_estimation_total.empty
+                else pg_estimation_total.add(pg_estimation, fill_value=0)
+            )
+
+            absl_logging.info(f"Month={period}, Fuel={fuel_type}")
+            # need to check: the mean of regional cf and the national cf.
+            absl_logging.info(f"The avg of national capacity factor:{national_cf.mean()}.")
+            absl_logging.info(f"national power generation (kWh): {pg_estimation.sum().sum()}.")
+
+            # Todo:
+            # for displaying real result of offshore wind power
+
+            for region in capacity_percentage:
+                absl_logging.info(f"{region} capacity percentage: {capacity_percentage[region]}.")
+
+        return pg_estimation_total
+
+    stages["target_generation"] = target_generation = store.artifact(
+        "target_generation",
+        period,
+        compute=estimate_target_generation,
+        params=[*fuel_types, *capacity_targets, *reference_digests],
+        upstream=list(capacity_factors.values()),
+    )
+
+    stages["emissions"] = emissions = store.artifact(
+        "emissions",
+        period,
+        compute=lambda: EmissionCalculator(
+            session,
+            pg_file=pg_file,
+            datetime_range=datetime_range,
+            pg_data=hourly.value.pg_data,
+        ).emissions,
+        params=[
+            *session.file_digests(*EMISSION_FACTOR_FILES),
+            session.adjusted_emission_factor,
+        ],
+        upstream=[hourly],
+    )
+
+    def estimate_balance() -> Tuple[
+        pd.DataFrame, Dict[str, pd.DataFrame], Dict[str, pd.DataFrame]
+    ]:
+        # One power flow solve gives the balance and the intensities
+        generation, balance_emissions, emission_intensities = EmissionCalculator(
+            session,
+            pg_file=pg_file,
+            datetime_range=datetime_range,
+            pg_data=hourly.value.pg_data,
+            emissions=emissions.value,
+        ).estimate_emission_flow(
+            generation=target_generation.value,
+            fuel_type=fuel_types,
+            flow_file=flow_file,
+            scale=flow_scale,
+            flow_data=hourly.value.flow_data,
+        )
+        # Add datetime index
+        start_time, end_time = datetime_range.split("|")
+        datetime_index = pd.date_range(start=start_time, end=end_time, freq="h")
+        generation.index = datetime_index
+        for frame in [*balance_emissions.values(), *emission_intensities.values()]:
+            frame.index = datetime_index
+        return generation, balance_emissions, emission_intensities
+
+    stages["balance"] = balance = store.artifact(
+        "balance",
+        period,
+        compute=estimate_balance,
+        # 'intensities' keys apart the older values without the intensities
+        params=[flow_scale, *fuel_types, "intensities"],
+        upstream=[hourly, target_generation, emissions],
+    )
+
+    def estimate_intensity() -> Dict[str, pd.DataFrame]:
+        emission_intensities = balance.value[2]
+        absl_logging.info(f"\nEmission intensities for period {period}:")
+        for emission_type, intensity in emission_intensities.items():
+            absl_logging.info(f"\n{emission_type}:")
+            absl_logging.info(f"{intensity.mean()}")
+        absl_logging.info("\n---")
+        return emission_intensities
+
+    stages["flow"] = flow = store.artifact(
+        "flow",
+        period,
+        compute=estimate_intensity,
+        params=[flow_scale, *fuel_types],
+        upstream=[balance],
+    )
+
+    def write_outputs() -> Dict[str, str]:
+        files = []
+        # Output the regional capacity factors
+        for fuel_type in fuel_types:
+            region_cf, _ = capacity_factors[session.profile_fuel(fuel_type)].value
+            files.append(result_dir / f"region_capacity_factor_{fuel_type}_{period}.csv")
+            region_cf.to_csv(files[-1], index=False, encoding="utf-8-sig")
+        # Save each emission type to a separate CSV file
+        for emission_type, intensity in flow.value.items():
+            files.append(result_dir / f"{emission_type}_EI_{period}.csv")
+            intensity.to_csv(files[-1], encoding="utf-8-sig", index=True)
+        return written_files(files)
+
+    stages["outputs"] = store.artifact(
+        "outputs",
+        period,
+        compute=write_outputs,
+        params=[str(result_dir), *fuel_types],
+        upstream=[flow, *capacity_factors.values()],
+        validate=files_unchanged,
+    )
+
+    def results() -> Dict[str, pd.DataFrame]:
+        results = {}
+        for fuel_type in fuel_types:
+            region_cf, _ = capacity_factors[session.profile_fuel(fuel_type)].value
+            results[f"region_capacity_factor_{fuel_type}"] = region_cf
+        for emission_type, intensity in flow.value.items():
+            results[f"{emission_type}_EI"] = intensity
+        return results
+
+    stages["profiles"] = store.artifact(
+        "profiles",
+        period,
+        compute=lambda: diurnal_profiles(results()),
+        params=[*fuel_types],
+        upstream=[flow, *capacity_factors.values()],
+    )
+
+    if uncertainty is None:
+        return stages
+
+    def estimate_uncertainty() -> Dict[str, str]:
+        if flow_scale != "regional":
+            absl_logging.warning(
+                f"Uncertainty bands of {period} use regional power flow, not {flow_scale}."
+            )
+        power_generator = PowerGenerator(session)
+        fuel_generation = [
+            estimate_fuel_generation(power_generator, fuel_type, capacity_target)[0]
+            for fuel_type, capacity_target in zip(fuel_types, capacity_targets)
+        ]
+        bands = EmissionCalculator(
+            session,
+            pg_file=pg_file,
+            datetime_range=datetime_range,
+            pg_data=hourly.value.pg_data,
+            emissions=emissions.value,
+        ).estimate_emission_intensity_uncertainty(
+            fuel_generation=fuel_generation,
+            fuel_type=fuel_types,
+            flow_file=flow_file,
+            flow_data=hourly.value.flow_data,
+            **uncertainty,
+        )
+        # Kept apart from the intensity files read back by convert_csv_results
+        band_dir = result_dir / "uncertainty"
+        band_dir.mkdir(parents=True, exist_ok=True)
+        files = []
+        for emission_type in bands.emission_types:
+            for percentile in bands.percentiles:
+                files.append(band_dir / f"{emission_type}_EI_p{percentile:g}_{period}.csv")
+                bands.to_frame(emission_type, percentile).to_csv(
+                    files[-1], encoding="utf-8-sig", index=True
+                )
+        return written_files(files)
+
+    stages["uncertainty"] = store.artifact(
+        "uncertainty",
+        period,
+        compute=estimate_uncertainty,
+        params=[
+            str(result_dir),
+            *fuel_types,
+            *capacity_targets,
+            *sorted(
+                f"{key}={value}"
+                for key, value in uncertainty.items()
+                if key not in UNCERTAINTY_EXECUTION_OPTIONS
+            ),
+        ],
+        upstream=[hourly, emissions, *capacity_factors.values()],
+        validate=files_unchanged,
+    )
+    return stages
+
+
+def run_period(
+    session: Session,
+    period: str,
+    pg_file: str,
+    flow_file: str,
+    datetime_range: str,
+    fuel_types: List[str],
+    capacity_targets: List[float],
+    result_dir: Path,
+    flow_scale: str = "regional",
+    store: StageStore | None = None,
+    period_data: PeriodData | None = None,
+    csv_outputs: bool = True,
+    uncertainty: Dict | None = None,
+) -> PeriodResult:
+    """Estimate the target generation and emission intensity of one period.
+
+    Args:
+        session: Reference data and options of the run
+        period: Name of the period
+        pg_file: Power generation data file
+        flow_file: Power flow data file
+        datetime_range: Hourly grid of the period in format 'start|end'
+        fuel_types: Target fuel types
+        capacity_targets: Target capacity of each fuel type (GW)
+        result_dir: Directory of the CSV outputs
+        flow_scale: Power flow method ('regional' or 'tracing')
+        store: Stage artifact cache; None computes every stage
+        period_data: Preloaded hourly inputs of the period
+        csv_outputs: Write the results of the period as CSV files
+        uncertainty: Arguments of `propagate_uncertainty`; writes the
+            percentile bands of the emission intensities as CSV files in
+            `result_dir`/uncertainty
+
+    Returns:
+        PeriodResult of the period
+    """
+    with profiling.period(period), profiling.stage("core.run_period"):
+        absl_logging.info(f"start working on {period}:\n")
+        store = store or StageStore()
+        first_event = len(store.events)
+
+        stages = build_period_stages(
+            store,
+            session,
+            period=period,
+            pg_file=pg_file,
+            flow_file=flow_file,
+            datetime_range=datetime_range,
+            fuel_types=fuel_types,
+            capacity_targets=capacity_targets,
+            result_dir=result_dir,
+            flow_scale=flow_scale,
+            uncertainty=uncertainty,
+        )
+        stages["ingest"].value
+        if period_data is not None:
+            stages["hourly"].provide(period_data)
+
+        files = stages["outputs"].value if csv_outputs else {}
+        if uncertainty is not None:
+            files = {**files, **stages["uncertainty"].value}
+
+        return PeriodResult(
+            period=period,
+            files=files,
+            intensities=stages["flow"].value,
+            generation=stages["balance"].value[0],
+            emissions=stages["balance"].value[1],
+            capacity_factors={
+                fuel_type: stages[
+                    f"capacity_factor/{session.profile_fuel(fuel_type)}"
+                ].value[0]
+                for fuel_type in fuel_types
+            },
+            profiles=stages["profiles"].value,
+            events=store.events[first_event:],
+        )
+
+
+def needs_ingest(
+    store: StageStore | None = None,
+    period_data: PeriodData | None = None,
+    csv_outputs: bool = True,
+    **job,
+) -> bool:
+    """Whether running a period would parse its input files.
+
+    Takes the arguments of `run_period`. Without a cache every period parses
+    its files; with one, only periods whose hourly inputs miss the cache and
+    whose results (intensities and capacity factors) miss it too do.
+    """
+    if period_data is not None:
+        return False
+    stages = build_period_stages(store or StageStore(), **job)
+    results = [
+        artifact
+        for name, artifact in stages.items()
+        if name in ("flow", "balance", "uncertainty")
+        or name.startswith("capacity_factor/")
+    ]
+    return not (stages["hourly"].cached or all(artifact.cached for artifact in results))
+
+
+def run_periods(jobs: List[Dict], workers: int = 1) -> List[PeriodResult]:
+    """Run independent periods, in parallel with `workers` > 1.
+
+    Every period runs in its own worker process. Worker log records are
+    buffered and replayed in period order once the period finishes, so the
+    log reads the same as a serial run; with profiling enabled, the workers'
+    stage measurements are collected the same way.
+
+    Args:
+        jobs: Arguments of `run_period` for each period
+        workers: Number of worker processes
+
+    Returns:
+        PeriodResult of each period, in the order of `jobs`
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [run_period(**job) for job in jobs]
+
+    workers = min(workers, len(jobs))
+    absl_logging.info(f"Running {len(jobs)} periods with {workers} worker processes.")
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                call_buffered,
+                run_period,
+                profile=profiling.is_enabled(),
+                trace_memory=profiling.is_tracing_memory(),
+                **job,
+            )
+            for job in jobs
+        ]
+        for future in futures:
+            result, records, stage_records = future.result()
+            replay_buffered(records, stage_records)
+            results.append(result)
+    return results
@@ -0,0 +1,257 @@
+import hashlib
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List
+
+import pandas as pd
+from absl import logging
+
+from app import profiling
+from app.data import (
+    file_digest,
+    make_cache_key,
+    has_cached_entry,
+    load_cached_artifact,
+    save_cached_artifact,
+)
+
+# Stages of one run, in dependency order
+STAGES = (
+    "ingest",
+    "hourly",
+    "capacity_factor",
+    "target_generation",
+    "emissions",
+    "balance",
+    "flow",
+    "outputs",
+    "profiles",
+    "uncertainty",
+    "store",
+    "figures",
+)
+
+
+@dataclass
+class StageEvent:
+    """How one stage artifact was obtained.
+
+    Attributes:
+        stage: Stage name
+        label: Artifact label, e.g. the period
+        status: 'hit' (loaded from the cache), 'miss' (computed) or 'source'
+            (input files fingerprinted)
+        seconds: Wall time spent on the artifact, excluding its inputs
+    """
+
+    stage: str
+    label: str
+    status: str
+    seconds: float
+
+
+class Artifact:
+    """Lazily evaluated output of one stage.
+
+    The key is derived from the stage parameters and the keys of the
+    upstream artifacts only, so it is known without evaluating anything.
+    The value is loaded from the cache on a hit and computed on a miss; the
+    upstream values are evaluated only when `compute` asks for them.
+    """
+
+    def __init__(
+        self,
+        store: "StageStore",
+        stage: str,
+        label: str,
+        key: str,
+        compute: Callable[[], Any],
+        validate: Callable[[Any], bool] | None = None,
+        persist: bool = True,
+    ):
+        self.store = store
+        self.stage = stage
+        self.label = label
+        self.key = key
+        self.compute = compute
+        self.validate = validate
+        self.persist = persist
+        self._evaluated = False
+        self._value = None
+
+    @property
+    def cached(self) -> bool:
+        """Whether the cache holds the artifact, without loading it"""
+        return self.persist and self.store.has(self.key)
+
+    @property
+    def value(self) -> Any:
+        if not self._evaluated:
+            self.provide(None, compute=True)
+        return self._value
+
+    def provide(self, value: Any, compute: bool = False) -> None:
+        """Set the value of the artifact, from the cache when possible.
+
+        Args:
+            value: Value computed elsewhere, e.g. preloaded by a worker pool
+            compute: Call `compute` instead of using `value` on a miss
+        """
+        if self._evaluated:
+            return
+        start = time.perf_counter()
+        # Time spent on upstream artifacts is attributed to their own stages.
+        self.store._upstream_seconds.append(0.0)
+        with profiling.stage(f"pipeline.{self.stage}"):
+            if not self.persist:
+                self._value = self.compute() if compute else value
+                status = "source"
+            else:
+                found, cached = self.store.load(self.key)
+                if found and (self.validate is None or self.validate(cached)):
+                    self._value = cached
+                    status = "hit"
+                else:
+                    self._value = self.compute() if compute else value
+                    self.store.save(self.key, self._value)
+                    status = "miss"
+            profiling.count(f"cache_{status}", 1)
+        self._evaluated = True
+
+        elapsed = time.perf_counter() - start
+        upstream_seconds = self.store._upstream_seconds.pop()
+        if self.store._upstream_seconds:
+            self.store._upstream_seconds[-1] += elapsed
+        self.store.events.append(
+            StageEvent(
+                stage=self.stage,
+                label=self.label,
+                status=status,
+                seconds=elapsed - upstream_seconds,
+            )
+        )
+
+
+class StageStore:
+    def __init__(self, cache_dir: str | None = None, max_bytes: int = 2 << 30):
+        """Cache of stage artifacts, sharing the directory of the hourly cache
+
+        Args:
+            cache_dir: Cache directory; None computes every stage
+            max_bytes: Size limit of the cache directory
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.events: List[StageEvent] = []
+        self._upstream_seconds: List[float] = []
+
+    def artifact(
+        self,
+        stage: str,
+        label: str,
+        compute: Callable[[], Any],
+        params: Iterable[Any] = (),
+        upstream: Iterable[Artifact] = (),
+        validate: Callable[[Any], bool] | None = None,
+        persist: bool = True,
+    ) -> Artifact:
+        """Declare the artifact of a stage.
+
+        Args:
+            stage: Stage name, one of STAGES
+            label: Artifact label, e.g. the period
+            compute: Function computing the value on a miss
+            params: Inputs and flags the stage depends on
+            upstream: Artifacts the stage depends on
+            validate: Check of a cached value, e.g. that written files still
+                match; a failed check counts as a miss
+            persist: Whether to cache the value
+
+        Returns:
+            Artifact of the stage
+        """
+        if stage not in STAGES:
+            raise ValueError(f"stage must be one of {STAGES}, got {stage}")
+        key = make_cache_key(
+            "stage", stage, *params, *(artifact.key for artifact in upstream)
+        )
+        return Artifact(
+            self,
+            stage=stage,
+            label=label,
+            key=key,
+            compute=compute,
+            validate=validate,
+            persist=persist,
+        )
+
+    def has(self, key: str) -> bool:
+        return self.cache_dir is not None and has_cached_entry(self.cache_dir, key)
+
+    def load(self, key: str):
+        if self.cache_dir is None:
+            return False, None
+        return load_cached_artifact(self.cache_dir, key)
+
+    def save(self, key: str, value: Any) -> None:
+        if self.cache_dir is not None:
+            save_cached_artifact(self.cache_dir, key, value, max_bytes=self.max_bytes)
+
+
+def data_digest(value: Any) -> str:
+    """Content hash of in-memory inputs: nested dicts, lists, frames and scalars."""
+    digest = hashlib.blake2b(digest_size=20)
+
+    def update(value: Any) -> None:
+        if isinstance(value, dict):
+            for key in sorted(value, key=str):
+                digest.update(f"\0key:{key}".encode())
+                update(value[key])
+        elif isinstance(value, (list, tuple)):
+            digest.update(f"\0list:{len(value)}".encode())
+            for item in value:
+                update(item)
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            digest.update(f"\0frame:{list(getattr(value, 'columns', []))}".encode())
+            digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        else:
+            digest.update(f"\0{value!r}".encode())
+
+    update(value)
+    return digest.hexdigest()
+
+
+def written_files(paths: Iterable[Path]) -> Dict[str, str]:
+    """Content hash of each written file, the value of the output stages."""
+    return {str(path): file_digest(path) for path in paths}
+
+
+def files_unchanged(files: Dict[str, str]) -> bool:
+    """Whether the files recorded by an output stage still hold that content."""
+    try:
+        return all(file_digest(path) == digest for path, digest in files.items())
+    except OSError:
+        return False
+
+
+def report_stages(events: List[StageEvent]) -> None:
+    """Log the cache hits and misses of every stage."""
+    counts = Counter((event.stage, event.status) for event in events)
+    seconds = Counter()
+    for event in events:
+        seconds[event.stage] += event.seconds
+
+    logging.info("Stage cache report:")
+    for stage in STAGES:
+        hits, misses = counts[(stage, "hit")], counts[(stage, "miss")]
+        sources = counts[(stage, "source")]
+        if not hits + misses + sources:
+            continue
+        if sources:
+            logging.info(f"  {stage:<18} {sources} fingerprinted")
+            continue
+        logging.info(
+            f"  {stage:<18} {hits} hit, {misses} miss ({seconds[stage]:.2f} s)"
+        )
@@ -1,41 +1,37 @@
-from typing import Dict, List, Tuple
+from typing import Tuple
 import pandas as pd
-from pathlib import Path
 
-from app.data import (
-    get_json_file,
-    get_station_info,
-    get_capacity_info,
-    get_hourly_pg_data,
-)
+from app.data import GenerationCube
 
 from app.module import (
-    calculate_capacity_factor,
     calculate_capacity_percentage,
     calculate_pg_with_cf,
 )
+from app.core.session import Session
 
 
 class PowerGenerator:
-    def __init__(self, data_dir: Path):
-        self.data_dir = data_dir
+    def __init__(self, session: Session):
+        self.session = session
 
     def estimate_target_power(
         self,
         pg_file: str,
-        station_file: str,
-        capacity_file: str,
         fuel_type: str,
         capacity_target: float,
+        datetime_range: str | None = None,
+        hourly_pg_data: GenerationCube | None = None,
+        capacity_factors: Tuple[pd.DataFrame, pd.Series] | None = None,
     ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]:
         """Estimate target power generation
 
         Args:
             pg_file: Power generation data file
-            station_file: Power plant information file
-            capacity_file: Capacity information file
             fuel_type: Type of fuel
             capacity_target: Target capacity
+            datetime_range: Hourly grid of the period in format 'start|end'
+            hourly_pg_data: Preloaded hourly power generation of the period
+            capacity_factors: Precomputed regional and national capacity factors
 
         Returns:
             Tuple containing:
@@ -44,38 +40,23 @@ class PowerGenerator:
             - National capacity factor
             - Capacity percentage by region
         """
-        hourly_pg_data = get_hourly_pg_data(
-            data_dir=self.data_dir,
-            pg_file=pg_file,
-            station_file=station_file,
-        )
-
-        station_info = get_station_info(
-            data_dir=self.data_dir, station_file=station_file
-        )
-
-        capacity_info = get_capacity_info(
-            data_dir=self.data_dir, capacity_file=capacity_file, fuel_type=fuel_type
-        )
+        fuel_type = self.session.profile_fuel(fuel_type)
 
-        # Calculate regional capacity factors
-        region_capacity_factor = calculate_capacity_factor(
-            hourly_pg=hourly_pg_data,
-            capacity_data=capacity_info,
-            fuel_type=fuel_type,
-            scale="regional",
-        )
-
-        national_capacity_factor = calculate_capacity_factor(
-            hourly_pg=hourly_pg_data,
-            capacity_data=capacity_info,
-            fuel_type=fuel_type,
-            scale="national",
-        )
+        # Calculate regional and national capacity factors, shared across calls
+        if capacity_factors is None:
+            capacity_factors = self.session.capacity_factors(
+                pg_file=pg_file,
+                fuel_type=fuel_type,
+                hourly_pg=hourly_pg_data,
+                datetime_range=datetime_range,
+            )
+        region_capacity_factor, national_capacity_factor = capacity_factors
 
         # Calculate capacity percentage by region
         capacity_percentage = calculate_capacity_percentage(
-            capacity_data=capacity_info, station_data=station_info, fuel_type=fuel_type
+            capacity_data=self.session.capacity_info(fuel_type),
+            station_data=self.session.station_info,
+            fuel_type=fuel_type,
         )
 
         # Estimate power generation by region
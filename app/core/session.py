@@ -0,0 +1,138 @@
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from app.data import (
+    file_digest,
+    get_station_info,
+    get_capacity_table,
+    get_emission_factor_table,
+    get_hourly_pg_cube,
+    GenerationCube,
+)
+from app.module import calculate_capacity_factors
+
+# Target fuels estimated from the generation profile of another fuel, since
+# offshore wind has no separate record in the power generation data.
+FUEL_PROFILES = {"離岸風電": "陸域風電"}
+
+
+class Session:
+    def __init__(
+        self,
+        data_dir: Path,
+        station_file: str,
+        capacity_file: str,
+        stream: bool = False,
+        cache_dir: str | None = None,
+        cache_max_bytes: int = 2 << 30,
+        gap_policy: str = "positional",
+        adjusted_emission_factor: bool = False,
+    ):
+        """Reference data and options shared by every period of one run
+
+        The station registry, the capacity table and the emission factor table
+        are loaded once, and capacity factors are memoized per period file
+        and fuel type.
+
+        Args:
+            data_dir: Data directory path
+            station_file: Station information file
+            capacity_file: Capacity information file
+            stream: Whether to stream the power generation records
+            cache_dir: Directory of the on-disk hourly generation cache
+            cache_max_bytes: Size limit of the cache directory
+            gap_policy: Hourly averaging policy of the 10-minute records
+            adjusted_emission_factor: Use the adjusted GHG emission factor
+        """
+        self.data_dir = data_dir
+        self.station_file = station_file
+        self.capacity_file = capacity_file
+        self.stream = stream
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.gap_policy = gap_policy
+        self.adjusted_emission_factor = adjusted_emission_factor
+        self._capacity_factors: Dict[Tuple[str, str], Tuple[pd.DataFrame, pd.Series]] = {}
+
+    @staticmethod
+    def profile_fuel(fuel_type: str) -> str:
+        """Fuel type whose generation profile and capacity represent `fuel_type`"""
+        return FUEL_PROFILES.get(fuel_type, fuel_type)
+
+    @cached_property
+    def station_info(self) -> Dict[str, Tuple[str, str]]:
+        """Region and fuel type of every station"""
+        return get_station_info(data_dir=self.data_dir, station_file=self.station_file)
+
+    @cached_property
+    def capacity_table(self) -> Dict[str, Dict[str, float]]:
+        """Installed capacity (kW) of every station, grouped by fuel type"""
+        return get_capacity_table(
+            data_dir=self.data_dir, capacity_file=self.capacity_file
+        )
+
+    @cached_property
+    def emission_factor_table(self) -> pd.DataFrame:
+        """Air pollutant and GHG emission factors of every unit"""
+        return get_emission_factor_table(
+            str(self.data_dir), adjusted=self.adjusted_emission_factor
+        )
+
+    def file_digests(self, *files: str) -> List[str]:
+        """Content hash of each data file, 'missing' for absent files"""
+        return [
+            file_digest(path) if path.exists() else "missing"
+            for path in (Path(self.data_dir, file) for file in files)
+        ]
+
+    def capacity_info(self, fuel_type: str) -> Dict[str, float]:
+        """Installed capacity (kW) of the stations of one fuel type"""
+        return self.capacity_table.get(self.profile_fuel(fuel_type), {})
+
+    def hourly_pg(
+        self, pg_file: str, datetime_range: str | None = None
+    ) -> GenerationCube:
+        """Hourly power generation of every unit in one period file"""
+        return get_hourly_pg_cube(
+            data_dir=self.data_dir,
+            pg_file=pg_file,
+            station_file=self.station_file,
+            stream=self.stream,
+            cache_dir=self.cache_dir,
+            cache_max_bytes=self.cache_max_bytes,
+            gap_policy=self.gap_policy,
+            datetime_range=datetime_range,
+        )
+
+    def capacity_factors(
+        self,
+        pg_file: str,
+        fuel_type: str,
+        hourly_pg: GenerationCube | None = None,
+        datetime_range: str | None = None,
+    ) -> Tuple[pd.DataFrame, pd.Series]:
+        """Regional and national capacity factors, memoized per period and fuel
+
+        Args:
+            pg_file: Power generation data file
+            fuel_type: Type of fuel
+            hourly_pg: Preloaded hourly power generation of the period
+            datetime_range: Hourly grid of the period in format 'start|end'
+
+        Returns:
+            Tuple of the regional and the national capacity factors
+        """
+        fuel_type = self.profile_fuel(fuel_type)
+        key = (pg_file, fuel_type)
+        if key not in self._capacity_factors:
+            if hourly_pg is None:
+                hourly_pg = self.hourly_pg(pg_file, datetime_range=datetime_range)
+            self._capacity_factors[key] = calculate_capacity_factors(
+                hourly_pg=hourly_pg,
+                capacity_data=self.capacity_info(fuel_type),
+                fuel_type=fuel_type,
+            )
+        return self._capacity_factors[key]
@@ -1,18 +1,54 @@
 from app.data.base import (
     get_json_file,
+    iter_json_records,
     get_station_info,
     get_capacity_info,
+    get_capacity_table,
     process_power_generation_data,
+    accumulate_power_generation_records,
     compute_hourly_data
 )
 
 from app.data.pg import (
     get_hourly_pg_data,
+    get_hourly_pg_cube,
     get_selected_pg_data
 )
 
+from app.data.cube import (
+    GenerationCube,
+)
+
+from app.data.cache import (
+    file_digest,
+    make_cache_key,
+    load_cached_cube,
+    save_cached_cube,
+    has_cached_entry,
+    load_cached_artifact,
+    save_cached_artifact,
+    evict_cache,
+)
+
+from app.data.results import (
+    write_array_file,
+    read_array_file,
+    write_result_store,
+    convert_csv_results,
+    ResultStore,
+    RESULT_STORE_FILE,
+)
+
 from app.data.ape import (
     get_ap_emission_factor,
+    get_ghg_emission_factor,
+    get_ghg_emission_shares,
+    get_emission_factor_table,
     get_emissions_by_region,
-    
+    get_regional_emissions,
+    build_emission_factor_matrix,
+    EMISSION_LABELS,
+    EMISSION_FACTOR_FILES,
+    EMISSION_FACTORS,
+    GWP,
 )
\ No newline at end of file
@@ -1,15 +1,99 @@
 import json
 import os
 import logging
+import functools
 import numpy as np
 import pandas as pd
 from typing import List, Dict, Tuple
 from collections import defaultdict
 from pathlib import Path
 
+from app import profiling
+from app.data.cube import GenerationCube
+
+EMISSION_LABELS: Dict[str, str] = {
+    "CO2e": "CO2e (g/kWh)",
+    "SOx": "SOx (g/kWh)",
+    "NOx": "NOx (g/kWh)",
+    "PM": "PM (g/kWh)",
+}
+
+# CSV files and columns of the air pollutant emission factors
+AP_EMISSION_CSV_FILES: Dict[str, List[str]] = {
+    "pg.csv": ["能源別", "電廠名稱", "淨發電量(度)"],
+    "AirpollutantEmission.csv": [
+        "硫氧化物排放量(kg)",
+        "氮氧化物排放量(kg)",
+        "粒狀污染物排放量(kg)",
+    ],
+}
+
+# Every file the emission factor table is built from
+EMISSION_FACTOR_FILES: List[str] = [
+    *AP_EMISSION_CSV_FILES,
+    "generation_info.csv",
+    "emission_reference.csv",
+]
+
+# IPCC default emission factors (kg/TJ) by fuel type
+EMISSION_FACTORS: Dict[str, Dict[str, float]] = {
+    "carbon_dioxide": {
+        "Coal": 95237.5,
+        "Gas": 56100,
+        "Diesel": 74100,
+        "Oil": 77400,
+    },
+    "methane": {
+        "Coal": 1.0,
+        "Gas": 1.0,
+        "Diesel": 3.0,
+        "Oil": 3.0,
+    },
+    "nitrous_oxide": {
+        "Coal": 1.5,
+        "Gas": 0.1,
+        "Diesel": 0.6,
+        "Oil": 0.6,
+    },
+}
+
+# Global warming potentials
+GWP: Dict[str, float] = {
+    "carbon_dioxide": 1.0,
+    "methane": 25.0,
+    "nitrous_oxide": 298.0,
+}
+
+# Heat value conversion factor (J to PJ)
+HEAT_CONVERSION_FACTOR = 4.1868 * (10**-9)
+
+# Greenhouse gases and their emission columns in the generation info
+GHG_EMISSION_COLUMNS: List[Tuple[str, str]] = [
+    ("carbon_dioxide", "Carbon Dioxide Emissions"),
+    ("methane", "Methane Emissions"),
+    ("nitrous_oxide", "Nitrous Oxide Emissions"),
+]
+
+
+@functools.lru_cache(maxsize=None)
+@profiling.profiled("data.get_emission_factor_table")
+def get_emission_factor_table(data_dir: str, adjusted: bool = False) -> pd.DataFrame:
+    """Emission factor table of a data directory, built once and shared.
+
+    Args:
+        data_dir: Path to the data directory
+        adjusted: Use the adjusted instead of the basic GHG emission factor
+
+    Returns:
+        DataFrame of emission factors indexed by plant name; treat as read-only
+    """
+    return get_ap_emission_factor(
+        str(data_dir), AP_EMISSION_CSV_FILES, adjusted=adjusted
+    )
+
 
 def get_ap_emission_factor(
-    data_dir: str, csv_files: Dict[str, List[str]]
+    data_dir: str, csv_files: Dict[str, List[str]], adjusted: bool = False
 ) -> pd.DataFrame:
 
     dfs: List[pd.DataFrame] = []
@@ -43,60 +127,81 @@ def get_ap_emission_factor(
         "淨發電量(度)"
     ].astype(float)
 
-    basic_emission_factors = get_ghg_emission_factor(data_dir, "generation_info.csv")
+    basic_emission_factors = get_ghg_emission_factor(
+        data_dir, "generation_info.csv", adjusted=adjusted
+    )
 
     df.set_index("電廠名稱", inplace=True)
     df = df.join(basic_emission_factors, how="left")
 
-    df["CO2e (g/kWh)"] = df["Basic Emission Factor"].astype(float).mul(1000)
+    ghg_factor = "adjusted Emission Factor" if adjusted else "Basic Emission Factor"
+    df["CO2e (g/kWh)"] = df[ghg_factor].astype(float).mul(1000)
 
     return df
 
 
-def get_ghg_emission_factor(data_dir: str, generation_info: str) -> pd.DataFrame:
+def get_ghg_emission_factor(
+    data_dir: str, generation_info: str, adjusted: bool = False
+) -> pd.DataFrame:
     """
     Calculate greenhouse gas emission factors called by "get_ap_emission_factor"
 
     Args:
         data_dir: Path to the data directory
         generation_info: Emission data filename
+        adjusted: Also return the emission factor adjusted to the reference
+            emissions in "emission_reference.csv"
 
     Returns:
         DataFrame: DataFrame containing the emission factors
     """
 
-    EMISSION_FACTORS = {
-        "carbon_dioxide": {
-            "Coal": 95237.5,
-            "Gas": 56100,
-            "Diesel": 74100,
-            "Oil": 77400,
-        },
-        "methane": {
-            "Coal": 1.0,
-            "Gas": 1.0,
-            "Diesel": 3.0,
-            "Oil": 3.0,
-        },
-        "nitrous_oxide": {
-            "Coal": 1.5,
-            "Gas": 0.1,
-            "Diesel": 0.6,
-            "Oil": 0.6,
-        },
-    }
+    df = _get_ghg_emissions(data_dir, generation_info)
 
-    GWP = {
-        "carbon_dioxide": 1.0,
-        "methane": 25.0,
-        "nitrous_oxide": 298.0,
-    }
+    # Calculate emission factor (kg/kWh)
+    df["Basic Emission Factor"] = (
+        df["Total GHG Emissions"] / df["Net Electricity Generation"]
+    )
 
-    emissions_data = [
-        ("carbon_dioxide", "Carbon Dioxide Emissions"),
-        ("methane", "Methane Emissions"),
-        ("nitrous_oxide", "Nitrous Oxide Emissions"),
-    ]
+    if not adjusted:
+        result_df = df[["Generator", "Basic Emission Factor"]]
+        result_df.set_index("Generator", inplace=True)
+        return result_df
+
+    # --------optional: adjusted emission factor----------------------
+
+    # To align with the paper's methods, it is not used by default.
+    plant_emissions = df.groupby("Plant")["Total GHG Emissions"].sum().reset_index()
+    plant_emissions.columns = ["Plant", "Total GHG Emissions"]
+
+    reference_path = Path(data_dir, "emission_reference.csv")
+    reference_df = pd.read_csv(reference_path)
+
+    plant_emissions = plant_emissions.merge(
+        reference_df[["Plant", "Reference Emission (kg)"]], on="Plant", how="left"
+    )
+    plant_emissions["Emission Ratio"] = (
+        plant_emissions["Reference Emission (kg)"]
+        / plant_emissions["Total GHG Emissions"]
+    ).fillna(1)
+
+    ratio_dict = dict(zip(plant_emissions["Plant"], plant_emissions["Emission Ratio"]))
+
+    df["adjusted Emission Factor"] = df["Basic Emission Factor"] * df["Plant"].map(
+        ratio_dict
+    ).fillna(1)
+
+    # ----------End: adjusted emission factor--------------------------
+
+    result_df = df[["Generator", "Basic Emission Factor", "adjusted Emission Factor"]]
+    result_df.set_index("Generator", inplace=True)
+
+    return result_df
+
+
+def _get_ghg_emissions(data_dir: str, generation_info: str) -> pd.DataFrame:
+    """Generation info with the emissions (kg) of every greenhouse gas and
+    their total in CO2 equivalent"""
 
     numeric_columns = [
         "Gross Electricity Generation",
@@ -104,9 +209,6 @@ def get_ghg_emission_factor(data_dir: str, generation_info: str) -> pd.DataFrame
         "Net Electricity Generation",
     ]
 
-    # Heat value conversion factor (J to PJ)
-    HEAT_CONVERSION_FACTOR = 4.1868 * (10**-9)
-
     file_path = Path(data_dir, generation_info)
     df = pd.read_csv(file_path)
 
@@ -120,70 +222,52 @@ def get_ghg_emission_factor(data_dir: str, generation_info: str) -> pd.DataFrame
         * HEAT_CONVERSION_FACTOR
     )
 
-    for emission_type, column_name in emissions_data:
-        # Create emission factor mapping
-        factors = pd.Series(EMISSION_FACTORS[emission_type])
-
-        # Calculate emissions
-        df[column_name] = df.apply(
-            lambda row: row["Power Generation Heat"] * factors.get(row["Type"], 0),
-            axis=1,
-        )
+    for emission_type, column_name in GHG_EMISSION_COLUMNS:
+        # Emission factor of each generator's fuel type, 0 for unknown types
+        factors = df["Type"].map(EMISSION_FACTORS[emission_type]).fillna(0)
+        df[column_name] = df["Power Generation Heat"] * factors
 
     # Calculate total greenhouse gas emissions (CO2 equivalent)
     df["Total GHG Emissions"] = sum(
-        df[col] * GWP[emission_type]
-        for emission_type, col in zip(
-            ["carbon_dioxide", "methane", "nitrous_oxide"],
-            [
-                "Carbon Dioxide Emissions",
-                "Methane Emissions",
-                "Nitrous Oxide Emissions",
-            ],
-        )
-    )
-
-    # Calculate emission factor (kg/kWh)
-    df["Basic Emission Factor"] = (
-        df["Total GHG Emissions"] / df["Net Electricity Generation"]
-    )
-
-    # --------optional: adjusted emission factor----------------------
-
-    # Just demonstrate how to calculate the adjusted emission factor.
-    # To align with the paper's methods, we don't use it.
-    plant_emissions = df.groupby("Plant")["Total GHG Emissions"].sum().reset_index()
-    plant_emissions.columns = ["Plant", "Total GHG Emissions"]
-
-    reference_path = Path(data_dir, "emission_reference.csv")
-    reference_df = pd.read_csv(reference_path)
-
-    plant_emissions = plant_emissions.merge(
-        reference_df[["Plant", "Reference Emission (kg)"]], on="Plant", how="left"
+        df[col] * GWP[emission_type] for emission_type, col in GHG_EMISSION_COLUMNS
     )
-    plant_emissions["Emission Ratio"] = (
-        plant_emissions["Reference Emission (kg)"]
-        / plant_emissions["Total GHG Emissions"]
-    ).fillna(1)
+    return df
 
-    ratio_dict = dict(zip(plant_emissions["Plant"], plant_emissions["Emission Ratio"]))
 
-    df["adjusted Emission Factor"] = df.apply(
-        lambda row: row["Basic Emission Factor"] * ratio_dict.get(row["Plant"], 1),
-        axis=1,
-    )
+def get_ghg_emission_shares(
+    data_dir: str, generation_info: str = "generation_info.csv"
+) -> pd.DataFrame:
+    """
+    Share of every greenhouse gas in the CO2e emission factor of each generator
 
-    # ----------End: adjusted emission factor--------------------------
+    The CO2e factor is linear in the IPCC factors and the GWPs, so scaling
+    the factor of one gas scales its share of the CO2e emissions. The
+    adjustment to the reference emissions applies to all gases alike and
+    leaves the shares unchanged.
 
-    result_df = df[["Generator", "Basic Emission Factor"]]
-    result_df.set_index("Generator", inplace=True)
+    Args:
+        data_dir: Path to the data directory
+        generation_info: Emission data filename
 
-    return result_df
+    Returns:
+        DataFrame indexed by generator with the fuel "Type" and one share
+        column per gas; generators without emissions have zero shares
+    """
+    df = _get_ghg_emissions(data_dir, generation_info)
+    shares = pd.DataFrame(
+        {
+            emission_type: df[col] * GWP[emission_type] / df["Total GHG Emissions"]
+            for emission_type, col in GHG_EMISSION_COLUMNS
+        }
+    ).fillna(0)
+    shares.insert(0, "Type", df["Type"])
+    shares.index = df["Generator"]
+    return shares
 
 
 # calculate the air pollutant emissions
 def get_emissions_by_region(
-    region_power_generation: Dict[str, Dict],
+    region_power_generation: Dict[str, Dict] | GenerationCube,
     emission_data: pd.DataFrame,
     target_emission: str,
 ) -> pd.DataFrame:
@@ -195,6 +279,13 @@ def get_emissions_by_region(
         "CO2e": "CO2e (g/kWh)",
     }
 
+    if isinstance(region_power_generation, GenerationCube):
+        return get_regional_emissions(
+            cube=region_power_generation,
+            emission_data=emission_data,
+            target_emissions=[target_emission],
+        )[target_emission]
+
     emissions: Dict[str, pd.DataFrame] = {}
 
     for region in region_power_generation:
@@ -217,3 +308,74 @@ def get_emissions_by_region(
     regional_air_pollution.drop(columns="離島", inplace=True)
 
     return regional_air_pollution
+
+
+def build_emission_factor_matrix(
+    cube: GenerationCube, emission_data: pd.DataFrame, target_emissions: List[str]
+) -> np.ndarray:
+    """Emission factors aligned to the units of the cube.
+
+    Units whose fuel is not an emission source in `emission_data`, and units
+    without a factor, get zeros.
+
+    Args:
+        cube: Hourly power generation of every unit
+        emission_data: Emission factors indexed by plant name
+        target_emissions: Emission types, e.g. ["CO2e", "SOx", "NOx", "PM"]
+
+    Returns:
+        Array of shape (units, emission types) in g/kWh
+    """
+    emitting = np.isin(cube.fuels, emission_data["能源別"].unique())
+
+    missing_units = cube.units[emitting & ~np.isin(cube.units, emission_data.index)]
+    if len(missing_units):
+        logging.warning(f"Missing emission factors for units: {missing_units.tolist()}.")
+
+    labels = [EMISSION_LABELS[emission] for emission in target_emissions]
+    factors = emission_data[labels].reindex(cube.units).to_numpy(dtype=float)
+    factors[~emitting] = 0
+
+    return np.nan_to_num(factors)
+
+
+@profiling.profiled("data.get_regional_emissions")
+def get_regional_emissions(
+    cube: GenerationCube, emission_data: pd.DataFrame, target_emissions: List[str]
+) -> Dict[str, pd.DataFrame]:
+    """Hourly regional emissions of several emission types in one pass.
+
+    The unit x emission-type factor matrix is spread over the regions of the
+    units, so a single matrix product with the generation array yields every
+    region and emission type at once.
+
+    Args:
+        cube: Hourly power generation of every unit
+        emission_data: Emission factors indexed by plant name
+        target_emissions: Emission types, e.g. ["CO2e", "SOx", "NOx", "PM"]
+
+    Returns:
+        Dictionary of hourly emissions (g) with one column per region
+    """
+    factors = build_emission_factor_matrix(cube, emission_data, target_emissions)
+
+    n_regions = len(cube.region_names)
+    region_onehot = np.zeros((len(cube.units), n_regions))
+    region_onehot[np.arange(len(cube.units)), cube.region_codes] = 1.0
+
+    # (units, emission types x regions)
+    unit_weights = (factors[:, :, None] * region_onehot[:, None, :]).reshape(
+        len(cube.units), -1
+    )
+    emissions = (np.nan_to_num(cube.values).T @ unit_weights).reshape(
+        cube.n_steps, len(target_emissions), n_regions
+    )
+    # Region-hours with a missing unit-hour are missing, like their generation.
+    emissions = np.where(cube.missing().T[:, None, :], np.nan, emissions)
+
+    return {
+        emission: pd.DataFrame(
+            emissions[:, i, :], columns=cube.region_names
+        ).drop(columns="離島", errors="ignore")
+        for i, emission in enumerate(target_emissions)
+    }
@@ -1,13 +1,18 @@
 import json
 import os
+import re
 import logging
 import numpy as np
 import pandas as pd
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterable, Iterator
 from collections import defaultdict
 
+from app import profiling
+from app.data.resample import hourly_mean
 
 
+
+@profiling.profiled("data.get_json_file")
 def get_json_file(
     data_dir: str,
     pg_file: str
@@ -16,18 +21,81 @@ def get_json_file(
     # file_path = f"{data_dir}/{file_name}"
     with open(file_path, 'r', encoding='utf-8-sig') as file:
         data = json.load(file)
+    for records in data.get('records', {}).values():
+        profiling.count('records', len(records))
     return data
 
 
+def iter_json_records(
+    data_dir: str,
+    pg_file: str,
+    record_key: str = 'NET_P',
+    chunk_size: int = 1 << 20
+) -> Iterator[Dict]:
+    """Stream the records of `data['records'][record_key]` one at a time.
+
+    The file is read in chunks of `chunk_size` characters and every record is
+    decoded on its own, so memory stays constant in the number of records.
+
+    Args:
+        data_dir: Directory of the json file
+        pg_file: Json file name
+        record_key: Name of the record array, e.g. 'NET_P' or 'FLOW_P'
+        chunk_size: Number of characters read per chunk
+
+    Yields:
+        Each record of the array as a dict
+    """
+    file_path = os.path.join(data_dir, pg_file)
+    # Fields inside a record are scalars, so only the record array itself is
+    # followed by '['.
+    array_start = re.compile(r'"%s"\s*:\s*\[' % re.escape(record_key))
+    separator = re.compile(r'[\s,]*')
+    decoder = json.JSONDecoder()
+
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        buffer = ''
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise ValueError(f'{record_key} records not found in {file_path}.')
+            buffer += chunk
+            match = array_start.search(buffer)
+            if match:
+                pos = match.end()
+                break
+            buffer = buffer[-(len(record_key) + 64):]
+
+        eof = False
+        while True:
+            pos = separator.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                if pos == len(buffer):
+                    raise json.JSONDecodeError('Incomplete record', buffer, pos)
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield record
+
+
 def get_station_info(
     data_dir: str,
     station_file: str
 ) -> Dict[str, Tuple[str, str]]:
-    station_info = {}
     file_path = os.path.join(data_dir, station_file)
     region_fuel_info = pd.read_csv(file_path)
-    for _, row in region_fuel_info.iterrows():
-        station_info[row['Station Name']] = (row['Location'], row['Type'])
+    station_info = dict(zip(
+        region_fuel_info['Station Name'],
+        zip(region_fuel_info['Location'], region_fuel_info['Type'])
+    ))
     return station_info
 
 
@@ -36,15 +104,22 @@ def get_capacity_info(
     capacity_file: str,
     fuel_type: str
 ) -> Dict[str, float]:
-    capacity_data = {}
+    capacity_table = get_capacity_table(data_dir=data_dir, capacity_file=capacity_file)
+    return capacity_table.get(fuel_type, {})
+
+
+def get_capacity_table(
+    data_dir: str,
+    capacity_file: str
+) -> Dict[str, Dict[str, float]]:
+    """Installed capacity (kW) of every station, grouped by fuel type."""
     file_path = os.path.join(data_dir, capacity_file)
     capacity_df = pd.read_csv(file_path, encoding='utf-8')
-    
-    for _, row in capacity_df.iterrows():
-        if row['Fuel Type'] == fuel_type:
-                capacity_data[row['Station Name']] = float(row['Installed Capacity(kW)'])
-    
-    return capacity_data
+    capacity_df['Installed Capacity(kW)'] = capacity_df['Installed Capacity(kW)'].astype(float)
+    return {
+        fuel_type: dict(zip(group['Station Name'], group['Installed Capacity(kW)'].tolist()))
+        for fuel_type, group in capacity_df.groupby('Fuel Type', sort=False)
+    }
         
 
 
@@ -53,18 +128,30 @@ def process_power_generation_data(
     station_info: Dict
 ) -> Dict:
 
+    return accumulate_power_generation_records(
+        records=data['records']['NET_P'],
+        station_info=station_info
+    )
+
+
+@profiling.profiled("data.accumulate_power_generation_records")
+def accumulate_power_generation_records(
+    records: Iterable[Dict],
+    station_info: Dict
+) -> Dict:
+
     pg_data = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
     missing_station = defaultdict(list)
 
-    for i in range(len(data['records']['NET_P'])):
-        fuel = data['records']['NET_P'][i]['FUEL_TYPE']
-        unit = data['records']['NET_P'][i]['UNIT_NAME']
-        net_power = data['records']['NET_P'][i]['NET_P']
+    for record in records:
+        fuel = record['FUEL_TYPE']
+        unit = record['UNIT_NAME']
+        net_power = record['NET_P']
         try:
-            date = data['records']['NET_P'][i]['DATE']
+            date = record['DATE']
         except Exception as e:
             # logging.warning(f"New Data format: Switching to backup method.")
-            date = data['records']['NET_P'][i]['DATETIME']
+            date = record['DATETIME']
         try:
             station_name = unit
             region, _ = station_info[station_name]
@@ -76,9 +163,11 @@ def process_power_generation_data(
     if missing_station:
         logging.warning(f'Please Check the new stations or errors: {missing_station.keys()}.')
 
+    profiling.count('missing_stations', len(missing_station))
     return pg_data
 
 
+@profiling.profiled("data.compute_hourly_data")
 def compute_hourly_data(
     data: Dict[str, Dict[str, Dict[str, List[float]]]]
 ) -> Dict[str, Dict[str, Dict[str, List[float]]]]:
@@ -88,10 +177,6 @@ def compute_hourly_data(
     for region, fuel_dict in data.items():
         for fuel_type, unit_dict in fuel_dict.items():
             for unit, power_values in unit_dict.items():
-                hourly_values = []
-                for i in range(0, len(power_values), 6):
-                    avg_value = np.mean(power_values[i:i+6])
-                    hourly_values.append(avg_value)
-                hourly_data[region][fuel_type][unit] = hourly_values
+                hourly_data[region][fuel_type][unit] = hourly_mean(power_values)
 
     return hourly_data
\ No newline at end of file
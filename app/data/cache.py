@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.data.cube import GenerationCube
+
+# Bump when the cached layout or the hourly computation changes.
+CACHE_VERSION = "1"
+
+_digests: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_digest(file_path: str | Path, chunk_size: int = 1 << 20) -> str:
+    """Content hash of a file, memoized by path, size and modification time.
+
+    Args:
+        file_path: Path to the file
+        chunk_size: Number of bytes hashed per read
+
+    Returns:
+        Hex digest of the file content
+    """
+    stat = os.stat(file_path)
+    memo_key = (str(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digests:
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                digest.update(chunk)
+        _digests[memo_key] = digest.hexdigest()
+    return _digests[memo_key]
+
+
+def make_cache_key(*parts: str) -> str:
+    """Combine content hashes and parameters into one cache key."""
+    digest = hashlib.blake2b(CACHE_VERSION.encode(), digest_size=20)
+    for part in parts:
+        digest.update(b"\0" + str(part).encode())
+    return digest.hexdigest()
+
+
+def load_cached_cube(cache_dir: str | Path, key: str) -> Optional[GenerationCube]:
+    """Load a cached cube with its values memory-mapped.
+
+    Args:
+        cache_dir: Cache directory
+        key: Cache key of the entry
+
+    Returns:
+        The cached GenerationCube, or None when the entry does not exist
+    """
+    entry = Path(cache_dir, key)
+    try:
+        with open(entry / "meta.json", encoding="utf-8") as file:
+            meta = json.load(file)
+        values = np.load(entry / "values.npy", mmap_mode="r")
+    except (OSError, ValueError) as e:
+        if entry.exists():
+            logging.warning(f"Ignoring broken cache entry {entry}: {e}")
+        return None
+
+    # Mark the entry as recently used for the eviction policy.
+    os.utime(entry)
+    return GenerationCube(
+        values=values,
+        regions=meta["regions"],
+        fuels=meta["fuels"],
+        units=meta["units"],
+        missing_invalid=meta.get("missing_invalid", False),
+    )
+
+
+def save_cached_cube(
+    cache_dir: str | Path, key: str, cube: GenerationCube, max_bytes: int
+) -> None:
+    """Store a cube under `key` and evict old entries beyond `max_bytes`.
+
+    Args:
+        cache_dir: Cache directory
+        key: Cache key of the entry
+        cube: Cube to store
+        max_bytes: Size limit of the whole cache directory
+    """
+
+    def write(staging: Path) -> None:
+        np.save(staging / "values.npy", cube.values)
+        with open(staging / "meta.json", "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "regions": cube.regions.tolist(),
+                    "fuels": cube.fuels.tolist(),
+                    "units": cube.units.tolist(),
+                    "missing_invalid": cube.missing_invalid,
+                },
+                file,
+                ensure_ascii=False,
+            )
+
+    _store_entry(cache_dir, key, write, max_bytes=max_bytes)
+
+
+def has_cached_entry(cache_dir: str | Path, key: str) -> bool:
+    """Whether the cache holds an entry under `key`."""
+    return Path(cache_dir, key).is_dir()
+
+
+def load_cached_artifact(cache_dir: str | Path, key: str) -> Tuple[bool, Any]:
+    """Load a pickled artifact.
+
+    Args:
+        cache_dir: Cache directory
+        key: Cache key of the entry
+
+    Returns:
+        Tuple of whether the entry exists and its value
+    """
+    entry = Path(cache_dir, key)
+    try:
+        with open(entry / "artifact.pkl", "rb") as file:
+            value = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        if entry.exists():
+            logging.warning(f"Ignoring broken cache entry {entry}: {e}")
+        return False, None
+
+    # Mark the entry as recently used for the eviction policy.
+    os.utime(entry)
+    return True, value
+
+
+def save_cached_artifact(
+    cache_dir: str | Path, key: str, value: Any, max_bytes: int
+) -> None:
+    """Pickle an artifact under `key` and evict old entries beyond `max_bytes`.
+
+    Args:
+        cache_dir: Cache directory
+        key: Cache key of the entry
+        value: Picklable value to store
+        max_bytes: Size limit of the whole cache directory
+    """
+
+    def write(staging: Path) -> None:
+        with open(staging / "artifact.pkl", "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    _store_entry(cache_dir, key, write, max_bytes=max_bytes)
+
+
+def _store_entry(
+    cache_dir: str | Path, key: str, write: Callable[[Path], None], max_bytes: int
+) -> None:
+    """Write an entry through `write` into a staging directory, then publish it."""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Write into a temporary directory first so readers never see partial entries.
+    staging = Path(tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir))
+    try:
+        if (cache_dir / key).exists():
+            # Another run already stored the same content.
+            shutil.rmtree(staging)
+            return
+        write(staging)
+        os.replace(staging, cache_dir / key)
+    except OSError as e:
+        logging.warning(f"Failed to write cache entry {key}: {e}")
+        shutil.rmtree(staging, ignore_errors=True)
+        return
+
+    evict_cache(cache_dir, max_bytes=max_bytes, keep=key)
+
+
+def evict_cache(cache_dir: str | Path, max_bytes: int, keep: str = "") -> None:
+    """Remove least recently used entries until the cache fits in `max_bytes`.
+
+    Args:
+        cache_dir: Cache directory
+        max_bytes: Size limit of the whole cache directory
+        keep: Key of an entry that must not be evicted
+    """
+    entries = []
+    for entry in Path(cache_dir).iterdir():
+        if not entry.is_dir() or entry.name.startswith("."):
+            continue
+        size = sum(f.stat().st_size for f in entry.iterdir())
+        entries.append((entry.stat().st_mtime, size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry.name == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        logging.info(f"Evicted cache entry {entry.name} ({size} bytes).")
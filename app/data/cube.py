@@ -0,0 +1,170 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class GenerationCube:
+    """Power generation of every unit stored as one contiguous array.
+
+    Attributes:
+        values: Generation (kW), shape (units, timesteps); shorter unit series
+            are padded with NaN
+        regions: Region of each unit, shape (units,)
+        fuels: Fuel type of each unit, shape (units,)
+        units: Unit name of each unit, shape (units,)
+        missing_invalid: NaN marks a missing unit-hour, e.g. under the 'nan'
+            and 'drop' gap policies; region sums and the hours after power
+            flow are then NaN too. Otherwise NaN counts as no generation.
+    """
+
+    values: np.ndarray
+    regions: np.ndarray
+    fuels: np.ndarray
+    units: np.ndarray
+    missing_invalid: bool = False
+    region_names: List[str] = field(init=False)
+    region_codes: np.ndarray = field(init=False)
+
+    def __post_init__(self):
+        self.values = np.ascontiguousarray(self.values, dtype=float)
+        self.regions = np.asarray(self.regions, dtype=str)
+        self.fuels = np.asarray(self.fuels, dtype=str)
+        self.units = np.asarray(self.units, dtype=str)
+        # Keep the regions in order of first appearance, like the nested dicts
+        self.region_names = list(dict.fromkeys(self.regions.tolist()))
+        region_index = {region: i for i, region in enumerate(self.region_names)}
+        self.region_codes = np.array(
+            [region_index[region] for region in self.regions], dtype=np.intp
+        )
+
+    @classmethod
+    def from_nested(
+        cls, data: Dict[str, Dict[str, Dict[str, List[float]]]]
+    ) -> "GenerationCube":
+        """Build a cube from the nested region/fuel/unit dictionary.
+
+        Args:
+            data: Power generation data in the form data[region][fuel][unit]
+
+        Returns:
+            GenerationCube holding the same series
+        """
+        regions, fuels, units, series = [], [], [], []
+        for region, fuel_dict in data.items():
+            for fuel, unit_dict in fuel_dict.items():
+                for unit, power_values in unit_dict.items():
+                    regions.append(region)
+                    fuels.append(fuel)
+                    units.append(unit)
+                    series.append(power_values)
+
+        n_steps = max((len(values) for values in series), default=0)
+        values = np.full((len(series), n_steps), np.nan)
+        for i, power_values in enumerate(series):
+            values[i, : len(power_values)] = power_values
+
+        return cls(values=values, regions=regions, fuels=fuels, units=units)
+
+    def to_nested(self) -> Dict[str, Dict[str, Dict[str, List[float]]]]:
+        """Convert the cube back to the nested region/fuel/unit dictionary."""
+        data: Dict[str, Dict[str, Dict[str, List[float]]]] = {}
+        for region, fuel, unit, values in zip(
+            self.regions, self.fuels, self.units, self.values
+        ):
+            data.setdefault(region, {}).setdefault(fuel, {})[unit] = values.tolist()
+        return data
+
+    @property
+    def n_steps(self) -> int:
+        return self.values.shape[1]
+
+    def mask(
+        self,
+        region: Optional[str] = None,
+        fuel: Optional[str] = None,
+        exclude_fuel: Optional[Iterable[str]] = None,
+        units: Optional[Iterable[str]] = None,
+    ) -> np.ndarray:
+        """Boolean unit mask for the given region, fuel and unit filters."""
+        selected = np.ones(len(self.units), dtype=bool)
+        if region is not None:
+            selected &= self.regions == region
+        if fuel is not None:
+            selected &= self.fuels == fuel
+        if exclude_fuel is not None:
+            selected &= ~np.isin(self.fuels, list(exclude_fuel))
+        if units is not None:
+            selected &= np.isin(self.units, list(units))
+        return selected
+
+    def select(self, **filters) -> "GenerationCube":
+        """Sub-cube of the units matching the filters of `mask`."""
+        selected = self.mask(**filters)
+        return GenerationCube(
+            values=self.values[selected],
+            regions=self.regions[selected],
+            fuels=self.fuels[selected],
+            units=self.units[selected],
+            missing_invalid=self.missing_invalid,
+        )
+
+    def missing(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Region-hours with a missing unit-hour, shape (regions, timesteps).
+
+        All False unless `missing_invalid`.
+
+        Args:
+            mask: Boolean unit mask of the units to check
+        """
+        missing = np.zeros((len(self.region_names), self.n_steps), dtype=bool)
+        if not self.missing_invalid:
+            return missing
+        unit_missing = np.isnan(self.values)
+        if mask is not None:
+            unit_missing &= mask[:, None]
+        np.logical_or.at(missing, self.region_codes, unit_missing)
+        return missing
+
+    def missing_hours(self) -> np.ndarray:
+        """Timesteps with any missing unit-hour, shape (timesteps,)."""
+        return self.missing().any(axis=0)
+
+    def group_sum(
+        self, values: Optional[np.ndarray] = None, mask: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Sum unit rows into region rows.
+
+        NaN counts as zero, except that for the generation values region-hours
+        with a missing unit-hour are NaN when `missing_invalid`.
+
+        Args:
+            values: Array aligned to the units on its first axis; defaults to
+                the generation values
+            mask: Boolean unit mask of the rows to include
+
+        Returns:
+            Array of shape (regions, ...) in the order of `region_names`
+        """
+        generation = values is None
+        values = self.values if generation else values
+        summed = np.zeros((len(self.region_names),) + values.shape[1:])
+        for code in range(len(self.region_names)):
+            rows = self.region_codes == code
+            if mask is not None:
+                rows &= mask
+            summed[code] = np.nan_to_num(values[rows]).sum(axis=0)
+        if generation and self.missing_invalid:
+            summed[self.missing(mask)] = np.nan
+        return summed
+
+    def region_sum(self, **filters) -> pd.DataFrame:
+        """Hourly generation summed by region for the units matching the filters.
+
+        Returns:
+            DataFrame with one column per region
+        """
+        summed = self.group_sum(mask=self.mask(**filters))
+        return pd.DataFrame(summed.T, columns=self.region_names)
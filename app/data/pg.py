@@ -8,37 +8,204 @@ from typing import List, Dict, Tuple
 from pathlib import Path
 from collections import defaultdict
 
+from app import profiling
 from app.data.base import(
     get_json_file,
+    iter_json_records,
     get_station_info,
     get_capacity_info,
     process_power_generation_data,
+    accumulate_power_generation_records,
     compute_hourly_data,
 )
+from app.data.cube import GenerationCube
+from app.data.resample import collect_unit_records, resample_hourly
+from app.data.cache import (
+    file_digest,
+    make_cache_key,
+    load_cached_cube,
+    save_cached_cube,
+)
 
 @functools.lru_cache(maxsize=None)
 def get_hourly_pg_data(
     data_dir: Path,
     pg_file: str,
-    station_file: str
+    station_file: str,
+    stream: bool = False
 ) -> Dict:
-    # Load power generation data
-    power_generation_data = get_json_file(
-        data_dir=f'{data_dir}/power_generation/',
-        pg_file=pg_file
+    return _read_hourly_pg_data(
+        data_dir=data_dir,
+        pg_file=pg_file,
+        station_file=station_file,
+        stream=stream
+    )
+
+@functools.lru_cache(maxsize=None)
+@profiling.profiled("data.get_hourly_pg_cube")
+def get_hourly_pg_cube(
+    data_dir: Path,
+    pg_file: str,
+    station_file: str,
+    stream: bool = False,
+    cache_dir: str | None = None,
+    cache_max_bytes: int = 2 << 30,
+    gap_policy: str = 'positional',
+    datetime_range: str | None = None
+) -> GenerationCube:
+    """Hourly power generation of every unit as a GenerationCube.
+
+    With `cache_dir` the result is stored on disk under a key derived from the
+    content of the power generation and station files, so later runs with the
+    same inputs skip the json ingest and memory-map the cached values.
+
+    `gap_policy` 'positional' averages every six records of a unit in order;
+    'nan', 'interpolate' and 'drop' place the records on the hourly grid of
+    `datetime_range` ('start|end') by their timestamps (see `resample_hourly`).
+    """
+    if cache_dir:
+        cache_key = make_cache_key(
+            'hourly_pg',
+            file_digest(Path(data_dir, 'power_generation', pg_file)),
+            file_digest(Path(data_dir, station_file)),
+            gap_policy,
+            datetime_range if gap_policy != 'positional' else ''
+        )
+        cube = load_cached_cube(cache_dir=cache_dir, key=cache_key)
+        if cube is not None:
+            logging.info(f'Loaded cached hourly generation for {pg_file}.')
+            return cube
+
+    if gap_policy == 'positional':
+        hourly_pg_data = _read_hourly_pg_data(
+            data_dir=data_dir,
+            pg_file=pg_file,
+            station_file=station_file,
+            stream=stream
+        )
+        cube = GenerationCube.from_nested(hourly_pg_data)
+    else:
+        cube = _resample_hourly_pg_cube(
+            data_dir=data_dir,
+            pg_file=pg_file,
+            station_file=station_file,
+            stream=stream,
+            gap_policy=gap_policy,
+            datetime_range=datetime_range
+        )
+
+    if cache_dir:
+        save_cached_cube(
+            cache_dir=cache_dir,
+            key=cache_key,
+            cube=cube,
+            max_bytes=cache_max_bytes
+        )
+
+    return cube
+
+@profiling.profiled("data.resample_hourly_pg_cube")
+def _resample_hourly_pg_cube(
+    data_dir: Path,
+    pg_file: str,
+    station_file: str,
+    stream: bool,
+    gap_policy: str,
+    datetime_range: str | None
+) -> GenerationCube:
+    station_info = get_station_info(
+        data_dir=data_dir,
+        station_file=station_file
+    )
+
+    if stream:
+        records = iter_json_records(
+            data_dir=f'{data_dir}/power_generation/',
+            pg_file=pg_file,
+            record_key='NET_P'
+        )
+    else:
+        records = get_json_file(
+            data_dir=f'{data_dir}/power_generation/',
+            pg_file=pg_file
+        )['records']['NET_P']
+
+    unit_records = collect_unit_records(records=records, value_key='NET_P')
+    start, end = datetime_range.split('|') if datetime_range else (None, None)
+    hourly = resample_hourly(
+        codes=unit_records.codes,
+        timestamps=unit_records.timestamps,
+        values=unit_records.values,
+        n_units=len(unit_records.units),
+        start=start,
+        end=end,
+        gap_policy=gap_policy
     )
 
+    known = np.array([unit in station_info for unit in unit_records.units], dtype=bool)
+    if not known.all():
+        missing_station = [unit for unit, ok in zip(unit_records.units, known) if not ok]
+        logging.warning(f'Please Check the new stations or errors: {missing_station}.')
+
+    logging.info(
+        f'{pg_file}: 10-minute coverage {hourly.coverage.mean():.4f} '
+        f'(min {hourly.coverage.min():.4f}), '
+        f'{hourly.incomplete_hours.sum()} incomplete unit-hours.'
+    )
+
+    units = [unit for unit, ok in zip(unit_records.units, known) if ok]
+    cube = GenerationCube(
+        values=hourly.values[known],
+        regions=[station_info[unit][0] for unit in units],
+        fuels=np.array(unit_records.fuels)[known],
+        units=units,
+        # Hours left NaN are missing, not zero generation
+        missing_invalid=gap_policy in ('nan', 'drop')
+    )
+    missing_hours = cube.missing_hours()
+    if missing_hours.any():
+        logging.warning(
+            f'{pg_file}: {missing_hours.sum()} of {cube.n_steps} hours miss unit data '
+            f'under gap_policy={gap_policy!r} ({cube.missing().sum()} region-hours); '
+            'their regional generation, capacity factors and intensities are NaN.'
+        )
+    return cube
+
+def _read_hourly_pg_data(
+    data_dir: Path,
+    pg_file: str,
+    station_file: str,
+    stream: bool
+) -> Dict:
     # Load station info
     station_info = get_station_info(
         data_dir=data_dir, 
         station_file=station_file
     )
 
-    # Process power generation data
-    pg_data = process_power_generation_data(
-        data=power_generation_data,
-        station_info=station_info
-    )
+    if stream:
+        # Feed the NET_P records straight into the per-unit accumulation
+        # without holding the whole json document in memory.
+        pg_data = accumulate_power_generation_records(
+            records=iter_json_records(
+                data_dir=f'{data_dir}/power_generation/',
+                pg_file=pg_file,
+                record_key='NET_P'
+            ),
+            station_info=station_info
+        )
+    else:
+        # Load power generation data
+        power_generation_data = get_json_file(
+            data_dir=f'{data_dir}/power_generation/',
+            pg_file=pg_file
+        )
+
+        # Process power generation data
+        pg_data = process_power_generation_data(
+            data=power_generation_data,
+            station_info=station_info
+        )
 
     hourly_pg_data = compute_hourly_data(
         data=pg_data
@@ -46,13 +213,17 @@ def get_hourly_pg_data(
 
     return hourly_pg_data
 
+@profiling.profiled("data.get_selected_pg_data")
 def get_selected_pg_data(
-    pg: dict,
+    pg: dict | GenerationCube,
     exclude_fuel: list
 ) -> Dict:
 
     exclude_fuel_types = ["風力" if item in ["陸域風電", "離岸風電"] else item for item in exclude_fuel]
 
+    if isinstance(pg, GenerationCube):
+        return pg.region_sum(exclude_fuel=exclude_fuel_types)
+
     selected_pg = pd.DataFrame()
 
     for region, fuel_dict in pg.items():
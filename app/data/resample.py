@@ -0,0 +1,196 @@
+import warnings
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from app import profiling
+
+# Number of 10-minute samples in one hour
+SAMPLES_PER_HOUR = 6
+SAMPLE_INTERVAL = np.timedelta64(10, "m")
+
+GAP_POLICIES = ("nan", "interpolate", "drop")
+
+
+@dataclass
+class UnitRecords:
+    """Flat columns of 10-minute records, one entry per record.
+
+    Attributes:
+        units: Unit names in order of first appearance
+        fuels: Fuel type of each unit ('' when the records carry none)
+        codes: Index into `units` of each record
+        timestamps: Timestamp string of each record
+        values: Value of each record (kW)
+    """
+
+    units: List[str]
+    fuels: List[str]
+    codes: np.ndarray
+    timestamps: np.ndarray
+    values: np.ndarray
+
+
+@dataclass
+class HourlyResample:
+    """Hourly means on a dense hourly grid.
+
+    Attributes:
+        values: Hourly means, shape (units, hours)
+        hours: Start of each hour
+        coverage: Fraction of the 10-minute samples present for each unit
+        incomplete_hours: Number of hours with missing samples for each unit
+    """
+
+    values: np.ndarray
+    hours: pd.DatetimeIndex
+    coverage: np.ndarray
+    incomplete_hours: np.ndarray
+
+
+@profiling.profiled("data.collect_unit_records")
+def collect_unit_records(
+    records: Iterable[Dict], value_key: str, unit_scale: float = 1000
+) -> UnitRecords:
+    """Collect records into flat unit/timestamp/value columns.
+
+    Args:
+        records: Records with 'UNIT_NAME', `value_key` and 'DATE' or 'DATETIME'
+        value_key: Name of the value field, e.g. 'NET_P' or 'P'
+        unit_scale: Factor applied to the values (MW -> kW by default)
+
+    Returns:
+        UnitRecords of all records
+    """
+    unit_index: Dict[str, int] = {}
+    fuels: List[str] = []
+    codes: List[int] = []
+    timestamps: List[str] = []
+    values: List[float] = []
+
+    for record in records:
+        unit = record["UNIT_NAME"]
+        code = unit_index.get(unit)
+        if code is None:
+            code = unit_index[unit] = len(unit_index)
+            fuels.append(record.get("FUEL_TYPE", ""))
+        codes.append(code)
+        timestamps.append(record["DATE"] if "DATE" in record else record["DATETIME"])
+        values.append(float(record[value_key]) * unit_scale)
+
+    profiling.count("records", len(codes))
+    profiling.count("units", len(unit_index))
+    return UnitRecords(
+        units=list(unit_index),
+        fuels=fuels,
+        codes=np.array(codes, dtype=np.intp),
+        timestamps=np.array(timestamps),
+        values=np.array(values, dtype=float),
+    )
+
+
+@profiling.profiled("data.resample_hourly")
+def resample_hourly(
+    codes: np.ndarray,
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    n_units: int,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    gap_policy: str = "nan",
+) -> HourlyResample:
+    """Place 10-minute records on a dense grid by timestamp and average hourly.
+
+    Args:
+        codes: Unit index of each record
+        timestamps: Timestamp of each record
+        values: Value of each record
+        n_units: Number of units
+        start: First hour of the grid; defaults to the earliest record
+        end: Last hour of the grid; defaults to the latest record
+        gap_policy: Handling of missing 10-minute samples:
+            'nan' averages the samples present and leaves empty hours NaN,
+            'interpolate' fills missing samples linearly within each unit,
+            'drop' leaves every hour with a missing sample NaN
+
+    Returns:
+        HourlyResample with values of shape (n_units, hours)
+    """
+    if gap_policy not in GAP_POLICIES:
+        raise ValueError(f"gap_policy must be one of {GAP_POLICIES}, got {gap_policy}")
+
+    record_times = pd.to_datetime(timestamps).values
+    first_hour = pd.Timestamp(start or record_times.min()).floor("h")
+    last_hour = pd.Timestamp(end or record_times.max()).floor("h")
+    hours = pd.date_range(first_hour, last_hour, freq="h")
+    n_slots = len(hours) * SAMPLES_PER_HOUR
+    profiling.count("records", len(codes))
+    profiling.count("unit_hours", n_units * len(hours))
+
+    slots = (record_times - first_hour.to_datetime64()) // SAMPLE_INTERVAL
+    inside = (slots >= 0) & (slots < n_slots)
+    grid = np.full((n_units, n_slots), np.nan)
+    grid[codes[inside], slots[inside]] = values[inside]
+
+    present = ~np.isnan(grid)
+    if gap_policy == "interpolate":
+        grid = _interpolate_slots(grid, present)
+
+    blocks = grid.reshape(n_units, len(hours), SAMPLES_PER_HOUR)
+    with warnings.catch_warnings():
+        # Hours without any sample stay NaN.
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        hourly = np.nanmean(blocks, axis=2)
+
+    samples_per_hour = present.reshape(blocks.shape).sum(axis=2)
+    incomplete = samples_per_hour < SAMPLES_PER_HOUR
+    if gap_policy == "drop":
+        hourly[incomplete] = np.nan
+
+    return HourlyResample(
+        values=hourly,
+        hours=hours,
+        coverage=present.mean(axis=1) if n_slots else np.zeros(n_units),
+        incomplete_hours=incomplete.sum(axis=1),
+    )
+
+
+def _interpolate_slots(grid: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """Linearly interpolate missing slots of every row, holding the edges."""
+    n_slots = grid.shape[1]
+    if n_slots == 0:
+        return grid
+    slot_index = np.arange(n_slots)
+    rows = np.arange(grid.shape[0])[:, None]
+
+    previous = np.maximum.accumulate(np.where(present, slot_index, -1), axis=1)
+    following = np.minimum.accumulate(
+        np.where(present, slot_index, n_slots)[:, ::-1], axis=1
+    )[:, ::-1]
+    has_previous = previous >= 0
+    has_following = following < n_slots
+
+    previous_value = grid[rows, np.clip(previous, 0, n_slots - 1)]
+    following_value = grid[rows, np.clip(following, 0, n_slots - 1)]
+    span = np.where(has_previous & has_following, following - previous, 1)
+    weight = (slot_index - previous) / np.maximum(span, 1)
+
+    filled = np.where(
+        has_previous & has_following,
+        previous_value + (following_value - previous_value) * weight,
+        np.where(has_previous, previous_value, following_value),
+    )
+    filled[~(has_previous | has_following)] = np.nan
+    return np.where(present, grid, filled)
+
+
+def hourly_mean(power_values: List[float]) -> List[float]:
+    """Average consecutive blocks of six 10-minute samples by position."""
+    power_values = np.asarray(power_values, dtype=float)
+    n_full = len(power_values) // SAMPLES_PER_HOUR * SAMPLES_PER_HOUR
+    hourly = power_values[:n_full].reshape(-1, SAMPLES_PER_HOUR).mean(axis=1).tolist()
+    if n_full < len(power_values):
+        hourly.append(float(np.mean(power_values[n_full:])))
+    return hourly
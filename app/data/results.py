@@ -0,0 +1,473 @@
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app import profiling
+
+RESULT_STORE_FILE = "results.eistore"
+RESULT_STORE_VERSION = 1
+
+# File layout: magic, little-endian uint64 header size, JSON header, then
+# every array at an offset aligned for memory mapping.
+_MAGIC = b"EISTORE\0"
+_ALIGNMENT = 64
+
+# Periods are month ranges such as '5~7'; other outputs, e.g. the
+# 'CO2e_EI_5~7_kg.csv' intensities in kg/kWh, are not part of the store.
+_EI_CSV = re.compile(r"^(?P<emission>[^_]+)_EI_(?P<period>\d+~\d+)\.csv$")
+_CF_CSV = re.compile(
+    r"^region_capacity_factor_(?P<fuel>[^_]+)_(?P<period>\d+~\d+)\.csv$"
+)
+
+
+def _period_key(period: str) -> Tuple[int, ...]:
+    """Chronological sort key of a period such as '10~12'."""
+    return tuple(int(month) for month in period.split("~"))
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def write_array_file(
+    file_path: str | Path, arrays: Dict[str, np.ndarray], meta: Dict
+) -> None:
+    """Write named arrays and JSON metadata into one memory-mappable file.
+
+    The file is written next to its destination and moved into place, so
+    readers never see a partial file.
+
+    Args:
+        file_path: Output file
+        arrays: Arrays by name, stored in C order with their dtype
+        meta: JSON-serializable metadata
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps(
+        {"meta": meta, "arrays": layout}, ensure_ascii=False
+    ).encode("utf-8")
+    data_start = _aligned(len(_MAGIC) + 8 + len(header))
+
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    staging = file_path.with_name(f".tmp-{os.getpid()}-{file_path.name}")
+    try:
+        with open(staging, "wb") as file:
+            file.write(_MAGIC)
+            file.write(len(header).to_bytes(8, "little"))
+            file.write(header)
+            for name, array in arrays.items():
+                file.seek(data_start + layout[name]["offset"])
+                file.write(array.tobytes())
+            file.truncate(data_start + offset)
+        os.replace(staging, file_path)
+    except BaseException:
+        staging.unlink(missing_ok=True)
+        raise
+
+
+def read_array_file(file_path: str | Path) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """Open a file written by `write_array_file` with its arrays memory-mapped.
+
+    Args:
+        file_path: File to read
+
+    Returns:
+        Tuple of the metadata and the read-only arrays by name
+    """
+    with open(file_path, "rb") as file:
+        if file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{file_path} is not a result store file")
+        header_size = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_size).decode("utf-8"))
+    data_start = _aligned(len(_MAGIC) + 8 + header_size)
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+        if np.prod(shape) == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+            continue
+        arrays[name] = np.memmap(
+            file_path,
+            dtype=dtype,
+            mode="r",
+            offset=data_start + spec["offset"],
+            shape=shape,
+        )
+    return header["meta"], arrays
+
+
+def _stack_frames(
+    frames: Dict[str, pd.DataFrame], names: List[str]
+) -> Tuple[np.ndarray, List[str]]:
+    """Stack frames sharing one column set into (names, hours, columns)."""
+    columns = list(frames[names[0]].columns)
+    values = np.stack(
+        [frames[name].reindex(columns=columns).to_numpy(dtype=float) for name in names]
+    )
+    return values, columns
+
+
+@profiling.profiled("data.write_result_store")
+def write_result_store(
+    file_path: str | Path,
+    intensities: Dict[str, Dict[str, pd.DataFrame]],
+    capacity_factors: Dict[str, Dict[str, pd.DataFrame]],
+    generation: Dict[str, pd.DataFrame] | None = None,
+    emissions: Dict[str, Dict[str, pd.DataFrame]] | None = None,
+) -> None:
+    """Write the results of a run into one binary result store.
+
+    Args:
+        file_path: Output file
+        intensities: Hourly emission intensity (g/kWh) by period and emission
+            type, indexed by datetime with one column per region
+        capacity_factors: Hourly regional capacity factors by period and
+            fuel type, on the same hourly grid as the intensities
+        generation: Hourly generation (kWh) after power flow by period, with
+            the regions of the intensities
+        emissions: Hourly emissions (g) after power flow by period and
+            emission type, with the regions of the intensities
+
+    Raises:
+        ValueError: When periods differ in their emission or fuel types
+    """
+    periods = list(intensities)
+    emission_types = list(next(iter(intensities.values()), {}))
+    fuel_types = list(next(iter(capacity_factors.values()), {}))
+
+    arrays, period_meta = {}, {}
+    for period in periods:
+        if list(intensities[period]) != emission_types or list(
+            capacity_factors.get(period, {})
+        ) != fuel_types:
+            raise ValueError(f"Period {period} has different emission or fuel types")
+
+        intensity, regions = _stack_frames(intensities[period], emission_types)
+        index = pd.DatetimeIndex(intensities[period][emission_types[0]].index)
+        arrays[f"{period}/timestamps"] = index.values.astype("datetime64[s]")
+        arrays[f"{period}/intensity"] = intensity
+        period_meta[period] = {"regions": regions}
+
+        # Generation and emissions, from which window intensities are weighted
+        if generation and emissions and period in generation:
+            arrays[f"{period}/generation"] = (
+                generation[period].reindex(columns=regions).to_numpy(dtype=float)
+            )
+            arrays[f"{period}/emissions"], _ = _stack_frames(
+                {
+                    emission_type: frame.reindex(columns=regions)
+                    for emission_type, frame in emissions[period].items()
+                },
+                emission_types,
+            )
+
+        if fuel_types:
+            capacity_factor, cf_regions = _stack_frames(
+                capacity_factors[period], fuel_types
+            )
+            # Capacity factors carry no index; they start with the intensities.
+            arrays[f"{period}/capacity_factor_timestamps"] = (
+                arrays[f"{period}/timestamps"][:1]
+                + np.arange(capacity_factor.shape[1]).astype("timedelta64[h]")
+            )
+            arrays[f"{period}/capacity_factor"] = capacity_factor
+            period_meta[period]["capacity_factor_regions"] = cf_regions
+
+    write_array_file(
+        file_path,
+        arrays,
+        meta={
+            "version": RESULT_STORE_VERSION,
+            "periods": period_meta,
+            "emission_types": emission_types,
+            "fuel_types": fuel_types,
+        },
+    )
+    logging.info(f"Wrote result store {file_path}.")
+
+
+class ResultStore:
+    def __init__(self, file_path: str | Path):
+        """Read-only view of a binary result store.
+
+        Arrays are memory-mapped, so a query only reads the pages of the
+        slice it returns.
+
+        Args:
+            file_path: Result store file, or a result directory holding one
+        """
+        file_path = Path(file_path)
+        if file_path.is_dir():
+            file_path = file_path / RESULT_STORE_FILE
+        self.file_path = file_path
+        meta, self.arrays = read_array_file(file_path)
+        if meta["version"] != RESULT_STORE_VERSION:
+            raise ValueError(
+                f"Unsupported result store version {meta['version']} in {file_path}"
+            )
+        self._periods: Dict[str, Dict[str, List[str]]] = meta["periods"]
+        self.emission_types: List[str] = meta["emission_types"]
+        self.fuel_types: List[str] = meta["fuel_types"]
+
+    @property
+    def periods(self) -> List[str]:
+        return list(self._periods)
+
+    def regions(self, period: str, capacity_factor: bool = False) -> List[str]:
+        """Regions of the intensity, or the capacity factor, of a period"""
+        key = "capacity_factor_regions" if capacity_factor else "regions"
+        return self._periods[self._check_period(period)][key]
+
+    def timestamps(self, period: str) -> pd.DatetimeIndex:
+        """Hourly timestamps of a period"""
+        return pd.DatetimeIndex(self.arrays[f"{self._check_period(period)}/timestamps"])
+
+    def has_balance(self, period: str) -> bool:
+        """Whether the store holds the generation and emissions of a period"""
+        return f"{self._check_period(period)}/generation" in self.arrays
+
+    def generation(
+        self,
+        period: str,
+        regions: List[str] | None = None,
+        start: str | None = None,
+        end: str | None = None,
+    ) -> pd.DataFrame:
+        """Hourly generation (kWh) after power flow of one period."""
+        values = self.arrays[f"{self._check_period(period)}/generation"]
+        return self._frame(values, period, self.regions(period), regions, start, end)
+
+    def emissions(
+        self,
+        emission_type: str,
+        period: str,
+        regions: List[str] | None = None,
+        start: str | None = None,
+        end: str | None = None,
+    ) -> pd.DataFrame:
+        """Hourly emissions (g) after power flow of one emission type and period."""
+        return self._slice(
+            "emissions",
+            self.emission_types,
+            emission_type,
+            period,
+            self.regions(period),
+            regions,
+            start,
+            end,
+        )
+
+    def intensity(
+        self,
+        emission_type: str,
+        period: str,
+        regions: List[str] | None = None,
+        start: str | None = None,
+        end: str | None = None,
+    ) -> pd.DataFrame:
+        """Hourly emission intensity (g/kWh) of one emission type and period.
+
+        Args:
+            emission_type: Emission type, e.g. 'CO2e'
+            period: Name of the period
+            regions: Regions to return; all by default
+            start: First hour to return, inclusive
+            end: Last hour to return, inclusive
+
+        Returns:
+            DataFrame indexed by datetime with one column per region
+        """
+        return self._slice(
+            "intensity",
+            self.emission_types,
+            emission_type,
+            period,
+            self.regions(period),
+            regions,
+            start,
+            end,
+        )
+
+    def capacity_factor(
+        self,
+        fuel_type: str,
+        period: str,
+        regions: List[str] | None = None,
+        start: str | None = None,
+        end: str | None = None,
+    ) -> pd.DataFrame:
+        """Hourly regional capacity factor of one fuel type and period.
+
+        Args:
+            fuel_type: Type of fuel
+            period: Name of the period
+            regions: Regions to return; all by default
+            start: First hour to return, inclusive
+            end: Last hour to return, inclusive
+
+        Returns:
+            DataFrame indexed by datetime with one column per region
+        """
+        return self._slice(
+            "capacity_factor",
+            self.fuel_types,
+            fuel_type,
+            period,
+            self.regions(period, capacity_factor=True),
+            regions,
+            start,
+            end,
+        )
+
+    def to_csv(self, result_dir: str | Path) -> List[Path]:
+        """Export the store as the per-period CSV files of earlier releases.
+
+        Args:
+            result_dir: Output directory
+
+        Returns:
+            Paths of the written files
+        """
+        result_dir = Path(result_dir)
+        files = []
+        for period in self.periods:
+            for fuel_type in self.fuel_types:
+                files.append(result_dir / f"region_capacity_factor_{fuel_type}_{period}.csv")
+                self.capacity_factor(fuel_type, period).to_csv(
+                    files[-1], index=False, encoding="utf-8-sig"
+                )
+            for emission_type in self.emission_types:
+                files.append(result_dir / f"{emission_type}_EI_{period}.csv")
+                self.intensity(emission_type, period).to_csv(
+                    files[-1], encoding="utf-8-sig", index=True
+                )
+        return files
+
+    def _check_period(self, period: str) -> str:
+        if period not in self._periods:
+            raise KeyError(f"Unknown period {period}; choose from {self.periods}")
+        return period
+
+    def _slice(
+        self,
+        array: str,
+        names: List[str],
+        name: str,
+        period: str,
+        columns: List[str],
+        regions: List[str] | None,
+        start: str | None,
+        end: str | None,
+    ) -> pd.DataFrame:
+        if name not in names:
+            raise KeyError(f"Unknown {array} series {name}; choose from {names}")
+        values = self.arrays[f"{self._check_period(period)}/{array}"][names.index(name)]
+        return self._frame(values, period, columns, regions, start, end, array)
+
+    def _frame(
+        self,
+        values: np.ndarray,
+        period: str,
+        columns: List[str],
+        regions: List[str] | None,
+        start: str | None,
+        end: str | None,
+        array: str = "intensity",
+    ) -> pd.DataFrame:
+        """Rows from `start` to `end` and the columns of `regions` of one array"""
+        timestamps = self.arrays[
+            f"{period}/capacity_factor_timestamps"
+            if array == "capacity_factor"
+            else f"{period}/timestamps"
+        ]
+
+        first, last = 0, len(values)
+        if start is not None:
+            first = np.searchsorted(timestamps, np.datetime64(pd.Timestamp(start)), "left")
+        if end is not None:
+            last = np.searchsorted(timestamps, np.datetime64(pd.Timestamp(end)), "right")
+        selected = list(range(len(columns)))
+        if regions is not None:
+            selected = [columns.index(region) for region in regions]
+
+        return pd.DataFrame(
+            np.array(values[first:last][:, selected]),
+            index=pd.DatetimeIndex(timestamps[first:last]),
+            columns=[columns[i] for i in selected],
+        )
+
+
+def convert_csv_results(
+    result_dir: str | Path, file_path: str | Path | None = None
+) -> Path:
+    """Build a result store from the CSV outputs of a result directory.
+
+    Args:
+        result_dir: Directory holding '{emission}_EI_{period}.csv' and
+            'region_capacity_factor_{fuel}_{period}.csv' files; other files
+            are skipped
+        file_path: Output file; RESULT_STORE_FILE in `result_dir` by default
+
+    Returns:
+        Path of the written store
+    """
+    result_dir = Path(result_dir)
+    intensities: Dict[str, Dict[str, pd.DataFrame]] = {}
+    capacity_factors: Dict[str, Dict[str, pd.DataFrame]] = {}
+    csv_files = []
+    for csv_file in result_dir.glob("*.csv"):
+        if match := _EI_CSV.match(csv_file.name) or _CF_CSV.match(csv_file.name):
+            csv_files.append((_period_key(match["period"]), csv_file.name, csv_file))
+    # Periods in chronological order, e.g. '2~4' before '10~12'
+    for _, _, csv_file in sorted(csv_files):
+        if match := _EI_CSV.match(csv_file.name):
+            data = pd.read_csv(
+                csv_file,
+                index_col=0,
+                encoding="utf-8-sig",
+                float_precision="round_trip",
+            )
+            if not pd.api.types.is_integer_dtype(data.index):
+                data.index = pd.to_datetime(data.index)
+            intensities.setdefault(match["period"], {})[match["emission"]] = data
+        elif match := _CF_CSV.match(csv_file.name):
+            data = pd.read_csv(
+                csv_file, encoding="utf-8-sig", float_precision="round_trip"
+            )
+            capacity_factors.setdefault(match["period"], {})[match["fuel"]] = data
+    if not intensities:
+        raise FileNotFoundError(f"No emission intensity CSV files in {result_dir}")
+
+    # Older outputs index some intensities by row number; they share the
+    # hours of the timestamped intensities of their period.
+    for period, frames in intensities.items():
+        indexes = [
+            frame.index
+            for frame in frames.values()
+            if isinstance(frame.index, pd.DatetimeIndex)
+        ]
+        if not indexes:
+            raise ValueError(f"Period {period} has no timestamped intensities")
+        for name, frame in frames.items():
+            if not isinstance(frame.index, pd.DatetimeIndex):
+                frames[name] = frame.set_axis(indexes[0][frame.index])
+
+    file_path = Path(file_path or result_dir / RESULT_STORE_FILE)
+    write_result_store(file_path, intensities, capacity_factors)
+    return file_path
@@ -1,5 +1,6 @@
 from app.module.core import(
     calculate_capacity_factor,
+    calculate_capacity_factors,
     calculate_capacity_percentage,
     calculate_pg_with_cf
 )
@@ -7,7 +8,59 @@ from app.module.core import(
 from app.module.api import(
     calculate_power_generation_with_target,
     calculate_air_pollution_intensity,
-    calculate_power_flow
+    calculate_air_pollution_intensities,
+    intensity_kernel,
+    transform_power_data
+)
+
+from app.module.flow import(
+    build_incidence_matrix,
+    apply_power_flow,
+    flow_intensity,
+    calculate_power_flow,
+    calculate_power_flow_batched,
+    calculate_power_flow_balance,
+    balance_intensities,
+    trace_power_flow,
+    calculate_flow_tracing,
+)
+
+
+from app.module.scenario import(
+    sweep_capacity_scenarios,
+    ScenarioSweep,
+)
+
+
+from app.module.uncertainty import(
+    propagate_uncertainty,
+    IntensityBands,
+    DEFAULT_UNCERTAINTY,
+)
+
+
+from app.module.intensity_index import(
+    IntensityIndex,
+)
+
+
+from app.module.charging import(
+    charging_windows,
+    ChargingEvaluator,
+)
+
+
+from app.module.marginal import(
+    marginal_emission_factors,
+    rolling_marginal_emission_factors,
+    MarginalEmissionFactors,
+)
+
+
+from app.module.diurnal import(
+    diurnal_profile,
+    diurnal_profiles,
+    load_diurnal_profiles,
 )
 
 
@@ -1,13 +1,14 @@
 import json
-from typing import List, Dict, Tuple, Union, TypedDict
+from typing import List, Dict, Tuple, TypedDict
 from enum import Enum
 import pandas as pd
 import numpy as np
 import os
-import copy
 from absl import logging
 from collections import defaultdict
 
+from app import profiling
+from app.data.resample import collect_unit_records, resample_hourly, hourly_mean
 from .constants import UNIT_NAME_TO_LOCATION, EXCLUDED_REGIONS
 
 
@@ -16,6 +17,7 @@ class CalculationScale(str, Enum):
 
     REGIONAL = "regional"
     NATIONAL = "national"
+    TRACING = "tracing"
 
 
 class PowerFlowData(TypedDict):
@@ -50,9 +52,97 @@ def calculate_power_generation_with_target(
     return power_generation
 
 
+def intensity_kernel(
+    emissions: np.ndarray, generation: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Emission intensity of stacked arrays with one masked division.
+
+    Args:
+        emissions: Emissions, shape (..., pollutants, hours, regions)
+        generation: Generation, shape (..., hours, regions)
+
+    Returns:
+        Tuple of the intensity, shape (..., pollutants, hours, regions) and 0
+        where generation is 0, and the zero-generation mask of shape
+        (..., hours, regions)
+    """
+    zero_generation = generation == 0
+    denominator = generation[..., None, :, :]
+    intensity = np.zeros(np.broadcast_shapes(emissions.shape, denominator.shape))
+    np.divide(emissions, denominator, out=intensity, where=~zero_generation[..., None, :, :])
+    return intensity, zero_generation
+
+
+def report_zero_generation(zero_generation: np.ndarray, regions: List[str]) -> np.ndarray:
+    """Log the number of zero-generation hours of each region.
+
+    Args:
+        zero_generation: Zero-generation mask, shape (hours, regions)
+        regions: Region names
+
+    Returns:
+        Bitmask of the zero-generation hours, one packed row per region
+    """
+    counts = zero_generation.sum(axis=0)
+    if counts.any():
+        summary = ", ".join(
+            f"{region} {count}" for region, count in zip(regions, counts) if count
+        )
+        logging.warning(
+            f"Generation is zero in {zero_generation.any(axis=1).sum()} of "
+            f"{len(zero_generation)} hours ({summary}); intensity set to 0."
+        )
+    return np.packbits(zero_generation.T, axis=1)
+
+
+@profiling.profiled("module.calculate_air_pollution_intensities")
+def calculate_air_pollution_intensities(
+    ap_data: Dict[str, pd.DataFrame], pg_data: pd.DataFrame, scale: CalculationScale
+) -> Tuple[Dict[str, pd.DataFrame | pd.Series], np.ndarray]:
+    """Calculate the intensity of several air pollutants at once.
+
+    Args:
+        ap_data: Regional emissions of each pollutant
+        pg_data: Power generation data
+        scale: Calculation scale, either 'regional' or 'national'
+
+    Returns:
+        Tuple of the regional (DataFrame) or national (Series) intensity of
+        each pollutant, indexed like `pg_data`, and the bitmask of the hours
+        with zero generation, one packed row per region (one row for the
+        national scale); see `np.unpackbits`
+    """
+    pollutants = list(ap_data)
+    # Hours are matched by position; extra hours of either input are dropped.
+    n_hours = min([len(pg_data)] + [len(ap_data[p]) for p in pollutants])
+    index = pg_data.index[:n_hours]
+
+    if scale == CalculationScale.REGIONAL:
+        regions = [region for region in pg_data.columns if region not in EXCLUDED_REGIONS]
+        generation = pg_data[regions].to_numpy(dtype=float)[:n_hours]
+        emissions = np.stack(
+            [ap_data[p][regions].to_numpy(dtype=float)[:n_hours] for p in pollutants]
+        )
+        intensity, zero_generation = intensity_kernel(emissions, generation)
+        zero_generation_bits = report_zero_generation(zero_generation, regions)
+        return {
+            p: pd.DataFrame(intensity[i], columns=regions, index=index)
+            for i, p in enumerate(pollutants)
+        }, zero_generation_bits
+
+    generation = pg_data.sum(axis=1).to_numpy(dtype=float)[:n_hours, None]
+    emissions = np.stack(
+        [ap_data[p].sum(axis=1).to_numpy(dtype=float)[:n_hours, None] for p in pollutants]
+    )
+    intensity, zero_generation = intensity_kernel(emissions, generation)
+    return {
+        p: pd.Series(intensity[i, :, 0], index=index) for i, p in enumerate(pollutants)
+    }, np.packbits(zero_generation.T, axis=1)
+
+
 def calculate_air_pollution_intensity(
     ap_data: pd.DataFrame, pg_data: pd.DataFrame, scale: CalculationScale
-) -> Union[pd.DataFrame, List[float]]:
+) -> pd.DataFrame | pd.Series:
     """Calculate air pollution intensity.
 
     Args:
@@ -61,43 +151,37 @@ def calculate_air_pollution_intensity(
         scale: Calculation scale, either 'regional' or 'national'
 
     Returns:
-        Regional or national air pollution intensity
+        Regional (DataFrame) or national (Series) air pollution intensity,
+        indexed like `pg_data`
     """
-    if scale == CalculationScale.REGIONAL:
-        api_regional = pd.DataFrame()
-        for region in pg_data.columns:
-            if region in EXCLUDED_REGIONS:
-                continue
-
-            if (pg_data[region] == 0).any():
-                zero_indices = list(pg_data[region][pg_data[region] == 0].index)
-                logging.warning(
-                    f"Warning: {region} generation has zeros at indices {zero_indices}"
-                )
-                api_regional[region] = [
-                    0 if b == 0 else a / b
-                    for a, b in zip(ap_data[region], pg_data[region])
-                ]
-            else:
-                api_regional[region] = [
-                    a / b for a, b in zip(ap_data[region], pg_data[region])
-                ]
-        return api_regional
-
-    pg_national = pg_data.sum(axis=1)
-    ap_national = ap_data.sum(axis=1)
-    return [a / b if b != 0 else 0 for a, b in zip(ap_national, pg_national)]
-
-
-def transform_power_data(new_data: Dict) -> Dict[str, PowerFlowData]:
+    intensities, _ = calculate_air_pollution_intensities(
+        {"emission": ap_data}, pg_data=pg_data, scale=scale
+    )
+    return intensities["emission"]
+
+
+@profiling.profiled("module.transform_power_data")
+def transform_power_data(
+    new_data: Dict,
+    gap_policy: str = "positional",
+    datetime_range: str | None = None,
+) -> Dict[str, PowerFlowData]:
     """Transform power data format.
 
     Args:
         new_data: Raw power data
+        gap_policy: 'positional' averages every six records in order; 'nan',
+            'interpolate' or 'drop' place the records on the hourly grid by
+            timestamp (see `resample_hourly`)
+        datetime_range: Hourly grid in format 'start|end' for the timestamp
+            based policies
 
     Returns:
         Transformed power data
     """
+    if gap_policy != "positional":
+        return _resample_power_data(new_data, gap_policy, datetime_range)
+
     flow_data = defaultdict(list)
 
     for record in new_data["records"]["FLOW_P"]:
@@ -109,9 +193,7 @@ def transform_power_data(new_data: Dict) -> Dict[str, PowerFlowData]:
 
     result = {}
     for unit_name, power_values in flow_data.items():
-        hourly_power = [
-            np.mean(power_values[i : i + 6]) for i in range(0, len(power_values), 6)
-        ]
+        hourly_power = hourly_mean(power_values)
         result[unit_name] = {
             "from_": UNIT_NAME_TO_LOCATION[unit_name]["from_"],
             "to": UNIT_NAME_TO_LOCATION[unit_name]["to"],
@@ -120,63 +202,43 @@ def transform_power_data(new_data: Dict) -> Dict[str, PowerFlowData]:
     return result
 
 
-def calculate_power_flow(
-    pg: pd.DataFrame,
-    flow: Dict[str, PowerFlowData],
-    intensity: pd.DataFrame,
-    emission: pd.DataFrame,
-    scale: CalculationScale,
-) -> pd.DataFrame:
-    """Calculate power flow and emission intensity.
-
-    Args:
-        pg: Power generation data
-        flow: Power flow data
-        intensity: Intensity data
-        emission: Emission data
-        scale: Calculation scale
-
-    Returns:
-        DataFrame containing emission intensity
-    """
-    pg_flow = copy.deepcopy(pg).fillna(0)
-    em_flow = copy.deepcopy(emission).fillna(0)
-
-    try:
-        for flow_type, flow_data in flow.items():
-            origin = flow_data["from_"]
-            destination = flow_data["to"]
-            power_values = flow_data["powerkWh"]
-
-            # Power flow calculation
-            pg_flow[destination] = [
-                x + y for x, y in zip(pg_flow[destination], power_values)
-            ]
-            pg_flow[origin] = [x - y for x, y in zip(pg_flow[origin], power_values)]
-
-            # Emission flow calculation
-            em = [x * y for x, y in zip(power_values, intensity[origin].fillna(0))]
-            em_flow[destination] = [x + y for x, y in zip(em_flow[destination], em)]
-            em_flow[origin] = [x - y for x, y in zip(em_flow[origin], em)]
-
-    except Exception as e:
-        logging.warning(f"Error in power flow calculation: {e}")
-        logging.info("Switching to backup method.")
-        flow = transform_power_data(flow)
-        return calculate_power_flow(pg, flow, intensity, emission, scale)
-
-    # Calculate emission intensity
-    EFs = pd.DataFrame()
-    for region in em_flow:
-        if region in EXCLUDED_REGIONS:
-            continue
-        EFs[region] = [
-            x / y if y != 0 else 0 for x, y in zip(em_flow[region], pg_flow[region])
-        ]
-
-    # Calculate national total
-    total_em_flow = sum(em_flow[region] for region in em_flow)
-    total_pg_flow = sum(pg_flow[region] for region in pg_flow)
-    EFs["全台"] = [x / y if y != 0 else 0 for x, y in zip(total_em_flow, total_pg_flow)]
-
-    return EFs
+def _resample_power_data(
+    new_data: Dict, gap_policy: str, datetime_range: str | None
+) -> Dict[str, PowerFlowData]:
+    """Transform power data onto the hourly grid using the record timestamps."""
+    records = collect_unit_records(new_data["records"]["FLOW_P"], value_key="P")
+    start, end = datetime_range.split("|") if datetime_range else (None, None)
+    hourly = resample_hourly(
+        codes=records.codes,
+        timestamps=records.timestamps,
+        values=records.values,
+        n_units=len(records.units),
+        start=start,
+        end=end,
+        gap_policy=gap_policy,
+    )
+
+    # 'nan' and 'drop' keep the hours they leave NaN missing; the intensities
+    # of those hours are NaN after power flow (see `missing_flow_hours`).
+    keep_missing = gap_policy in ("nan", "drop")
+    if hourly.incomplete_hours.any():
+        logging.warning(
+            f"Power flow has {hourly.incomplete_hours.sum()} incomplete corridor-hours "
+            f"(min coverage {hourly.coverage.min():.3f}); "
+            + (
+                f"{np.isnan(hourly.values).any(axis=0).sum()} hours with a missing "
+                f"flow are missing after power flow under gap_policy={gap_policy!r}."
+                if keep_missing
+                else "missing hours count as no flow."
+            )
+        )
+
+    values = hourly.values if keep_missing else np.nan_to_num(hourly.values)
+    result = {}
+    for unit_name, hourly_power in zip(records.units, values):
+        result[unit_name] = {
+            "from_": UNIT_NAME_TO_LOCATION[unit_name]["from_"],
+            "to": UNIT_NAME_TO_LOCATION[unit_name]["to"],
+            "powerkWh": hourly_power.tolist(),
+        }
+    return result
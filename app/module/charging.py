@@ -0,0 +1,268 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from app import profiling
+from app.data import ResultStore
+
+
+def charging_windows(
+    timestamps: pd.DatetimeIndex, start_hour: int, end_hour: int
+) -> np.ndarray:
+    """Daily charging sessions, e.g. plugged in from 22:00 to 06:00.
+
+    Args:
+        timestamps: Hourly timestamps of the intensities
+        start_hour: First hour of each session (0-23)
+        end_hour: Hour the vehicles leave, exclusive; a session runs past
+            midnight when it is not after `start_hour`
+
+    Returns:
+        Session number of every hour, starting at 1, and 0 outside the sessions
+    """
+    hours = pd.DatetimeIndex(timestamps).hour
+    if start_hour < end_hour:
+        inside = (hours >= start_hour) & (hours < end_hour)
+    else:
+        inside = (hours >= start_hour) | (hours < end_hour)
+    inside = np.asarray(inside)
+    starts = inside & ~np.concatenate([[False], inside[:-1]])
+    return np.where(inside, np.cumsum(starts), 0)
+
+
+class ChargingEvaluator:
+    def __init__(
+        self,
+        timestamps: pd.DatetimeIndex,
+        regions: List[str],
+        emission_types: List[str],
+        intensity: np.ndarray,
+    ):
+        """Operating emissions of many fleet charging profiles at once.
+
+        Charging loads are arrays of shape (fleets, hours, regions) in kWh,
+        aligned with the timestamps and regions of the intensities.
+
+        Args:
+            timestamps: Hourly timestamps
+            regions: Region names
+            emission_types: Emission type of each intensity slice
+            intensity: Hourly intensity (g/kWh), shape (emission types, hours,
+                regions); NaN counts as 0
+        """
+        self.timestamps = pd.DatetimeIndex(timestamps)
+        self.regions = list(regions)
+        self.emission_types = list(emission_types)
+        self.intensity = np.nan_to_num(np.asarray(intensity, dtype=float))
+
+    @classmethod
+    def from_intensities(
+        cls, intensities: Dict[str, pd.DataFrame], regions: List[str] | None = None
+    ) -> "ChargingEvaluator":
+        """Evaluator of the output of `estimate_emission_intensity_with_flow`.
+
+        Args:
+            intensities: Hourly intensity of each emission type, one column
+                per region, or a Series for the national scale
+            regions: Regions to keep, in the order of the load columns; all by
+                default
+
+        Returns:
+            ChargingEvaluator of the intensities
+        """
+        frames = {
+            name: data.to_frame() if isinstance(data, pd.Series) else data
+            for name, data in intensities.items()
+        }
+        first = next(iter(frames.values()))
+        regions = list(first.columns) if regions is None else list(regions)
+        return cls(
+            timestamps=first.index,
+            regions=regions,
+            emission_types=list(frames),
+            intensity=np.stack([frame[regions].to_numpy() for frame in frames.values()]),
+        )
+
+    @classmethod
+    def from_store(
+        cls, store: ResultStore, period: str, regions: List[str] | None = None
+    ) -> "ChargingEvaluator":
+        """Evaluator of one period of a result store."""
+        return cls.from_intensities(
+            {e: store.intensity(e, period) for e in store.emission_types},
+            regions=regions,
+        )
+
+    @profiling.profiled("module.charging_emissions")
+    def emissions(self, loads: np.ndarray, by_region: bool = False) -> np.ndarray:
+        """Operating emissions of every fleet.
+
+        Args:
+            loads: Charging load (kWh), shape (fleets, hours, regions) or
+                (hours, regions)
+            by_region: Keep the emissions of each region apart
+
+        Returns:
+            Emissions (g), shape (fleets, emission types) or (fleets, emission
+            types, regions)
+        """
+        loads = self._loads(loads)
+        if by_region:
+            return np.einsum("fhr,ehr->fer", loads, self.intensity, optimize=True)
+        # One matrix product over the flattened (hours, regions) axis.
+        n_fleets = loads.shape[0]
+        return loads.reshape(n_fleets, -1) @ self.intensity.reshape(
+            len(self.emission_types), -1
+        ).T
+
+    @profiling.profiled("module.reallocate_charging")
+    def reallocate(
+        self,
+        loads: np.ndarray,
+        windows: np.ndarray,
+        max_power: float | np.ndarray | None = None,
+        emission_type: str = "CO2e",
+        chunk_size: int = 1024,
+    ) -> np.ndarray:
+        """Move the charging of every session to its lowest-intensity hours.
+
+        The energy of each fleet, region and session is kept and filled
+        greedily into the hours of the session in order of increasing
+        intensity, at most `max_power` per hour. Hours outside the sessions
+        keep their load. Sessions shared by all fleets are sorted once; fleets
+        are processed in chunks of `chunk_size`, which bounds the memory.
+
+        Args:
+            loads: Charging load (kWh), shape (fleets, hours, regions) or
+                (hours, regions)
+            windows: Session number of every hour, 0 where the charging is
+                fixed, shape (hours,) for all fleets or (fleets, hours); see
+                `charging_windows`
+            max_power: Charging limit (kWh per hour), broadcastable to the
+                loads; unlimited by default
+            emission_type: Emission type whose intensity is minimized
+
+        Returns:
+            Reallocated load (kWh), shape (fleets, hours, regions)
+
+        Raises:
+            ValueError: A session holds more energy than `max_power` allows
+        """
+        loads = self._loads(loads)
+        windows = np.atleast_2d(np.asarray(windows, dtype=np.int64))
+        if windows.shape[1] != len(self.timestamps) or windows.shape[0] not in (
+            1,
+            len(loads),
+        ):
+            raise ValueError(
+                f"windows of shape {windows.shape} do not match loads of shape "
+                f"{loads.shape}."
+            )
+        if max_power is not None:
+            max_power = np.broadcast_to(
+                np.asarray(max_power, dtype=float), loads.shape
+            )
+        score = self.intensity[self._emission(emission_type)]
+
+        result = np.empty_like(loads)
+        for start in range(0, len(loads), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            result[chunk] = _shift_sessions(
+                loads[chunk],
+                windows if len(windows) == 1 else windows[chunk],
+                score,
+                None if max_power is None else max_power[chunk],
+            )
+        return result
+
+    def _loads(self, loads: np.ndarray) -> np.ndarray:
+        loads = np.asarray(loads, dtype=float)
+        if not np.isfinite(loads.sum()):
+            loads = np.nan_to_num(loads)
+        if loads.ndim == 2:
+            loads = loads[None]
+        expected = (len(self.timestamps), len(self.regions))
+        if loads.ndim != 3 or loads.shape[1:] != expected:
+            raise ValueError(
+                f"Expected loads of shape (fleets, {expected[0]}, {expected[1]}), "
+                f"got {loads.shape}."
+            )
+        return loads
+
+    def _emission(self, emission_type: str) -> int:
+        try:
+            return self.emission_types.index(emission_type)
+        except ValueError:
+            raise KeyError(
+                f"Unknown emission type {emission_type}; choose from {self.emission_types}"
+            )
+
+
+def _shift_sessions(
+    loads: np.ndarray,
+    windows: np.ndarray,
+    score: np.ndarray,
+    max_power: np.ndarray | None,
+) -> np.ndarray:
+    """Greedy session reallocation of one chunk of fleets.
+
+    Args:
+        loads: Charging load, shape (fleets, hours, regions)
+        windows: Session numbers, shape (1 or fleets, hours)
+        score: Intensity to minimize, shape (hours, regions)
+        max_power: Charging limit with the shape of the loads, or None
+
+    Returns:
+        Reallocated load, shape (fleets, hours, regions)
+    """
+    n_fleets, n_hours, n_regions = loads.shape
+    # Hours last: (fleets, regions, hours)
+    loads = loads.transpose(0, 2, 1)
+    labels = np.broadcast_to(windows[:, None, :], (len(windows), n_regions, n_hours))
+
+    # Order the hours of each row by session, then by intensity.
+    order = np.lexsort(
+        (np.broadcast_to(score.T, labels.shape), labels), axis=-1
+    )
+    restore = np.argsort(order, axis=-1)
+    labels = np.take_along_axis(labels, order, axis=-1)
+    loads = np.take_along_axis(loads, order, axis=-1)
+    starts = np.ones(labels.shape, dtype=bool)
+    starts[..., 1:] = labels[..., 1:] != labels[..., :-1]
+    segments = np.cumsum(starts, axis=-1) - 1
+
+    def segment_totals(values: np.ndarray) -> np.ndarray:
+        """Sum of every session, at each of its hours."""
+        if len(windows) == 1:
+            # Shared sessions sort into the same hour ranges in every row.
+            bounds = np.flatnonzero(starts[0, 0])
+            return np.add.reduceat(values, bounds, axis=-1)[..., segments[0, 0]]
+        rows = n_fleets * n_regions
+        index = np.broadcast_to(segments, values.shape).reshape(rows, n_hours)
+        keys = np.arange(rows)[:, None] * n_hours + index
+        totals = np.bincount(
+            keys.ravel(), weights=values.ravel(), minlength=rows * n_hours
+        ).reshape(rows, n_hours)
+        return np.take_along_axis(totals, index, axis=-1).reshape(values.shape)
+
+    energy = segment_totals(loads)
+    if max_power is None:
+        # Everything goes into the cleanest hour of the session.
+        shifted = np.where(starts, energy, 0.0)
+    else:
+        capacity = np.take_along_axis(max_power.transpose(0, 2, 1), order, axis=-1)
+        flexible = labels > 0
+        short = flexible & (energy > segment_totals(capacity) * (1 + 1e-9) + 1e-9)
+        if short.any():
+            raise ValueError(
+                f"{np.count_nonzero(short & starts)} charging sessions need more "
+                "energy than max_power allows."
+            )
+        # Capacity filled by the cleaner hours of the same session
+        before = np.cumsum(capacity, axis=-1) - capacity
+        filled = before - np.maximum.accumulate(np.where(starts, before, 0.0), axis=-1)
+        shifted = np.clip(energy - filled, 0.0, capacity)
+    shifted = np.where(labels > 0, shifted, loads)
+
+    return np.take_along_axis(shifted, restore, axis=-1).transpose(0, 2, 1)
@@ -7,65 +7,93 @@ from typing import List, Dict, Tuple
 from collections import defaultdict
 from rich.logging import RichHandler
 
+from app import profiling
+from app.data.cube import GenerationCube
+
 
 def calculate_capacity_factor(
-    hourly_pg: Dict[str, Dict[str, Dict[str, List[float]]]],   
+    hourly_pg: Dict[str, Dict[str, Dict[str, List[float]]]] | GenerationCube,
     capacity_data: Dict[str, float],
     fuel_type: str,
     scale: str
 ) -> pd.DataFrame | pd.Series:
 
-    def detect_negative_values(
-        data: list
-    ) -> list:
-        if np.any(np.array(data) < 0):
-            #logging.info(f'There is the station with negative power values: region: {region}, station: {station}.')
-
-            neg_station = np.array(data)
-            neg_station[neg_station < 0] = 0
-            revised_data = neg_station.tolist()
+    regional_capacity_factor, national_capacity_factor = calculate_capacity_factors(
+        hourly_pg=hourly_pg,
+        capacity_data=capacity_data,
+        fuel_type=fuel_type
+    )
 
-            return revised_data
-        else:
-            return data
+    if scale == 'national':
+        #logging.info(f'The avg of national capacity factor:\n{national_capacity_factor.mean()}.')
+        return national_capacity_factor
 
-    national_power = pd.DataFrame()
-    national_capacity: float = 0
-    regional_avg_capacity_factor = pd.DataFrame()
-    if fuel_type in ["陸域風電", "離岸風電"]:
-        fuel_type = "風力"
-    for region, region_data in hourly_pg.items():
-        regional_power = pd.DataFrame()
-        regional_capacity: float = 0
-        for station, station_data in region_data[fuel_type].items():
-            if station in capacity_data:
-                # check if there are negative values, and replace them with zeros.
-                station_data = detect_negative_values(data=station_data)
+    if scale == 'regional':
+        #logging.info(f'The avg of regional capacity factor:\n{regional_capacity_factor.mean()}.')
+        return regional_capacity_factor
 
-                regional_power[station] = station_data 
-                regional_capacity += capacity_data[station]
 
-                national_power[station] = station_data
-                national_capacity += capacity_data[station]
+@profiling.profiled("module.calculate_capacity_factors")
+def calculate_capacity_factors(
+    hourly_pg: Dict[str, Dict[str, Dict[str, List[float]]]] | GenerationCube,
+    capacity_data: Dict[str, float],
+    fuel_type: str
+) -> Tuple[pd.DataFrame, pd.Series]:
+    """Regional and national capacity factors in one vectorized pass.
+
+    Args:
+        hourly_pg: Hourly power generation of every unit
+        capacity_data: Installed capacity (kW) of each station
+        fuel_type: Type of fuel
+
+    Returns:
+        Tuple of the regional capacity factors (one column per region) and
+        the national capacity factor
+    """
+    cube = hourly_pg
+    if not isinstance(cube, GenerationCube):
+        cube = GenerationCube.from_nested(hourly_pg)
 
-        regional_capacity_factor = regional_power.sum(axis=1) / regional_capacity
+    if fuel_type in ["陸域風電", "離岸風電"]:
+        fuel_type = "風力"
 
-        regional_avg_capacity_factor[region] = regional_capacity_factor
+    stations = cube.mask(fuel=fuel_type, units=capacity_data.keys())
+    station_capacity = np.array(
+        [capacity_data[unit] for unit in cube.units[stations]], dtype=float
+    )
+    # Negative power values are replaced with zeros, once for both scales.
+    station_power = np.clip(cube.values[stations], 0, None)
+    if not cube.missing_invalid:
+        station_power = np.nan_to_num(station_power)
+    # Otherwise a missing station-hour leaves its region and the nation NaN.
+    station_regions = cube.region_codes[stations]
+
+    regional_power = np.zeros((len(cube.region_names), cube.n_steps))
+    regional_capacity = np.zeros(len(cube.region_names))
+    for code in range(len(cube.region_names)):
+        in_region = station_regions == code
+        regional_power[code] = station_power[in_region].sum(axis=0)
+        regional_capacity[code] = station_capacity[in_region].sum()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        regional_capacity_factor = regional_power / regional_capacity[:, None]
+    # Regions without stations have no capacity factor.
+    regional_capacity_factor[regional_capacity == 0] = np.nan
+
+    regional_avg_capacity_factor = pd.DataFrame(
+        regional_capacity_factor.T, columns=cube.region_names
+    )
 
     # Eastern region is the average of central and southern region, due to the lack of eastern solar power data.
     if fuel_type in ["太陽能"]:
         if regional_avg_capacity_factor['東部'].isna().all():
             regional_avg_capacity_factor['東部'] = regional_avg_capacity_factor[['中部', '南部']].mean(axis=1)
 
-    national_capacity_factor = national_power.sum(axis=1) / national_capacity
-
-    if scale == 'national':
-        #logging.info(f'The avg of national capacity factor:\n{national_capacity_factor.mean()}.')
-        return national_capacity_factor
+    national_capacity_factor = pd.Series(
+        station_power.sum(axis=0) / station_capacity.sum()
+    )
 
-    if scale == 'regional':
-        #logging.info(f'The avg of regional capacity factor:\n{regional_capacity_factor.mean()}.')
-        return regional_avg_capacity_factor
+    return regional_avg_capacity_factor, national_capacity_factor
 
 
 def calculate_capacity_percentage(
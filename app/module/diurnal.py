@@ -0,0 +1,80 @@
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from app.data import RESULT_STORE_FILE, ResultStore
+
+HOURS_PER_DAY = 24
+CAPACITY_FACTOR_TARGET = "region_capacity_factor"
+
+
+def diurnal_profile(data: pd.DataFrame, by_month: bool = False) -> pd.DataFrame:
+    """Hour-of-day mean of every column, computed with one groupby.
+
+    The hour of a row is its position modulo 24, since every result starts
+    at midnight of its first day; this also covers results without a
+    DatetimeIndex, e.g. the capacity factors. Missing values are skipped.
+
+    Args:
+        data: Hourly values, one column per region
+        by_month: Group by (month, hour) of the DatetimeIndex instead
+
+    Returns:
+        DataFrame of the mean of every column, indexed by 'hour' (0-23) or by
+        ('month', 'hour')
+    """
+    if not by_month:
+        hours = pd.Index(np.arange(len(data)) % HOURS_PER_DAY, name="hour")
+        return data.groupby(hours).mean()
+
+    if not isinstance(data.index, pd.DatetimeIndex):
+        raise ValueError("by_month needs data with a DatetimeIndex")
+    keys = [data.index.month.rename("month"), data.index.hour.rename("hour")]
+    return data.groupby(keys).mean()
+
+
+def diurnal_profiles(
+    results: Dict[str, pd.DataFrame], by_month: bool = False
+) -> Dict[str, pd.DataFrame]:
+    """Diurnal profile of every result, keyed like `results`."""
+    return {
+        name: diurnal_profile(data, by_month=by_month) for name, data in results.items()
+    }
+
+
+def load_diurnal_profiles(
+    result_dir: str | Path, target: str, data_period_list: List[str]
+) -> Dict[str, pd.DataFrame]:
+    """Diurnal profiles of results written by earlier runs.
+
+    Used when figures are regenerated without the in-memory results. Reads
+    the result CSV files, or the result store of runs without CSV outputs.
+
+    Args:
+        result_dir: Directory of the outputs
+        target: File name stem before the period, e.g. 'CO2e_EI'
+        data_period_list: Periods to load
+
+    Returns:
+        Diurnal profile of each period
+    """
+    result_dir = Path(result_dir)
+    store = None
+    profiles = {}
+    for data_period in data_period_list:
+        file_path = result_dir / f"{target}_{data_period}.csv"
+        if file_path.exists() or not (result_dir / RESULT_STORE_FILE).exists():
+            data = pd.read_csv(file_path, encoding="utf-8")
+            # Emission intensity files carry the datetime index as a first column.
+            data = data.select_dtypes("number")
+        else:
+            store = store or ResultStore(result_dir)
+            if target.startswith(CAPACITY_FACTOR_TARGET):
+                fuel_type = target[len(CAPACITY_FACTOR_TARGET) + 1 :]
+                data = store.capacity_factor(fuel_type, data_period)
+            else:
+                data = store.intensity(target.removesuffix("_EI"), data_period)
+        profiles[data_period] = diurnal_profile(data)
+    return profiles
@@ -1,6 +1,10 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 from pathlib import Path
+from typing import Dict
+
+from app import profiling
+from app.module.diurnal import load_diurnal_profiles
 
 fuel_type_mapping = {
     "太陽能": "solar power",
@@ -18,11 +22,30 @@ regions_mapping = {
 }
 
 
+@profiling.profiled("module.create_figure_CF")
 def create_figure_CF(
-    result_dir: str, data_period_list: str, fuel_type: str, target: str
+    result_dir: str,
+    data_period_list: str,
+    fuel_type: str,
+    target: str,
+    profiles: Dict[str, pd.DataFrame] | None = None,
 ):
-    result_dir = result_dir
+    """Diurnal capacity factor of every region.
+
+    Args:
+        result_dir: Directory of the outputs
+        data_period_list: Periods to plot
+        fuel_type: Type of fuel
+        target: File name stem of the capacity factor results
+        profiles: Diurnal profile of each period; read from the result CSV
+            files when omitted
+    """
+    result_dir = Path(result_dir)
     fuel_type_name = fuel_type_mapping.get(fuel_type, "Unknown")
+    if profiles is None:
+        profiles = load_diurnal_profiles(
+            result_dir, f"{target}_{fuel_type}", data_period_list
+        )
 
     fig, axes = plt.subplots(1, 5, figsize=(20, 6), sharex=True, sharey=True)
 
@@ -30,11 +53,7 @@ def create_figure_CF(
         region_name = regions_mapping.get(region, "Unknown")
         ax = axes[i]
         for data_period in data_period_list:
-            file_path = result_dir / f"{target}_{fuel_type}_{data_period}.csv"
-            df = pd.read_csv(file_path, encoding="utf-8")
-            region_data = []
-            for hr in range(24):
-                region_data.append(df[region][df.index % 24 == hr].mean())
+            region_data = profiles[data_period][region].to_numpy()
             ax.plot(range(24), region_data, label=data_period, linewidth=2)
             ax.set_xlabel("Time of day (hr)", fontsize=20)
             ax.set_ylabel(f"{target}", fontsize=20)
@@ -66,18 +85,35 @@ def create_figure_CF(
     plt.savefig(
         result_dir / "figure" / f"{fuel_type}_{target}.png", bbox_inches="tight"
     )
+    plt.close(fig)
 
     return
 
 
+@profiling.profiled("module.create_figure_EI_total")
 def create_figure_EI_total(
     result_dir: str,
     data_period_list: str,
     targets: list,
     limits: list,
+    profiles: Dict[str, Dict[str, pd.DataFrame]] | None = None,
 ):
+    """Diurnal emission intensity of every region and emission type.
+
+    Args:
+        result_dir: Directory of the outputs
+        data_period_list: Periods to plot
+        targets: File name stems of the emission intensity results
+        limits: Lower and upper y-axis bound of each target
+        profiles: Diurnal profile of each target and period; targets without
+            profiles are read from the result CSV files
+    """
     result_dir = Path(result_dir)
+    profiles = dict(profiles or {})
     fig, axes = plt.subplots(4, 5, figsize=(24, 16), sharex=True, sharey="row")
+    for target in targets:
+        if target not in profiles:
+            profiles[target] = load_diurnal_profiles(result_dir, target, data_period_list)
     for i, (target, limit) in enumerate(zip(targets, limits)):
         for j, region in enumerate(["北部", "中部", "南部", "東部", "全台"]):
             region_name = regions_mapping.get(region, "Unknown")
@@ -85,11 +121,7 @@ def create_figure_EI_total(
             if j == 0:
                 ax.set_ylabel(f"{target} (g/kWh)", fontsize=20)
             for data_period in data_period_list:
-                file_path = result_dir / f"{target}_{data_period}.csv"
-                df = pd.read_csv(file_path, encoding="utf-8")
-                region_data = []
-                for hr in range(24):
-                    region_data.append(df[region][df.index % 24 == hr].mean())
+                region_data = profiles[target][data_period][region].to_numpy()
                 ax.plot(range(24), region_data, label=data_period, linewidth=2)
                 if i == 3:
                     ax.set_xlabel("Time of day (hr)", fontsize=20)
@@ -120,5 +152,6 @@ def create_figure_EI_total(
     )
     (result_dir / "figure").mkdir(parents=True, exist_ok=True)
     plt.savefig(result_dir / "figure" / "total_EI.png", bbox_inches="tight")
+    plt.close(fig)
 
     return
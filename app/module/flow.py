@@ -0,0 +1,381 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app import profiling
+
+from .api import (
+    CalculationScale,
+    PowerFlowData,
+    intensity_kernel,
+    transform_power_data,
+)
+from .constants import EXCLUDED_REGIONS
+
+NATIONAL = "全台"
+
+
+def build_incidence_matrix(
+    regions: List[str], flow: Dict[str, PowerFlowData]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Region x corridor incidence matrix of the power flow corridors.
+
+    A corridor's column is +1 at its destination and -1 at its origin, so
+    `flows @ incidence.T` is the net import of every region. With four regions
+    and twelve corridors a dense array is smaller than any sparse format.
+
+    Args:
+        regions: Region names defining the row order
+        flow: Hourly power flow of every corridor
+
+    Returns:
+        Tuple of the incidence matrix (regions, corridors) and the origin
+        region index of every corridor
+    """
+    incidence = np.zeros((len(regions), len(flow)))
+    origins = np.empty(len(flow), dtype=np.intp)
+    for i, corridor in enumerate(flow.values()):
+        origin = regions.index(corridor["from_"])
+        destination = regions.index(corridor["to"])
+        incidence[destination, i] += 1.0
+        incidence[origin, i] -= 1.0
+        origins[i] = origin
+    return incidence, origins
+
+
+def stack_flows(
+    flow: Dict[str, PowerFlowData], n_hours: int, fill_missing: bool = True
+) -> np.ndarray:
+    """Hourly corridor flows as an array of shape (hours, corridors).
+
+    Missing flows (NaN) count as no flow unless `fill_missing` is False.
+    """
+    flows = np.column_stack([corridor["powerkWh"] for corridor in flow.values()])
+    if flows.shape[0] != n_hours:
+        raise ValueError(
+            f"Power flow has {flows.shape[0]} hours but generation has {n_hours}."
+        )
+    return np.nan_to_num(flows) if fill_missing else flows
+
+
+def missing_flow_hours(
+    flow: Dict[str, PowerFlowData], n_hours: int, missing: np.ndarray | None = None
+) -> np.ndarray:
+    """Hours missing after power flow.
+
+    The flows couple all regions, so an hour with a missing corridor flow, or
+    with a missing region-hour given by `missing`, is missing everywhere.
+
+    Args:
+        flow: Hourly power flow of every corridor
+        n_hours: Number of hours
+        missing: Hours already missing before power flow, shape (hours,)
+
+    Returns:
+        Boolean mask of shape (hours,)
+    """
+    flows = stack_flows(flow, n_hours=n_hours, fill_missing=False)
+    hours = np.isnan(flows).any(axis=1)
+    return hours if missing is None else hours | missing
+
+
+def apply_power_flow(
+    generation: np.ndarray,
+    emissions: np.ndarray,
+    intensity: np.ndarray,
+    flows: np.ndarray,
+    incidence: np.ndarray,
+    origins: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Move generation and emissions along the corridors.
+
+    Every corridor carries emissions at the pre-flow intensity of its origin.
+    Leading batch dimensions (e.g. scenarios or samples) are broadcast.
+
+    Args:
+        generation: Generation (kWh), shape (..., hours, regions)
+        emissions: Emissions (g), shape (..., pollutants, hours, regions)
+        intensity: Pre-flow intensity (g/kWh), same shape as `emissions`
+        flows: Corridor flows (kWh), shape (hours, corridors)
+        incidence: Incidence matrix, shape (regions, corridors)
+        origins: Origin region index of every corridor
+
+    Returns:
+        Tuple of the adjusted generation and adjusted emissions
+    """
+    adjusted_generation = generation + flows @ incidence.T
+    carried_emissions = flows * intensity[..., origins]
+    adjusted_emissions = emissions + carried_emissions @ incidence.T
+    return adjusted_generation, adjusted_emissions
+
+
+def flow_intensity(generation: np.ndarray, emissions: np.ndarray) -> np.ndarray:
+    """Regional and national intensity, 0 where generation is 0.
+
+    Args:
+        generation: Generation, shape (..., hours, regions)
+        emissions: Emissions, shape (..., pollutants, hours, regions)
+
+    Returns:
+        Intensity of shape (..., pollutants, hours, regions + 1) with the
+        national intensity last
+    """
+    generation = np.concatenate(
+        [generation, generation.sum(axis=-1, keepdims=True)], axis=-1
+    )
+    emissions = np.concatenate(
+        [emissions, emissions.sum(axis=-1, keepdims=True)], axis=-1
+    )
+    intensity, _ = intensity_kernel(emissions, generation)
+    return intensity
+
+
+def trace_power_flow(
+    generation: np.ndarray,
+    emissions: np.ndarray,
+    flows: np.ndarray,
+    incidence: np.ndarray,
+) -> np.ndarray:
+    """Regional intensity by proportional-sharing flow tracing.
+
+    The power leaving a region is assumed to be the same mix as the power
+    entering it (local generation plus imports), so transit flows such as
+    南部 -> 中部 -> 北部 carry the emissions of their original sources. For
+    every hour the mixed intensity c solves
+
+        (G_i + sum_j F_ji) c_i - sum_j F_ji c_j = E_i
+
+    with G the local generation, E the local emissions and F the net flows
+    between regions. All hours and emission types are solved in one stacked
+    `numpy.linalg.solve`.
+
+    Args:
+        generation: Local generation (kWh), shape (..., hours, regions)
+        emissions: Local emissions (g), shape (..., pollutants, hours, regions)
+        flows: Corridor flows (kWh), shape (hours, corridors)
+        incidence: Incidence matrix, shape (regions, corridors)
+
+    Returns:
+        Regional intensity of shape (..., pollutants, hours, regions)
+    """
+    # Gross region-to-region flows, (hours, from, to)
+    origin = (incidence < 0).astype(float)
+    destination = (incidence > 0).astype(float)
+    gross = np.einsum("hc,ic,jc->hij", flows, origin, destination)
+    # Net flows in the direction they actually run
+    net = np.clip(gross - np.swapaxes(gross, -1, -2), 0, None)
+
+    imports = np.swapaxes(net, -1, -2)  # imports[h, i, j] = flow j -> i
+    throughflow = generation + imports.sum(axis=-1)
+    system = -np.broadcast_to(imports, throughflow.shape + imports.shape[-1:]).copy()
+    diagonal = np.arange(system.shape[-1])
+    # Regions without generation or imports get intensity 0.
+    idle = throughflow == 0
+    system[..., diagonal, diagonal] = np.where(idle, 1.0, throughflow)
+
+    local_emissions = np.moveaxis(emissions, -3, -1)  # (..., hours, regions, pollutants)
+    local_emissions = np.where(idle[..., None], 0.0, local_emissions)
+    intensity = np.linalg.solve(system, local_emissions)
+    return np.moveaxis(intensity, -1, -3)
+
+
+@profiling.profiled("module.calculate_flow_tracing")
+def calculate_flow_tracing(
+    pg: pd.DataFrame,
+    flow: Dict[str, PowerFlowData],
+    emissions: Dict[str, pd.DataFrame],
+    missing: np.ndarray | None = None,
+) -> Dict[str, pd.DataFrame]:
+    """Emission intensity with flow tracing for several emission types at once.
+
+    Args:
+        pg: Power generation data
+        flow: Hourly power flow of every corridor
+        emissions: Regional emissions of each emission type
+        missing: Hours with missing generation data, shape (hours,)
+
+    Returns:
+        Dictionary of regional and national (全台) emission intensity, NaN in
+        the hours missing after power flow (see `missing_flow_hours`)
+    """
+    if "records" in flow:
+        flow = transform_power_data(flow)
+
+    emission_types = list(emissions)
+    regions = [
+        region
+        for region in emissions[emission_types[0]].columns
+        if region not in EXCLUDED_REGIONS
+    ]
+
+    generation = pg[regions].fillna(0).to_numpy(dtype=float)
+    stacked_emissions = np.stack(
+        [emissions[e][regions].fillna(0).to_numpy(dtype=float) for e in emission_types]
+    )
+
+    incidence, _ = build_incidence_matrix(regions, flow)
+    regional = trace_power_flow(
+        generation=generation,
+        emissions=stacked_emissions,
+        flows=stack_flows(flow, n_hours=len(generation)),
+        incidence=incidence,
+    )
+    # Flows cancel out nationally.
+    national = flow_intensity(generation, stacked_emissions)[..., -1:]
+    intensity = np.concatenate([regional, national], axis=-1)
+    intensity[:, missing_flow_hours(flow, len(generation), missing)] = np.nan
+
+    return {
+        emission_type: pd.DataFrame(
+            intensity[i], columns=regions + [NATIONAL], index=pg.index
+        )
+        for i, emission_type in enumerate(emission_types)
+    }
+
+
+def calculate_power_flow(
+    pg: pd.DataFrame,
+    flow: Dict[str, PowerFlowData],
+    intensity: pd.DataFrame,
+    emission: pd.DataFrame,
+    scale: CalculationScale,
+) -> pd.DataFrame:
+    """Calculate power flow and emission intensity.
+
+    Args:
+        pg: Power generation data
+        flow: Power flow data
+        intensity: Intensity data
+        emission: Emission data
+        scale: Calculation scale
+
+    Returns:
+        DataFrame containing emission intensity
+    """
+    return calculate_power_flow_batched(
+        pg=pg,
+        flow=flow,
+        intensities={"emission": intensity},
+        emissions={"emission": emission},
+    )["emission"]
+
+
+@profiling.profiled("module.calculate_power_flow_batched")
+def calculate_power_flow_batched(
+    pg: pd.DataFrame,
+    flow: Dict[str, PowerFlowData],
+    intensities: Dict[str, pd.DataFrame],
+    emissions: Dict[str, pd.DataFrame],
+) -> Dict[str, pd.DataFrame]:
+    """Emission intensity with power flow for several emission types at once.
+
+    Args:
+        pg: Power generation data
+        flow: Hourly power flow of every corridor
+        intensities: Pre-flow regional intensity of each emission type
+        emissions: Regional emissions of each emission type
+
+    Returns:
+        Dictionary of regional and national (全台) emission intensity
+    """
+    generation, adjusted_emissions = calculate_power_flow_balance(
+        pg=pg, flow=flow, intensities=intensities, emissions=emissions
+    )
+    return balance_intensities(generation, adjusted_emissions)
+
+
+def calculate_power_flow_balance(
+    pg: pd.DataFrame,
+    flow: Dict[str, PowerFlowData],
+    intensities: Dict[str, pd.DataFrame],
+    emissions: Dict[str, pd.DataFrame],
+    missing: np.ndarray | None = None,
+) -> Tuple[pd.DataFrame, Dict[str, pd.DataFrame]]:
+    """Generation and emissions of every region after power flow.
+
+    Args:
+        pg: Power generation data
+        flow: Hourly power flow of every corridor
+        intensities: Pre-flow regional intensity of each emission type
+        emissions: Regional emissions of each emission type
+        missing: Hours with missing generation data, shape (hours,)
+
+    Returns:
+        Tuple of the adjusted generation (kWh) and the adjusted emissions (g)
+        of each emission type, with the national (全台) total last; NaN in
+        the hours missing after power flow (see `missing_flow_hours`)
+    """
+    if "records" in flow:
+        flow = transform_power_data(flow)
+
+    emission_types = list(emissions)
+    regions = [
+        region
+        for region in emissions[emission_types[0]].columns
+        if region not in EXCLUDED_REGIONS
+    ]
+
+    generation = pg[regions].fillna(0).to_numpy(dtype=float)
+    stacked_emissions = np.stack(
+        [emissions[e][regions].fillna(0).to_numpy(dtype=float) for e in emission_types]
+    )
+    stacked_intensity = np.stack(
+        [
+            pd.DataFrame(intensities[e])[regions].fillna(0).to_numpy(dtype=float)
+            for e in emission_types
+        ]
+    )
+
+    incidence, origins = build_incidence_matrix(regions, flow)
+    adjusted_generation, adjusted_emissions = apply_power_flow(
+        generation=generation,
+        emissions=stacked_emissions,
+        intensity=stacked_intensity,
+        flows=stack_flows(flow, n_hours=len(generation)),
+        incidence=incidence,
+        origins=origins,
+    )
+    # National totals, summed like flow_intensity
+    adjusted_generation = np.concatenate(
+        [adjusted_generation, adjusted_generation.sum(axis=-1, keepdims=True)], axis=-1
+    )
+    adjusted_emissions = np.concatenate(
+        [adjusted_emissions, adjusted_emissions.sum(axis=-1, keepdims=True)], axis=-1
+    )
+    hours = missing_flow_hours(flow, len(generation), missing)
+    adjusted_generation[hours] = np.nan
+    adjusted_emissions[:, hours] = np.nan
+
+    columns = regions + [NATIONAL]
+    return pd.DataFrame(adjusted_generation, columns=columns, index=pg.index), {
+        emission_type: pd.DataFrame(
+            adjusted_emissions[i], columns=columns, index=pg.index
+        )
+        for i, emission_type in enumerate(emission_types)
+    }
+
+
+def balance_intensities(
+    generation: pd.DataFrame, emissions: Dict[str, pd.DataFrame]
+) -> Dict[str, pd.DataFrame]:
+    """Intensity of each emission type from generation and emissions frames.
+
+    Args:
+        generation: Generation (kWh), one column per region
+        emissions: Emissions (g) of each emission type, same shape
+
+    Returns:
+        Dictionary of the intensity of each emission type, 0 where generation
+        is 0
+    """
+    intensity, _ = intensity_kernel(
+        np.stack([emissions[e][generation.columns].to_numpy() for e in emissions]),
+        generation.to_numpy(),
+    )
+    return {
+        emission_type: pd.DataFrame(
+            intensity[i], columns=generation.columns, index=generation.index
+        )
+        for i, emission_type in enumerate(emissions)
+    }
@@ -0,0 +1,218 @@
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+from absl import logging
+
+from app.data import ResultStore
+from .api import intensity_kernel
+
+
+def _window_intensity(emissions: np.ndarray, generation: np.ndarray) -> np.ndarray:
+    """Intensity of summed windows, NaN where a window has no generation.
+
+    Args:
+        emissions: Window emissions, shape (emission types, windows, regions)
+        generation: Window generation, shape (windows, regions)
+
+    Returns:
+        Intensity, shape (windows, emission types, regions)
+    """
+    intensity, zero_generation = intensity_kernel(emissions, generation)
+    # A window without covered hours or generation has no intensity, not 0.
+    intensity[:, zero_generation] = np.nan
+    return np.swapaxes(intensity, 0, 1)
+
+
+class IntensityIndex:
+    def __init__(
+        self,
+        timestamps: pd.DatetimeIndex,
+        regions: List[str],
+        emission_types: List[str],
+        emissions: np.ndarray,
+        generation: np.ndarray,
+    ):
+        """Generation-weighted emission intensity of arbitrary time windows.
+
+        Cumulative sums of the hourly emissions and generation of every
+        region are built once, so the intensity of any contiguous window is
+        two lookups and one division, whatever its length.
+
+        Args:
+            timestamps: Hourly timestamps, sorted
+            regions: Region names
+            emission_types: Emission type of each emission slice
+            emissions: Hourly emissions (g), shape (emission types, hours, regions)
+            generation: Hourly generation (kWh), shape (hours, regions)
+        """
+        self.timestamps = pd.DatetimeIndex(timestamps)
+        self.regions = list(regions)
+        self.emission_types = list(emission_types)
+        self.emissions = np.nan_to_num(np.asarray(emissions, dtype=float))
+        self.generation = np.nan_to_num(np.asarray(generation, dtype=float))
+
+        # Zero row first, so the sum of hours [i, j) is cum[j] - cum[i].
+        self._cumulative_emissions = np.zeros(
+            (len(self.emission_types), len(self.timestamps) + 1, len(self.regions))
+        )
+        np.cumsum(self.emissions, axis=1, out=self._cumulative_emissions[:, 1:])
+        self._cumulative_generation = np.zeros(
+            (len(self.timestamps) + 1, len(self.regions))
+        )
+        np.cumsum(self.generation, axis=0, out=self._cumulative_generation[1:])
+
+    @classmethod
+    def from_balance(
+        cls, generation: pd.DataFrame, emissions: Dict[str, pd.DataFrame]
+    ) -> "IntensityIndex":
+        """Index of the generation and emissions after power flow.
+
+        Args:
+            generation: Hourly generation (kWh), indexed by datetime with one
+                column per region
+            emissions: Hourly emissions (g) of each emission type, same shape
+
+        Returns:
+            IntensityIndex of the frames
+        """
+        regions = list(generation.columns)
+        return cls(
+            timestamps=generation.index,
+            regions=regions,
+            emission_types=list(emissions),
+            emissions=np.stack([frame[regions].to_numpy() for frame in emissions.values()]),
+            generation=generation.to_numpy(),
+        )
+
+    @classmethod
+    def from_store(cls, store: ResultStore, period: str) -> "IntensityIndex":
+        """Index of one period of a result store.
+
+        Stores converted from CSV outputs hold intensities only; their index
+        weighs every hour equally.
+
+        Args:
+            store: Result store
+            period: Name of the period
+
+        Returns:
+            IntensityIndex of the period
+        """
+        regions = store.regions(period)
+        timestamps = store.timestamps(period)
+        if store.has_balance(period):
+            generation = store.generation(period).to_numpy()
+            emissions = np.stack(
+                [store.emissions(e, period).to_numpy() for e in store.emission_types]
+            )
+        else:
+            logging.warning(
+                f"Result store {store.file_path} has no generation for {period}; "
+                "window intensities are unweighted means."
+            )
+            generation = np.ones((len(timestamps), len(regions)))
+            emissions = np.stack(
+                [store.intensity(e, period).to_numpy() for e in store.emission_types]
+            )
+        return cls(timestamps, regions, store.emission_types, emissions, generation)
+
+    def positions(self, times: Iterable) -> np.ndarray:
+        """Index of the first hour at or after each time."""
+        times = pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(times)))
+        return np.searchsorted(self.timestamps.values, times.values, side="left")
+
+    def windows(self, starts: Iterable, ends: Iterable) -> np.ndarray:
+        """Intensity of many windows at once.
+
+        Args:
+            starts: First hour of each window, inclusive
+            ends: End of each window, exclusive
+
+        Returns:
+            Intensity (g/kWh), shape (windows, emission types, regions), NaN
+            where the window has no covered hours or no generation
+        """
+        first, last = self.positions(starts), self.positions(ends)
+        emissions = self._cumulative_emissions[:, last] - self._cumulative_emissions[:, first]
+        generation = self._cumulative_generation[last] - self._cumulative_generation[first]
+        return _window_intensity(emissions, generation)
+
+    def window(self, start, end) -> pd.DataFrame:
+        """Intensity of the hours from `start` (inclusive) to `end` (exclusive).
+
+        Returns:
+            DataFrame with one row per emission type and one column per region,
+            NaN outside the indexed hours
+        """
+        return pd.DataFrame(
+            self.windows([start], [end])[0],
+            index=self.emission_types,
+            columns=self.regions,
+        )
+
+    def masked(self, masks: np.ndarray) -> np.ndarray:
+        """Intensity of arbitrary sets of hours.
+
+        Args:
+            masks: Boolean hour masks, shape (hours,) or (queries, hours)
+
+        Returns:
+            Intensity (g/kWh), shape (emission types, regions) or (queries,
+            emission types, regions), NaN where no hour with generation matches
+        """
+        single = np.ndim(masks) == 1
+        masks = np.atleast_2d(np.asarray(masks, dtype=float))
+        emissions = masks @ self.emissions  # (emission types, queries, regions)
+        generation = masks @ self.generation
+        intensity = _window_intensity(emissions, generation)
+        return intensity[0] if single else intensity
+
+    def calendar_mask(
+        self,
+        months: Iterable[int] | None = None,
+        weekdays: Iterable[int] | None = None,
+        hours: Iterable[int] | None = None,
+        start=None,
+        end=None,
+    ) -> np.ndarray:
+        """Boolean mask of the hours matching calendar conditions.
+
+        Args:
+            months: Months to keep (1-12)
+            weekdays: Days of the week to keep (Monday=0)
+            hours: Hours of the day to keep (0-23)
+            start: First hour to keep, inclusive
+            end: End of the hours to keep, exclusive
+
+        Returns:
+            Mask of shape (hours,)
+        """
+        mask = np.ones(len(self.timestamps), dtype=bool)
+        if months is not None:
+            mask &= np.isin(self.timestamps.month, list(months))
+        if weekdays is not None:
+            mask &= np.isin(self.timestamps.weekday, list(weekdays))
+        if hours is not None:
+            mask &= np.isin(self.timestamps.hour, list(hours))
+        if start is not None:
+            mask[: self.positions(start)[0]] = False
+        if end is not None:
+            mask[self.positions(end)[0] :] = False
+        return mask
+
+    def calendar(self, **conditions) -> pd.DataFrame:
+        """Intensity of the hours matching `calendar_mask(**conditions)`.
+
+        For example `calendar(months=[7], weekdays=range(5), hours=range(18, 22))`
+        is the weekday 18:00-22:00 intensity in July.
+
+        Returns:
+            DataFrame with one row per emission type and one column per region,
+            NaN when no indexed hour matches
+        """
+        return pd.DataFrame(
+            self.masked(self.calendar_mask(**conditions)),
+            index=self.emission_types,
+            columns=self.regions,
+        )
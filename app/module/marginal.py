@@ -0,0 +1,239 @@
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app import profiling
+
+HOURS_PER_DAY = 24
+# Meteorological seasons, indexed by (month % 12) // 3
+SEASONS = ["winter", "spring", "summer", "autumn"]
+
+
+@dataclass
+class MarginalEmissionFactors:
+    """Marginal emission factors of every group of hours.
+
+    Attributes:
+        emission_types: Emission type of each factor slice
+        regions: Region names
+        groups: Group of each factor row, by season and/or hour of the day
+        factors: Marginal emission factor dE/dG (g/kWh), shape (emission
+            types, groups, regions); NaN where a group has too few samples
+        r2: Coefficient of determination of each regression, same shape
+        samples: Number of hourly changes in each regression, shape (groups,
+            regions)
+    """
+
+    emission_types: List[str]
+    regions: List[str]
+    groups: pd.Index
+    factors: np.ndarray
+    r2: np.ndarray
+    samples: np.ndarray
+
+    def to_frame(self, emission_type: str) -> pd.DataFrame:
+        """Factors of one emission type, one row per group."""
+        i = self.emission_types.index(emission_type)
+        return pd.DataFrame(self.factors[i], index=self.groups, columns=self.regions)
+
+
+def _hourly_changes(
+    generation: pd.DataFrame, emissions: Dict[str, pd.DataFrame]
+) -> Tuple[pd.DatetimeIndex, List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """Hour-to-hour changes of generation and emissions on whole days.
+
+    The changes are placed on a regular hourly grid from midnight of the
+    first day to the end of the last day. Hours without a valid change, i.e.
+    gaps, missing values and the padding, get weight 0. Only the regions
+    with both generation and emissions are kept, e.g. not 離島 for the
+    regional emissions.
+
+    Args:
+        generation: Hourly generation (kWh), indexed by datetime with one
+            column per region
+        emissions: Hourly emissions (g) of each emission type, same shape
+
+    Returns:
+        Tuple of the grid timestamps, the regions, the generation change
+        (hours, regions), the emission changes (emission types, hours,
+        regions) and the weights (hours, regions)
+
+    Raises:
+        TypeError: The generation is not indexed by datetime
+    """
+    if not isinstance(generation.index, pd.DatetimeIndex):
+        # A positional index has no hour-to-hour changes to fit.
+        raise TypeError(
+            "Marginal emission factors need generation indexed by datetime, got "
+            f"{type(generation.index).__name__}."
+        )
+    timestamps = generation.index
+    regions = [
+        region
+        for region in generation.columns
+        if all(region in frame.columns for frame in emissions.values())
+    ]
+    g = generation[regions].to_numpy(dtype=float)
+    e = np.stack([emissions[name][regions].to_numpy(dtype=float) for name in emissions])
+
+    # A change is valid only between consecutive hours.
+    consecutive = np.diff(timestamps.values) == np.timedelta64(1, "h")
+    dg = np.diff(g, axis=0)
+    de = np.diff(e, axis=1)
+    valid = consecutive[:, None] & np.isfinite(dg) & np.isfinite(de).all(axis=0)
+
+    grid = pd.date_range(
+        timestamps[0].normalize(),
+        timestamps[-1].normalize() + pd.Timedelta(hours=HOURS_PER_DAY - 1),
+        freq="h",
+    )
+    rows = (timestamps[1:] - grid[0]) // pd.Timedelta(hours=1)
+    x = np.zeros((len(grid), len(regions)))
+    y = np.zeros((len(e), len(grid), len(regions)))
+    weights = np.zeros((len(grid), len(regions)))
+    x[rows] = np.where(valid, dg, 0.0)
+    y[:, rows] = np.where(valid, de, 0.0)
+    weights[rows] = valid
+    return grid, regions, x, y, weights
+
+
+def _moments(x: np.ndarray, y: np.ndarray, weights: np.ndarray) -> List[np.ndarray]:
+    """Terms of the least-squares sums, with the hours on axis -2."""
+    wx = weights * x
+    return [weights, wx, weights * y, wx * x, wx * y, weights * y * y]
+
+
+def _regression(
+    sums: List[np.ndarray], min_samples: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Slope and R² of y on x from grouped sums, with an intercept.
+
+    Args:
+        sums: Sums of 1, x, y, x², xy and y² of every group
+        min_samples: Fewest samples for a slope
+
+    Returns:
+        Tuple of the slope, R² and the number of samples
+    """
+    n, sx, sy, sxx, sxy, syy = sums
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        cov = sxy - sx * sy / n
+        slope = cov / var_x
+        r2 = cov * cov / (var_x * var_y)
+    unfit = (n < max(min_samples, 2)) | ~(var_x > 0)
+    return np.where(unfit, np.nan, slope), np.where(unfit, np.nan, r2), n
+
+
+@profiling.profiled("module.marginal_emission_factors")
+def marginal_emission_factors(
+    generation: pd.DataFrame,
+    emissions: Dict[str, pd.DataFrame],
+    by_hour: bool = True,
+    by_season: bool = True,
+    min_samples: int = 10,
+) -> MarginalEmissionFactors:
+    """Binned marginal emission factors of every region and emission type.
+
+    The factor of a group is the least-squares slope of the hour-to-hour
+    emission change on the generation change over all hours of the group.
+    Every group, region and emission type is fitted at once from grouped
+    sums, computed as one matrix product with the group indicator.
+
+    Args:
+        generation: Hourly generation (kWh), indexed by datetime with one
+            column per region, e.g. from `calculate_power_flow_balance`
+        emissions: Hourly emissions (g) of each emission type, same shape
+        by_hour: Group by the hour of the day
+        by_season: Group by meteorological season
+        min_samples: Fewest hourly changes for a factor
+
+    Returns:
+        MarginalEmissionFactors of every group
+
+    Raises:
+        TypeError: The generation is not indexed by datetime
+    """
+    grid, regions, x, y, weights = _hourly_changes(generation, emissions)
+    hours = np.arange(len(grid)) % HOURS_PER_DAY
+    seasons = (grid.month.to_numpy() % 12) // 3
+
+    if by_season and by_hour:
+        groups = pd.MultiIndex.from_product(
+            [SEASONS, range(HOURS_PER_DAY)], names=["season", "hour"]
+        )
+        group = seasons * HOURS_PER_DAY + hours
+    elif by_season:
+        groups = pd.Index(SEASONS, name="season")
+        group = seasons
+    elif by_hour:
+        groups = pd.Index(range(HOURS_PER_DAY), name="hour")
+        group = hours
+    else:
+        groups = pd.Index(["all"], name="group")
+        group = np.zeros(len(grid), dtype=int)
+
+    indicator = (group[None, :] == np.arange(len(groups))[:, None]).astype(float)
+    sums = [indicator @ moment for moment in _moments(x, y, weights)]
+    factors, r2, samples = _regression(sums, min_samples)
+    return MarginalEmissionFactors(
+        emission_types=list(emissions),
+        regions=regions,
+        groups=groups,
+        factors=factors,
+        r2=r2,
+        samples=samples.astype(int),
+    )
+
+
+@profiling.profiled("module.rolling_marginal_emission_factors")
+def rolling_marginal_emission_factors(
+    generation: pd.DataFrame,
+    emissions: Dict[str, pd.DataFrame],
+    window_days: int = 30,
+    min_samples: int = 10,
+) -> Dict[str, pd.DataFrame]:
+    """Time-varying marginal emission factors by hour of the day.
+
+    The factor of an hour is the regression over the same hour of the day in
+    the `window_days` days up to and including it. The window sums come from
+    cumulative sums over the days, so the cost does not depend on the window.
+
+    Args:
+        generation: Hourly generation (kWh), indexed by datetime with one
+            column per region
+        emissions: Hourly emissions (g) of each emission type, same shape
+        window_days: Length of the trailing window (days)
+        min_samples: Fewest hourly changes for a factor
+
+    Returns:
+        Hourly marginal emission factor (g/kWh) of each emission type, indexed
+        like `generation`; NaN until the window holds `min_samples` changes
+
+    Raises:
+        TypeError: The generation is not indexed by datetime
+    """
+    grid, regions, x, y, weights = _hourly_changes(generation, emissions)
+    n_days = len(grid) // HOURS_PER_DAY
+
+    sums = []
+    for moment in _moments(x, y, weights):
+        # (..., days, hours of the day, regions), with a zero day first
+        daily = moment.reshape(*moment.shape[:-2], n_days, HOURS_PER_DAY, -1)
+        cumulative = np.zeros((*daily.shape[:-3], n_days + 1, *daily.shape[-2:]))
+        np.cumsum(daily, axis=-3, out=cumulative[..., 1:, :, :])
+        first = np.maximum(np.arange(1, n_days + 1) - window_days, 0)
+        window = cumulative[..., 1:, :, :] - cumulative[..., first, :, :]
+        sums.append(window.reshape(moment.shape))
+    factors, _, _ = _regression(sums, min_samples)
+
+    rows = (pd.DatetimeIndex(generation.index) - grid[0]) // pd.Timedelta(hours=1)
+    return {
+        name: pd.DataFrame(
+            factors[i, rows], index=generation.index, columns=regions
+        )
+        for i, name in enumerate(emissions)
+    }
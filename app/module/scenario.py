@@ -0,0 +1,192 @@
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from app import profiling
+
+from .api import PowerFlowData, transform_power_data
+from .constants import EXCLUDED_REGIONS
+from .flow import (
+    NATIONAL,
+    apply_power_flow,
+    build_incidence_matrix,
+    flow_intensity,
+    missing_flow_hours,
+    stack_flows,
+)
+
+AGGREGATIONS = ("hourly", "mean", "weighted")
+
+
+@dataclass
+class ScenarioSweep:
+    """Regional emission intensity of many capacity scenarios.
+
+    Attributes:
+        targets: Capacity of each target fuel (GW), shape (scenarios, fuels)
+        emission_types: Emission type of each intensity slice
+        regions: Region names, with the national intensity (全台) last
+        intensity: Intensity (g/kWh), shape (scenarios, emission types,
+            hours, regions) for 'hourly' or (scenarios, emission types,
+            regions) for the aggregated sweeps
+    """
+
+    targets: np.ndarray
+    emission_types: List[str]
+    regions: List[str]
+    intensity: np.ndarray
+
+    def to_frame(self, emission_type: str) -> pd.DataFrame:
+        """Aggregated intensity of one emission type, one row per scenario."""
+        if self.intensity.ndim != 3:
+            raise ValueError("to_frame needs an aggregated sweep.")
+        i = self.emission_types.index(emission_type)
+        return pd.DataFrame(self.intensity[:, i, :], columns=self.regions)
+
+
+@profiling.profiled("module.sweep_capacity_scenarios")
+def sweep_capacity_scenarios(
+    base_generation: pd.DataFrame,
+    unit_generation: List[pd.DataFrame],
+    emissions: Dict[str, pd.DataFrame],
+    targets: np.ndarray,
+    flow: Dict[str, PowerFlowData] | None = None,
+    aggregate: str = "mean",
+    chunk_size: int = 256,
+    dtype: np.dtype | str = np.float64,
+    out: np.ndarray | None = None,
+) -> ScenarioSweep:
+    """Evaluate the emission intensity of many capacity targets at once.
+
+    Target generation is linear in capacity, so the generation of scenario s
+    is `base + sum_f targets[s, f] * unit_generation[f]`, and emissions do not
+    depend on the targets. Scenarios are evaluated as broadcast array
+    operations in chunks of `chunk_size`, which bounds the intermediate memory.
+
+    Memory is the result plus the intermediates of one chunk. An 'hourly'
+    result holds scenarios * emission types * hours * (regions + 1) values:
+    10,000 scenarios of a year with 4 emission types and the 4 mainland
+    regions take 10,000 * 4 * 8,760 * 5 * 8 bytes = 14 GB in float64. Pass
+    `out`, e.g. a `numpy.lib.format.open_memmap` array, to write the result
+    to disk chunk by chunk, and/or a float32 `dtype` to halve it. The
+    intermediates of a chunk are about chunk_size * emission types * hours *
+    (4 * (regions + 1) + corridors) float64 values whatever the number of
+    scenarios: 2.3 GB for a year with the 12 corridors at the default
+    chunk_size, 290 MB at chunk_size=32.
+
+    Hours where `base_generation` is NaN, or a corridor flow is missing,
+    hold missing data (see `GenerationCube.missing_invalid`): they are NaN in
+    'hourly' sweeps and left out of the aggregated ones.
+
+    Args:
+        base_generation: Regional generation without the target fuels
+        unit_generation: Regional generation of each target fuel at 1 GW, as
+            returned by `PowerGenerator.estimate_target_power`; NaN counts as 0
+        emissions: Regional emissions of each emission type
+        targets: Capacity of each target fuel (GW), shape (scenarios, fuels)
+        flow: Hourly power flow of every corridor; without it the intensity
+            ignores power flow
+        aggregate: 'hourly' keeps every hour, 'mean' averages the hourly
+            intensity and 'weighted' divides total emissions by total
+            generation
+        chunk_size: Number of scenarios evaluated together
+        dtype: Data type of the result when `out` is not given; the
+            intermediates are always float64
+        out: Array to write the result into, of shape (scenarios, emission
+            types, hours, regions + 1) for 'hourly' or (scenarios, emission
+            types, regions + 1) otherwise; its dtype overrides `dtype`
+
+    Returns:
+        ScenarioSweep of all scenarios, whose intensity is `out` when given
+    """
+    if aggregate not in AGGREGATIONS:
+        raise ValueError(f"aggregate must be one of {AGGREGATIONS}, got {aggregate}")
+
+    targets = np.atleast_2d(np.asarray(targets, dtype=float))
+    if targets.shape[1] != len(unit_generation):
+        raise ValueError(
+            f"targets has {targets.shape[1]} fuels but {len(unit_generation)} "
+            "unit generation frames were given."
+        )
+
+    emission_types = list(emissions)
+    regions = [
+        region
+        for region in emissions[emission_types[0]].columns
+        if region not in EXCLUDED_REGIONS
+    ]
+
+    missing = base_generation[regions].isna().any(axis=1).to_numpy()
+    base = base_generation[regions].fillna(0).to_numpy(dtype=float)
+    # (fuels, hours, regions)
+    units = np.stack(
+        [
+            generation.reindex(columns=regions).fillna(0).to_numpy(dtype=float)
+            for generation in unit_generation
+        ]
+    )
+    stacked_emissions = np.stack(
+        [emissions[e][regions].fillna(0).to_numpy(dtype=float) for e in emission_types]
+    )
+
+    if flow is not None:
+        if "records" in flow:
+            flow = transform_power_data(flow)
+        incidence, origins = build_incidence_matrix(regions, flow)
+        flows = stack_flows(flow, n_hours=len(base))
+        missing = missing_flow_hours(flow, len(base), missing)
+    valid = ~missing
+
+    n_scenarios, n_hours = len(targets), len(base)
+    if aggregate == "hourly":
+        shape = (n_scenarios, len(emission_types), n_hours, len(regions) + 1)
+    else:
+        shape = (n_scenarios, len(emission_types), len(regions) + 1)
+    if out is None:
+        result = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError(f"out must have shape {shape}, got {out.shape}")
+    else:
+        result = out
+
+    for start in range(0, n_scenarios, chunk_size):
+        chunk = targets[start : start + chunk_size]
+        # (chunk, hours, regions)
+        generation = base + np.tensordot(chunk, units, axes=(1, 0))
+        chunk_emissions = np.broadcast_to(
+            stacked_emissions, (len(chunk),) + stacked_emissions.shape
+        )
+
+        if flow is not None:
+            initial_intensity = flow_intensity(generation, chunk_emissions)[..., :-1]
+            generation, chunk_emissions = apply_power_flow(
+                generation=generation,
+                emissions=chunk_emissions,
+                intensity=initial_intensity,
+                flows=flows,
+                incidence=incidence,
+                origins=origins,
+            )
+
+        if aggregate == "weighted":
+            result[start : start + len(chunk)] = flow_intensity(
+                generation[..., valid, :].sum(axis=-2, keepdims=True),
+                chunk_emissions[..., valid, :].sum(axis=-2, keepdims=True),
+            )[..., 0, :]
+            continue
+
+        intensity = flow_intensity(generation, chunk_emissions)
+        if aggregate == "mean":
+            intensity = intensity[..., valid, :].mean(axis=-2)
+        else:
+            intensity[..., missing, :] = np.nan
+        result[start : start + len(chunk)] = intensity
+
+    return ScenarioSweep(
+        targets=targets,
+        emission_types=emission_types,
+        regions=regions + [NATIONAL],
+        intensity=result,
+    )
@@ -0,0 +1,342 @@
+import concurrent.futures
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+from absl import logging
+
+from app import profiling
+from app.data import EMISSION_FACTORS, GWP, GenerationCube, build_emission_factor_matrix
+
+from .api import PowerFlowData, transform_power_data
+from .constants import EXCLUDED_REGIONS
+from .flow import (
+    NATIONAL,
+    apply_power_flow,
+    build_incidence_matrix,
+    flow_intensity,
+    missing_flow_hours,
+    stack_flows,
+)
+
+EMISSION_TYPES = ["CO2e", "SOx", "NOx", "PM"]
+AIR_POLLUTANTS = ["SOx", "NOx", "PM"]
+
+# Standard deviation of the log multiplier of every uncertain input: the
+# IPCC factor of each gas per fuel type, the GWP of each non-CO2 gas, the
+# air pollutant factor of each unit and the capacity factor of each target
+# fuel per region.
+DEFAULT_UNCERTAINTY: Dict[str, float] = {
+    "carbon_dioxide": 0.05,
+    "methane": 0.5,
+    "nitrous_oxide": 0.5,
+    "GWP": 0.2,
+    "SOx": 0.2,
+    "NOx": 0.2,
+    "PM": 0.3,
+    "capacity_factor": 0.1,
+}
+
+
+@dataclass
+class IntensityBands:
+    """Percentile bands of the hourly emission intensity over Monte Carlo draws.
+
+    Attributes:
+        emission_types: Emission type of each band slice
+        regions: Region names, with the national intensity (全台) last
+        index: Hours of the period
+        percentiles: Percentile of each band
+        bands: Intensity (g/kWh), shape (percentiles, emission types, hours,
+            regions)
+        mean: Mean intensity over the draws, shape (emission types, hours,
+            regions)
+        n_samples: Number of draws
+    """
+
+    emission_types: List[str]
+    regions: List[str]
+    index: pd.Index
+    percentiles: List[float]
+    bands: np.ndarray
+    mean: np.ndarray
+    n_samples: int
+
+    def to_frame(self, emission_type: str, percentile: float) -> pd.DataFrame:
+        """Hourly band of one emission type and percentile."""
+        e = self.emission_types.index(emission_type)
+        q = self.percentiles.index(percentile)
+        return pd.DataFrame(self.bands[q, e], index=self.index, columns=self.regions)
+
+
+@dataclass
+class _Components:
+    """Emissions of one emission type as a sum of independently scaled parts.
+
+    The emissions of a draw are `sum_k m[k] * contributions[k]` with the log
+    multipliers `log m = loadings @ (z * sigmas) - 0.5 * loadings @ sigmas**2`
+    for standard normal z, so every multiplier has mean 1.
+
+    Attributes:
+        contributions: Emissions of each part, shape (parts, hours, regions)
+        loadings: Uncertain inputs each part depends on, shape (parts, inputs)
+        sigmas: Standard deviation of the log of each input, shape (inputs,)
+    """
+
+    contributions: np.ndarray
+    loadings: np.ndarray
+    sigmas: np.ndarray
+
+    def sample(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        """Emissions of `n` draws, shape (n, hours, regions)."""
+        z = rng.standard_normal((n, len(self.sigmas)))
+        log_multipliers = (z * self.sigmas) @ self.loadings.T - 0.5 * (
+            self.loadings @ self.sigmas**2
+        )
+        return np.tensordot(np.exp(log_multipliers), self.contributions, axes=(1, 0))
+
+
+@dataclass
+class _UncertaintyModel:
+    """Arrays shared by every chunk of draws."""
+
+    base: np.ndarray
+    fuel_generation: np.ndarray
+    capacity_sigma: float
+    components: List[_Components]
+    flow: tuple | None
+
+
+def _unit_contributions(
+    cube: GenerationCube, factors: np.ndarray, regions: List[str]
+) -> np.ndarray:
+    """Hourly emissions of every unit in its region, shape (units, hours, regions)."""
+    generation = np.nan_to_num(cube.values) * factors[:, None]
+    contributions = np.zeros((len(cube.units), cube.n_steps, len(regions)))
+    for column, region in enumerate(regions):
+        in_region = cube.regions == region
+        contributions[in_region, :, column] = generation[in_region]
+    return contributions
+
+
+def _emission_components(
+    cube: GenerationCube,
+    emission_data: pd.DataFrame,
+    ghg_shares: pd.DataFrame,
+    regions: List[str],
+    uncertainty: Dict[str, float],
+) -> List[_Components]:
+    """Uncertain parts of the emissions of every emission type."""
+    factors = build_emission_factor_matrix(cube, emission_data, EMISSION_TYPES)
+    components = []
+
+    # CO2e: one part per gas and fuel type, scaled by the IPCC factor of the
+    # gas for that fuel and by the GWP of the gas.
+    gases = list(GWP)
+    fuel_types = list(EMISSION_FACTORS[gases[0]])
+    shares = ghg_shares.reindex(cube.units)
+    co2e = _unit_contributions(cube, factors[:, 0], regions)
+    parts, loadings = [], []
+    n_inputs = len(gases) * len(fuel_types) + len(gases) - 1
+    for g, gas in enumerate(gases):
+        share = shares[gas].fillna(0).to_numpy()
+        for t, fuel_type in enumerate(fuel_types):
+            in_type = (shares["Type"] == fuel_type).to_numpy()
+            parts.append(np.tensordot(share * in_type, co2e, axes=(0, 0)))
+            loading = np.zeros(n_inputs)
+            loading[g * len(fuel_types) + t] = 1
+            if g > 0:
+                loading[len(gases) * len(fuel_types) + g - 1] = 1
+            loadings.append(loading)
+    classified = np.isin(shares["Type"], fuel_types)
+    # Units of other fuel types keep their factor.
+    parts.append(np.tensordot(~classified, co2e, axes=(0, 0)))
+    loadings.append(np.zeros(n_inputs))
+    sigmas = [uncertainty[gas] for gas in gases for _ in fuel_types]
+    sigmas += [uncertainty["GWP"]] * (len(gases) - 1)
+    components.append(
+        _Components(np.stack(parts), np.stack(loadings), np.array(sigmas))
+    )
+
+    # Air pollutants: one part per emitting unit, scaled by its own factor.
+    for i, pollutant in enumerate(AIR_POLLUTANTS, start=1):
+        emitting = factors[:, i] > 0
+        contributions = _unit_contributions(cube, factors[:, i], regions)[emitting]
+        components.append(
+            _Components(
+                contributions,
+                np.eye(len(contributions)),
+                np.full(len(contributions), uncertainty[pollutant]),
+            )
+        )
+    return components
+
+
+_worker_model: _UncertaintyModel | None = None
+
+
+def _init_worker(model: _UncertaintyModel) -> None:
+    global _worker_model
+    _worker_model = model
+
+
+def _sample_chunk(
+    seed: np.random.SeedSequence, n: int, model: _UncertaintyModel | None = None
+) -> np.ndarray:
+    """Intensity of `n` draws, shape (n, emission types, hours, regions + 1)."""
+    model = model or _worker_model
+    rng = np.random.default_rng(seed)
+
+    # Capacity factors scale the generation of each target fuel per region.
+    n_fuels, _, n_regions = model.fuel_generation.shape
+    multipliers = np.exp(
+        model.capacity_sigma * rng.standard_normal((n, n_fuels, 1, n_regions))
+        - 0.5 * model.capacity_sigma**2
+    )
+    generation = model.base + (multipliers * model.fuel_generation).sum(axis=1)
+    emissions = np.stack([part.sample(rng, n) for part in model.components], axis=1)
+
+    if model.flow is not None:
+        flows, incidence, origins = model.flow
+        initial_intensity = flow_intensity(generation, emissions)[..., :-1]
+        generation, emissions = apply_power_flow(
+            generation=generation,
+            emissions=emissions,
+            intensity=initial_intensity,
+            flows=flows,
+            incidence=incidence,
+            origins=origins,
+        )
+    return flow_intensity(generation, emissions).astype(np.float32)
+
+
+@profiling.profiled("module.propagate_uncertainty")
+def propagate_uncertainty(
+    cube: GenerationCube,
+    emission_data: pd.DataFrame,
+    ghg_shares: pd.DataFrame,
+    base_generation: pd.DataFrame,
+    fuel_generation: List[pd.DataFrame],
+    flow: Dict[str, PowerFlowData] | None = None,
+    n_samples: int = 1000,
+    uncertainty: Dict[str, float] | None = None,
+    percentiles: Sequence[float] = (5, 50, 95),
+    chunk_size: int = 64,
+    workers: int = 1,
+    seed: int = 0,
+    samples_path: str | Path | None = None,
+) -> IntensityBands:
+    """Monte Carlo bands of the hourly emission intensity.
+
+    Every draw scales the IPCC factor of each gas and fuel type, the GWPs,
+    the air pollutant factor of each unit and the capacity factor of each
+    target fuel and region by lognormal multipliers with mean 1. Emissions
+    are linear in all of them, so a chunk of draws is a batch of matrix
+    products over precomputed contributions, followed by the power flow
+    adjustment with the draws as leading dimension. Chunks are seeded
+    independently and give the same draws with any number of workers.
+
+    Args:
+        cube: Hourly power generation of every unit
+        emission_data: Emission factors indexed by plant name
+        ghg_shares: Share of each gas in the CO2e factors, from
+            `get_ghg_emission_shares`
+        base_generation: Regional generation without the target fuels
+        fuel_generation: Regional generation of each target fuel
+        flow: Hourly power flow of every corridor; without it the intensity
+            ignores power flow
+        n_samples: Number of draws
+        uncertainty: Standard deviation of the log multiplier of each input,
+            overriding DEFAULT_UNCERTAINTY; 0 keeps an input exact
+        percentiles: Percentiles of the bands
+        chunk_size: Number of draws evaluated together
+        workers: Number of processes evaluating chunks in parallel
+        seed: Random seed
+        samples_path: Keep the draws in this .npy file instead of in memory,
+            shape (draws, emission types, hours, regions + 1), float32
+
+    Returns:
+        IntensityBands of the draws, NaN in the hours with missing data (see
+        `GenerationCube.missing_invalid`)
+    """
+    uncertainty = {**DEFAULT_UNCERTAINTY, **(uncertainty or {})}
+    regions = [region for region in cube.region_names if region not in EXCLUDED_REGIONS]
+
+    flow_arrays = None
+    if flow is not None:
+        if "records" in flow:
+            flow = transform_power_data(flow)
+        incidence, origins = build_incidence_matrix(regions, flow)
+        flow_arrays = (stack_flows(flow, n_hours=cube.n_steps), incidence, origins)
+
+    model = _UncertaintyModel(
+        base=base_generation[regions].fillna(0).to_numpy(dtype=float),
+        fuel_generation=np.array(
+            [
+                generation.reindex(columns=regions).fillna(0).to_numpy(dtype=float)
+                for generation in fuel_generation
+            ]
+        ).reshape(len(fuel_generation), cube.n_steps, len(regions)),
+        capacity_sigma=uncertainty["capacity_factor"],
+        components=_emission_components(
+            cube, emission_data, ghg_shares, regions, uncertainty
+        ),
+        flow=flow_arrays,
+    )
+
+    shape = (n_samples, len(EMISSION_TYPES), cube.n_steps, len(regions) + 1)
+    if samples_path is None:
+        samples = np.empty(shape, dtype=np.float32)
+    else:
+        samples = np.lib.format.open_memmap(
+            samples_path, mode="w+", dtype=np.float32, shape=shape
+        )
+
+    starts = range(0, n_samples, chunk_size)
+    sizes = [min(chunk_size, n_samples - start) for start in starts]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers > 1 and len(sizes) > 1:
+        logging.info(
+            f"Sampling {n_samples} draws in {len(sizes)} chunks with {workers} "
+            "worker processes."
+        )
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(model,)
+        ) as executor:
+            for start, chunk in zip(starts, executor.map(_sample_chunk, seeds, sizes)):
+                samples[start : start + len(chunk)] = chunk
+    else:
+        for start, chunk_seed, size in zip(starts, seeds, sizes):
+            samples[start : start + size] = _sample_chunk(chunk_seed, size, model)
+
+    # Percentiles over blocks of hours bound the memory of the partial sorts.
+    percentiles = [float(q) for q in percentiles]
+    bands = np.empty((len(percentiles),) + shape[1:])
+    mean = np.empty(shape[1:])
+    block = max(1, (1 << 28) // max(1, samples[:, :, :1].nbytes))
+    for hour in range(0, cube.n_steps, block):
+        hours = slice(hour, hour + block)
+        values = np.asarray(samples[:, :, hours])
+        bands[:, :, hours] = np.percentile(values, percentiles, axis=0)
+        mean[:, hours] = values.mean(axis=0, dtype=float)
+    if samples_path is not None:
+        samples.flush()
+
+    # Hours with missing generation or flow data have no bands.
+    missing = cube.missing_hours()
+    if flow is not None:
+        missing = missing_flow_hours(flow, cube.n_steps, missing)
+    bands[:, :, missing] = np.nan
+    mean[:, missing] = np.nan
+
+    return IntensityBands(
+        emission_types=list(EMISSION_TYPES),
+        regions=regions + [NATIONAL],
+        index=base_generation.index,
+        percentiles=percentiles,
+        bands=bands,
+        mean=mean,
+        n_samples=n_samples,
+    )
@@ -0,0 +1,217 @@
+import contextlib
+import functools
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_enabled = False
+_trace_memory = False
+_records: List["StageRecord"] = []
+# Running stages with the highest traced memory seen inside each
+_stack: List[list] = []
+_period: Optional[str] = None
+
+
+@dataclass
+class StageRecord:
+    """Measurements of one instrumented call.
+
+    Attributes:
+        stage: Stage name, e.g. 'data.get_json_file'
+        period: Period being processed, if any
+        wall_seconds: Wall time, including nested stages
+        cpu_seconds: CPU time of this process, including nested stages
+        rss_peak_growth: Growth of the peak resident set size (bytes)
+        traced_peak: Peak traced memory above the start of the stage (bytes),
+            only with memory tracing
+        counts: Record counts reported by the stage
+    """
+
+    stage: str
+    period: Optional[str] = None
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    rss_peak_growth: int = 0
+    traced_peak: int = 0
+    counts: Dict[str, int] = field(default_factory=dict)
+
+
+def enable(trace_memory: bool = False) -> None:
+    """Turn instrumentation on; `trace_memory` adds tracemalloc peaks."""
+    global _enabled, _trace_memory
+    _enabled = True
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable() -> None:
+    global _enabled, _trace_memory
+    _enabled = False
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _trace_memory = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def is_tracing_memory() -> bool:
+    return _trace_memory
+
+
+def _peak_rss() -> int:
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[Optional[StageRecord]]:
+    """Measure the enclosed block as one stage; does nothing when disabled."""
+    if not _enabled:
+        yield None
+        return
+
+    record = StageRecord(stage=name, period=_period)
+    traced_start = 0
+    if _trace_memory:
+        traced_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    rss_start = _peak_rss()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    entry = [record, 0]
+    _stack.append(entry)
+    try:
+        yield record
+    finally:
+        _stack.pop()
+        record.wall_seconds = time.perf_counter() - wall_start
+        record.cpu_seconds = time.process_time() - cpu_start
+        record.rss_peak_growth = _peak_rss() - rss_start
+        if _trace_memory:
+            # Nested stages reset the peak, so keep the largest one seen.
+            peak = max(tracemalloc.get_traced_memory()[1], entry[1])
+            record.traced_peak = peak - traced_start
+            if _stack:
+                _stack[-1][1] = max(_stack[-1][1], peak)
+        _records.append(record)
+
+
+def profiled(name: str) -> Callable:
+    """Decorator measuring every call of a function as stage `name`."""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, n: int) -> None:
+    """Add `n` to a record count of the innermost running stage."""
+    if _enabled and _stack:
+        counts = _stack[-1][0].counts
+        counts[name] = counts.get(name, 0) + int(n)
+
+
+@contextlib.contextmanager
+def period(label: str) -> Iterator[None]:
+    """Attribute the stages run inside the block to a period."""
+    global _period
+    previous, _period = _period, label
+    try:
+        yield
+    finally:
+        _period = previous
+
+
+def records() -> List[StageRecord]:
+    return list(_records)
+
+
+def extend(new_records: List[StageRecord]) -> None:
+    """Add records measured elsewhere, e.g. in a worker process."""
+    _records.extend(new_records)
+
+
+def reset() -> None:
+    _records.clear()
+
+
+def summarize(stage_records: List[StageRecord]) -> List[Dict]:
+    """Totals of every (stage, period), in order of first appearance."""
+    totals: Dict[tuple, Dict] = {}
+    for record in stage_records:
+        key = (record.stage, record.period)
+        if key not in totals:
+            totals[key] = {
+                "stage": record.stage,
+                "period": record.period,
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "rss_peak_growth": 0,
+                "traced_peak": 0,
+                "counts": defaultdict(int),
+            }
+        total = totals[key]
+        total["calls"] += 1
+        total["wall_seconds"] += record.wall_seconds
+        total["cpu_seconds"] += record.cpu_seconds
+        total["rss_peak_growth"] += record.rss_peak_growth
+        total["traced_peak"] = max(total["traced_peak"], record.traced_peak)
+        for name, n in record.counts.items():
+            total["counts"][name] += n
+    return [dict(total, counts=dict(total["counts"])) for total in totals.values()]
+
+
+def log_report() -> None:
+    """Log the per-stage totals through the Rich logging handler."""
+    if not _records:
+        return
+    logging.info("Profile (wall / cpu seconds, peak RSS growth, traced peak):")
+    for total in summarize(_records):
+        label = total["stage"] if total["period"] is None else f"{total['stage']} [{total['period']}]"
+        counts = ", ".join(f"{name}={n}" for name, n in total["counts"].items())
+        logging.info(
+            f"  {label:<45} x{total['calls']:<3} "
+            f"{total['wall_seconds']:8.3f} / {total['cpu_seconds']:8.3f} s  "
+            f"{total['rss_peak_growth'] / 2**20:7.1f} MiB  "
+            f"{total['traced_peak'] / 2**20:7.1f} MiB"
+            + (f"  {counts}" if counts else "")
+        )
+
+
+def write_report(file_path: str | Path) -> None:
+    """Write the per-stage totals and the raw records as a JSON run report."""
+    report = {
+        "trace_memory": _trace_memory,
+        "stages": summarize(_records),
+        "records": [asdict(record) for record in _records],
+    }
+    Path(file_path).write_text(
+        json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8"
+    )
+    logging.info(f"Wrote run report {file_path}.")
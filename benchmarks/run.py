@@ -0,0 +1,129 @@
+"""Stage benchmarks on synthetic TPC data.
+
+Usage:
+    python -m benchmarks.run --units=400 --days=92 --output=baseline.json
+    python -m benchmarks.run --units=400 --days=92 --compare=baseline.json
+"""
+
+import json
+import platform
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from absl import app, flags, logging
+
+from benchmarks.stages import run_stages
+from benchmarks.synthetic import generate_dataset
+
+flags.DEFINE_integer("units", 200, "Number of generating units.")
+flags.DEFINE_integer("regions", 5, "Number of regions (4 or 5).")
+flags.DEFINE_integer("days", 30, "Number of days of 10-minute records.")
+flags.DEFINE_integer("seed", 0, "Random seed of the synthetic data.")
+flags.DEFINE_integer("repeat", 3, "Number of timed runs of each stage.")
+flags.DEFINE_list("stages", None, "Stages to measure; all by default.")
+flags.DEFINE_string(
+    "data_dir", None, "Directory for the synthetic data; a temporary one by default."
+)
+flags.DEFINE_string("output", None, "Write the results as a JSON baseline.")
+flags.DEFINE_string("compare", None, "Compare the results with a JSON baseline.")
+flags.DEFINE_float(
+    "tolerance", 0.25, "Allowed relative slowdown or memory growth per stage."
+)
+
+FLAGS = flags.FLAGS
+
+
+def compare_results(
+    results: Dict, baseline: Dict, tolerance: float
+) -> Dict[str, Dict[str, float]]:
+    """Relative change of every stage against a baseline.
+
+    Args:
+        results: Results of this run
+        baseline: Results loaded from a baseline file
+        tolerance: Allowed relative growth of time and peak memory
+
+    Returns:
+        Ratio of the median time and peak memory of every stage in both runs,
+        with 'regressed' set where either ratio exceeds 1 + tolerance
+    """
+    if results["config"] != baseline["config"]:
+        logging.warning(
+            f"Baseline config {baseline['config']} differs from {results['config']}."
+        )
+
+    changes = {}
+    for stage, current in results["stages"].items():
+        if stage not in baseline["stages"]:
+            continue
+        reference = baseline["stages"][stage]
+        time_ratio = current["seconds_median"] / max(reference["seconds_median"], 1e-9)
+        memory_ratio = current["peak_bytes"] / max(reference["peak_bytes"], 1)
+        changes[stage] = {
+            "time_ratio": time_ratio,
+            "memory_ratio": memory_ratio,
+            "regressed": max(time_ratio, memory_ratio) > 1 + tolerance,
+        }
+    return changes
+
+
+def main(argv):
+    data_dir = FLAGS.data_dir or tempfile.mkdtemp(prefix="emission-bench-")
+    logging.info(
+        f"Generating {FLAGS.units} units x {FLAGS.days} days in {data_dir}."
+    )
+    dataset = generate_dataset(
+        data_dir,
+        n_units=FLAGS.units,
+        n_regions=FLAGS.regions,
+        n_days=FLAGS.days,
+        seed=FLAGS.seed,
+    )
+
+    timings = run_stages(dataset, repeat=FLAGS.repeat, stages=FLAGS.stages)
+    results = {
+        "config": {
+            "units": FLAGS.units,
+            "regions": FLAGS.regions,
+            "days": FLAGS.days,
+            "seed": FLAGS.seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+        },
+        "stages": {name: timing.summary() for name, timing in timings.items()},
+    }
+
+    for name, summary in results["stages"].items():
+        logging.info(
+            f"{name:<30} median {summary['seconds_median']:8.3f} s  "
+            f"min {summary['seconds_min']:8.3f} s  "
+            f"peak {summary['peak_bytes'] / 2**20:8.1f} MiB"
+        )
+
+    if FLAGS.output:
+        Path(FLAGS.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        logging.info(f"Wrote baseline {FLAGS.output}.")
+
+    if FLAGS.compare:
+        baseline = json.loads(Path(FLAGS.compare).read_text(encoding="utf-8"))
+        changes = compare_results(results, baseline, tolerance=FLAGS.tolerance)
+        for name, change in changes.items():
+            logging.info(
+                f"{name:<30} time x{change['time_ratio']:.2f}  "
+                f"memory x{change['memory_ratio']:.2f}"
+                + ("  REGRESSED" if change["regressed"] else "")
+            )
+        if any(change["regressed"] for change in changes.values()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    app.run(main)
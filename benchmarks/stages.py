@@ -0,0 +1,244 @@
+import gc
+import statistics
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from app.data import (
+    GenerationCube,
+    compute_hourly_data,
+    get_emission_factor_table,
+    get_emissions_by_region,
+    get_ghg_emission_shares,
+    get_json_file,
+    get_capacity_info,
+    get_selected_pg_data,
+    get_station_info,
+    process_power_generation_data,
+)
+from app.module import (
+    ChargingEvaluator,
+    calculate_air_pollution_intensity,
+    calculate_capacity_factor,
+    calculate_power_flow,
+    create_figure_CF,
+    charging_windows,
+    create_figure_EI_total,
+    diurnal_profiles,
+    marginal_emission_factors,
+    propagate_uncertainty,
+    transform_power_data,
+)
+
+from benchmarks.synthetic import SyntheticDataset
+
+EMISSION_TYPES = ["CO2e", "SOx", "NOx", "PM"]
+TARGET_FUELS = ["太陽能", "陸域風電"]
+CHARGING_FLEETS = 1000
+UNCERTAINTY_SAMPLES = 256
+
+
+@dataclass
+class StageTiming:
+    """Measurements of one stage.
+
+    Attributes:
+        seconds: Wall time of every repeat
+        peak_bytes: Peak traced memory of one extra run under tracemalloc
+    """
+
+    seconds: List[float] = field(default_factory=list)
+    peak_bytes: int = 0
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "seconds_min": min(self.seconds),
+            "seconds_median": statistics.median(self.seconds),
+            "peak_bytes": self.peak_bytes,
+        }
+
+
+def measure(function: Callable[[], Any], repeat: int) -> StageTiming:
+    """Time `function` `repeat` times, then trace its peak memory once.
+
+    Memory is traced in a separate run because tracemalloc slows down
+    allocation-heavy code and would distort the timings.
+    """
+    timing = StageTiming()
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        timing.seconds.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        timing.peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return timing
+
+
+def run_stages(
+    dataset: SyntheticDataset, repeat: int = 3, stages: List[str] | None = None
+) -> Dict[str, StageTiming]:
+    """Benchmark every stage on its own, fed with the previous stage's output.
+
+    The inputs of each stage are computed once outside the measurement, so
+    a stage's numbers do not include the stages before it.
+
+    Args:
+        dataset: Generated data directory
+        repeat: Number of timed runs of each stage
+        stages: Names of the stages to measure; all by default
+
+    Returns:
+        StageTiming of each measured stage, in pipeline order
+    """
+    data_dir = dataset.data_dir
+    pg_dir = f"{data_dir}/power_generation/"
+    station_info = get_station_info(data_dir=data_dir, station_file=dataset.station_file)
+    capacity_info = {
+        fuel_type: get_capacity_info(
+            data_dir=data_dir, capacity_file=dataset.capacity_file, fuel_type=fuel_type
+        )
+        for fuel_type in TARGET_FUELS
+    }
+    emission_data = get_emission_factor_table(str(data_dir))
+
+    # Inputs of every stage, in pipeline order
+    raw = get_json_file(data_dir=pg_dir, pg_file=dataset.pg_file)
+    pg_data = process_power_generation_data(data=raw, station_info=station_info)
+    hourly = compute_hourly_data(pg_data)
+    cube = GenerationCube.from_nested(hourly)
+    emissions = {
+        emission_type: get_emissions_by_region(cube, emission_data, emission_type)
+        for emission_type in EMISSION_TYPES
+    }
+    generation = get_selected_pg_data(pg=cube, exclude_fuel=[])
+    flow = transform_power_data(
+        get_json_file(data_dir=str(data_dir), pg_file=dataset.flow_file)
+    )
+    # The marginal emission factors fit hour-to-hour changes on the hourly grid.
+    hours = pd.date_range(*dataset.datetime_range.split("|"), freq="h")
+    hourly_generation = generation.set_axis(hours)
+    hourly_emissions = {
+        emission_type: frame.set_axis(hours)
+        for emission_type, frame in emissions.items()
+    }
+    intensities = {
+        emission_type: calculate_air_pollution_intensity(
+            ap_data=emissions[emission_type], pg_data=generation, scale="regional"
+        )
+        for emission_type in EMISSION_TYPES
+    }
+
+    def capacity_factors():
+        for fuel_type in TARGET_FUELS:
+            calculate_capacity_factor(
+                hourly_pg=cube,
+                capacity_data=capacity_info[fuel_type],
+                fuel_type=fuel_type,
+                scale="regional",
+            )
+
+    def power_flow():
+        return {
+            emission_type: calculate_power_flow(
+                pg=generation,
+                flow=flow,
+                intensity=intensities[emission_type],
+                emission=emissions[emission_type],
+                scale="regional",
+            )
+            for emission_type in EMISSION_TYPES
+        }
+
+    result_dir = Path(tempfile.mkdtemp(prefix="figures-"))
+    for fuel_type in TARGET_FUELS:
+        calculate_capacity_factor(
+            hourly_pg=cube,
+            capacity_data=capacity_info[fuel_type],
+            fuel_type=fuel_type,
+            scale="regional",
+        ).to_csv(result_dir / f"region_capacity_factor_{fuel_type}_bench.csv", index=False)
+    flow_intensities = power_flow()
+    for emission_type, intensity in flow_intensities.items():
+        intensity.to_csv(result_dir / f"{emission_type}_EI_bench.csv")
+
+    evaluator = ChargingEvaluator.from_intensities(flow_intensities)
+    charging_loads = np.random.default_rng(0).random(
+        (CHARGING_FLEETS, len(evaluator.timestamps), len(evaluator.regions))
+    )
+    windows = charging_windows(evaluator.timestamps, 22, 6)
+
+    def charging():
+        evaluator.emissions(charging_loads)
+        evaluator.reallocate(charging_loads, windows)
+
+    def figures():
+        for fuel_type in TARGET_FUELS:
+            create_figure_CF(
+                result_dir=result_dir,
+                data_period_list=["bench"],
+                fuel_type=fuel_type,
+                target="region_capacity_factor",
+            )
+        create_figure_EI_total(
+            result_dir=result_dir,
+            data_period_list=["bench"],
+            targets=[f"{emission_type}_EI" for emission_type in EMISSION_TYPES],
+            limits=[[0, 700], [0.0, 0.13], [0.0, 0.20], [0.0, 0.0065]],
+        )
+        plt.close("all")
+
+    benchmarks = {
+        "get_json_file": lambda: get_json_file(data_dir=pg_dir, pg_file=dataset.pg_file),
+        "process_power_generation_data": lambda: process_power_generation_data(
+            data=raw, station_info=station_info
+        ),
+        "compute_hourly_data": lambda: compute_hourly_data(pg_data),
+        "calculate_capacity_factor": capacity_factors,
+        "get_emissions_by_region": lambda: [
+            get_emissions_by_region(cube, emission_data, emission_type)
+            for emission_type in EMISSION_TYPES
+        ],
+        "calculate_power_flow": power_flow,
+        "diurnal_profiles": lambda: diurnal_profiles(flow_intensities),
+        "charging": charging,
+        "marginal_emission_factors": lambda: marginal_emission_factors(
+            hourly_generation, hourly_emissions
+        ),
+        "propagate_uncertainty": lambda: propagate_uncertainty(
+            cube,
+            emission_data,
+            get_ghg_emission_shares(str(data_dir)),
+            base_generation=generation,
+            fuel_generation=[],
+            flow=flow,
+            n_samples=UNCERTAINTY_SAMPLES,
+        ),
+        "figures": figures,
+    }
+
+    unknown = set(stages or []) - set(benchmarks)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}; choose from {list(benchmarks)}")
+
+    return {
+        name: measure(function, repeat=repeat)
+        for name, function in benchmarks.items()
+        if stages is None or name in stages
+    }
@@ -0,0 +1,220 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.module.constants import UNIT_NAME_TO_LOCATION
+
+# Regions in the order they are added; power flow needs the first four.
+REGIONS = ["北部", "中部", "南部", "東部", "離島"]
+FUELS = ["燃煤", "燃氣", "太陽能", "風力", "核能"]
+THERMAL_FUELS = {"燃煤": "Coal", "燃氣": "Gas"}
+
+PG_FILE = "synthetic_pg.json"
+FLOW_FILE = "synthetic_flow.json"
+STATION_FILE = "powerplants_info.csv"
+CAPACITY_FILE = "capacity.csv"
+
+
+@dataclass
+class SyntheticDataset:
+    """Location and shape of a generated data directory.
+
+    Attributes:
+        data_dir: Data directory, laid out like data/2024
+        pg_file: Power generation file under data_dir/power_generation
+        flow_file: Power flow file under data_dir
+        station_file: Station information file
+        capacity_file: Capacity information file
+        datetime_range: Hourly grid of the data in format 'start|end'
+        n_units: Number of generating units
+        n_regions: Number of regions
+        n_days: Number of days
+    """
+
+    data_dir: Path
+    pg_file: str
+    flow_file: str
+    station_file: str
+    capacity_file: str
+    datetime_range: str
+    n_units: int
+    n_regions: int
+    n_days: int
+
+
+def generate_dataset(
+    data_dir: str | Path,
+    n_units: int = 200,
+    n_regions: int = 5,
+    n_days: int = 92,
+    seed: int = 0,
+    start: str = "2024-05-01",
+) -> SyntheticDataset:
+    """Write synthetic TPC inputs: NET_P and FLOW_P records plus the CSV tables.
+
+    Units are spread round-robin over regions and fuels, so every region has
+    solar, wind and thermal units. Solar follows a daily profile, wind is
+    noisy with occasional negative values, and thermal units run flat with
+    noise. The same seed always writes the same files.
+
+    Args:
+        data_dir: Output data directory
+        n_units: Number of generating units
+        n_regions: Number of regions, 4 or 5 (the island region is optional)
+        n_days: Number of days of 10-minute records
+        seed: Random seed
+        start: First day of the records
+
+    Returns:
+        SyntheticDataset describing the files
+    """
+    if not 4 <= n_regions <= len(REGIONS):
+        raise ValueError(
+            f"n_regions must be between 4 and {len(REGIONS)}, got {n_regions}"
+        )
+    if n_units < len(FUELS) * n_regions:
+        raise ValueError(
+            f"n_units must be at least {len(FUELS) * n_regions} to cover every "
+            f"region and fuel, got {n_units}"
+        )
+
+    rng = np.random.default_rng(seed)
+    data_dir = Path(data_dir)
+    (data_dir / "power_generation").mkdir(parents=True, exist_ok=True)
+
+    units = _make_units(n_units, REGIONS[:n_regions])
+    timestamps = pd.date_range(start, periods=n_days * 144, freq="10min")
+
+    _write_tables(data_dir, units, rng)
+    _write_generation(data_dir / "power_generation" / PG_FILE, units, timestamps, rng)
+    _write_flow(data_dir / FLOW_FILE, timestamps, rng)
+
+    return SyntheticDataset(
+        data_dir=data_dir,
+        pg_file=PG_FILE,
+        flow_file=FLOW_FILE,
+        station_file=STATION_FILE,
+        capacity_file=CAPACITY_FILE,
+        datetime_range=f"{timestamps[0]:%Y-%m-%d %H:00:00}|{timestamps[-1]:%Y-%m-%d %H:00:00}",
+        n_units=n_units,
+        n_regions=n_regions,
+        n_days=n_days,
+    )
+
+
+def _make_units(n_units: int, regions: List[str]) -> List[Tuple[str, str, str]]:
+    """(unit, region, fuel) of every unit."""
+    units = []
+    for i in range(n_units):
+        region = regions[i % len(regions)]
+        fuel = FUELS[(i // len(regions)) % len(FUELS)]
+        units.append((f"{region}{fuel}{i}", region, fuel))
+    return units
+
+
+def _write_tables(
+    data_dir: Path, units: List[Tuple[str, str, str]], rng: np.random.Generator
+) -> None:
+    """Station registry, capacity table and emission factor inputs."""
+    pd.DataFrame(units, columns=["Station Name", "Location", "Type"]).to_csv(
+        data_dir / STATION_FILE, index=False
+    )
+
+    capacity = []
+    for unit, _, fuel in units:
+        if fuel == "太陽能":
+            capacity.append((unit, "太陽能", rng.uniform(1000, 1500)))
+        elif fuel == "風力":
+            capacity.append((unit, "陸域風電", rng.uniform(800, 1100)))
+    pd.DataFrame(
+        capacity, columns=["Station Name", "Fuel Type", "Installed Capacity(kW)"]
+    ).to_csv(data_dir / CAPACITY_FILE, index=False)
+
+    thermal = [(unit, fuel) for unit, _, fuel in units if fuel in THERMAL_FUELS]
+    n_thermal = len(thermal)
+    pd.DataFrame(
+        {
+            "能源別": [fuel for _, fuel in thermal],
+            "電廠名稱": [unit for unit, _ in thermal],
+            "淨發電量(度)": rng.uniform(1e8, 1e9, n_thermal),
+        }
+    ).to_csv(data_dir / "pg.csv", index=False)
+    pd.DataFrame(
+        {
+            "硫氧化物排放量(kg)": rng.uniform(1e4, 1e5, n_thermal),
+            "氮氧化物排放量(kg)": rng.uniform(1e4, 1e5, n_thermal),
+            "粒狀污染物排放量(kg)": rng.uniform(1e3, 1e4, n_thermal),
+        }
+    ).to_csv(data_dir / "AirpollutantEmission.csv", index=False)
+
+    plants = [f"{unit}廠" for unit, _ in thermal]
+    pd.DataFrame(
+        {
+            "Generator": [unit for unit, _ in thermal],
+            "Plant": plants,
+            "Type": [THERMAL_FUELS[fuel] for _, fuel in thermal],
+            "Gross Electricity Generation": rng.uniform(1e8, 1e9, n_thermal),
+            "Gross Low Heating Value": rng.uniform(2000, 9000, n_thermal),
+            "Net Electricity Generation": rng.uniform(1e8, 1e9, n_thermal),
+        }
+    ).to_csv(data_dir / "generation_info.csv", index=False)
+    pd.DataFrame(
+        {"Plant": plants, "Reference Emission (kg)": rng.uniform(1e9, 1e10, n_thermal)}
+    ).to_csv(data_dir / "emission_reference.csv", index=False)
+
+
+def _write_generation(
+    file_path: Path,
+    units: List[Tuple[str, str, str]],
+    timestamps: pd.DatetimeIndex,
+    rng: np.random.Generator,
+) -> None:
+    """NET_P records (MW), one per unit and 10-minute timestamp."""
+    fuels = np.array([fuel for _, _, fuel in units])
+    hours = timestamps.hour.to_numpy() + timestamps.minute.to_numpy() / 60
+    solar_profile = np.clip(np.sin((hours - 6) / 12 * np.pi), 0, None)
+
+    # (timestamps, units)
+    power = rng.uniform(10, 100, (len(timestamps), len(units)))
+    solar = fuels == "太陽能"
+    power[:, solar] = solar_profile[:, None] * 1.2 + rng.normal(
+        0, 0.01, (len(timestamps), solar.sum())
+    )
+    wind = fuels == "風力"
+    power[:, wind] = rng.uniform(-0.05, 0.9, (len(timestamps), wind.sum()))
+
+    # Records are written row by row to keep memory flat for large datasets.
+    prefixes = [
+        f'"FUEL_TYPE": "{fuel}", "UNIT_NAME": "{unit}", "NET_P": "'
+        for unit, _, fuel in units
+    ]
+    with open(file_path, "w", encoding="utf-8-sig") as file:
+        file.write('{"success": true, "records": {"NET_P": [')
+        first = True
+        for timestamp, row in zip(timestamps.strftime("%Y-%m-%d %H:%M"), power):
+            chunk = ", ".join(
+                f'{{{prefix}{value:.3f}", "DATE": "{timestamp}"}}'
+                for prefix, value in zip(prefixes, row)
+            )
+            file.write(chunk if first else ", " + chunk)
+            first = False
+        file.write("]}}")
+
+
+def _write_flow(
+    file_path: Path, timestamps: pd.DatetimeIndex, rng: np.random.Generator
+) -> None:
+    """FLOW_P records (MW) of every corridor and 10-minute timestamp."""
+    corridors = list(UNIT_NAME_TO_LOCATION)
+    flows = rng.uniform(0, 50, (len(timestamps), len(corridors)))
+    records = [
+        {"UNIT_NAME": corridor, "P": f"{value:.2f}", "DATETIME": timestamp}
+        for timestamp, row in zip(timestamps.strftime("%Y-%m-%d %H:%M"), flows)
+        for corridor, value in zip(corridors, row)
+    ]
+    with open(file_path, "w", encoding="utf-8-sig") as file:
+        json.dump({"records": {"FLOW_P": records}}, file, ensure_ascii=False)
@@ -1,125 +1,148 @@
-import pandas as pd
 from pathlib import Path
-from absl import app, logging
+from absl import app
 
+from app import profiling
 from app.config.settings import FLAGS
-from app.core.emissions import EmissionCalculator
-from app.core.power import PowerGenerator
-from app.module import (
-    create_figure_CF,
-    create_figure_EI_total,
+from app.core.session import Session
+from app.core.figures import figure_jobs, render_figures
+from app.core.ingest import load_periods
+from app.core.period import needs_ingest, run_periods
+from app.core.pipeline import (
+    StageStore,
+    data_digest,
+    files_unchanged,
+    report_stages,
+    written_files,
 )
+from app.data import RESULT_STORE_FILE, write_result_store
 
 
 def main(argv):
+    if FLAGS.profile:
+        profiling.enable(trace_memory=FLAGS.profile_memory)
+
     # Initialize paths
     data_dir = Path(FLAGS.data_dir)
     result_dir = Path(FLAGS.result_dir)
     result_dir.mkdir(parents=True, exist_ok=True)
 
-    # Initialize power generator
-    power_generator = PowerGenerator(data_dir)
+    # Reference data shared by all periods
+    cache_dir = FLAGS.cache_dir or None
+    cache_max_bytes = FLAGS.cache_max_mb * 2**20
+    session = Session(
+        data_dir,
+        station_file=FLAGS.station_file,
+        capacity_file=FLAGS.capacity_data,
+        stream=FLAGS.stream_ingest,
+        cache_dir=cache_dir,
+        cache_max_bytes=cache_max_bytes,
+        gap_policy=FLAGS.gap_policy,
+        adjusted_emission_factor=FLAGS.adjusted_emission_factor,
+    )
 
-    # Process data for each period
-    for period_idx, period in enumerate(FLAGS.data_period_list):
-        logging.info(f"start working on {period}:\n")
-        pg_file = FLAGS.raw_pg_data[period_idx]
-        flow_file = FLAGS.power_flow_data[period_idx]
+    # Stage artifacts share the cache directory of the hourly data
+    store = StageStore(cache_dir, max_bytes=cache_max_bytes)
 
-        emission_calculator = EmissionCalculator(
+    # Monte Carlo bands of the emission intensities, if requested
+    uncertainty = None
+    if FLAGS.uncertainty_samples > 0:
+        uncertainty = dict(
+            n_samples=FLAGS.uncertainty_samples,
+            percentiles=[float(q) for q in FLAGS.uncertainty_percentiles],
+            workers=FLAGS.uncertainty_workers,
+        )
+
+    # Process data for each period
+    jobs = [
+        dict(
+            session=session,
+            period=period,
+            pg_file=FLAGS.raw_pg_data[period_idx],
+            flow_file=FLAGS.power_flow_data[period_idx],
+            datetime_range=FLAGS.datetime_range[period_idx],
+            fuel_types=FLAGS.fuel_type,
+            capacity_targets=[float(target) for target in FLAGS.capacity_target],
+            result_dir=result_dir,
+            flow_scale=FLAGS.flow_scale,
+            store=store,
+            csv_outputs=FLAGS.csv_outputs,
+            uncertainty=uncertainty,
+        )
+        for period_idx, period in enumerate(FLAGS.data_period_list)
+    ]
+
+    if FLAGS.workers <= 1:
+        # Load the hourly inputs of the periods that miss the cache; with
+        # --workers every worker loads its own period files.
+        pending = [job for job in jobs if needs_ingest(**job)]
+        period_data = load_periods(
             data_dir=data_dir,
-            pg_file=pg_file,
+            pg_files=[job["pg_file"] for job in pending],
+            flow_files=[job["flow_file"] for job in pending],
             station_file=FLAGS.station_file,
+            datetime_ranges=[job["datetime_range"] for job in pending],
+            workers=FLAGS.ingest_workers,
+            stream=FLAGS.stream_ingest,
+            cache_dir=cache_dir,
+            cache_max_bytes=cache_max_bytes,
+            gap_policy=FLAGS.gap_policy,
         )
-
-        pg_estimation_total = pd.DataFrame()
-
-        # Process each fuel type
-        for fuel_idx, fuel_type in enumerate(FLAGS.fuel_type):
-            capacity_target = float(FLAGS.capacity_target[fuel_idx])
-
-            # Estimate target power generation
-            pg_estimation, region_cf, national_cf, capacity_percentage = (
-                power_generator.estimate_target_power(
-                    pg_file=pg_file,
-                    station_file=FLAGS.station_file,
-                    capacity_file=FLAGS.capacity_data,
-                    fuel_type="陸域風電" if fuel_type == "離岸風電" else fuel_type,
-                    capacity_target=capacity_target,
-                )
-            )
-
-            # Add to total power generation
-            pg_estimation_total = (
-                pg_estimation
-                if pg_estimation_total.empty
-                else pg_estimation_total.add(pg_estimation, fill_value=0)
-            )
-
-            logging.info(f"Month={period}, Fuel={fuel_type}")
-            # need to check: the mean of regional cf and the national cf.
-            logging.info(f"The avg of national capacity factor:{national_cf.mean()}.")
-            logging.info(
-                f"national power generation (kWh): {pg_estimation.sum().sum()}."
-            )
-
-            # Todo:
-            # for displaying real result of offshore wind power
-
-            # Output the regional capacity factors
-            for region in capacity_percentage:
-                logging.info(
-                    f"{region} capacity percentage: {capacity_percentage[region]}."
-                )
-            region_cf.to_csv(
-                result_dir / f"region_capacity_factor_{fuel_type}_{period}.csv",
-                index=False,
-                encoding="utf-8-sig",
-            )
-
-        # Calculate emission intensity for total power generation
-        emission_intensities = (
-            emission_calculator.estimate_emission_intensity_with_flow(
-                generation=pg_estimation_total,
-                fuel_type=FLAGS.fuel_type,
-                flow_file=flow_file,
-                scale="regional",
-            )
+        for job, data in zip(pending, period_data):
+            job["period_data"] = data
+
+    results = run_periods(jobs, workers=FLAGS.workers)
+
+    # Consolidated binary results of the run; the CSV files are an optional view
+    first_event = len(store.events)
+    result_store = result_dir / RESULT_STORE_FILE
+    intensities = {result.period: result.intensities for result in results}
+    capacity_factors = {result.period: result.capacity_factors for result in results}
+    generation = {result.period: result.generation for result in results}
+    emissions = {result.period: result.emissions for result in results}
+
+    def write_results():
+        write_result_store(
+            result_store,
+            intensities,
+            capacity_factors,
+            generation=generation,
+            emissions=emissions,
         )
-
-        # Log emission intensities and save to CSV files
-        logging.info(f"\nEmission intensities for period {period}:")
-        for emission_type, intensity in emission_intensities.items():
-            logging.info(f"\n{emission_type}:")
-            logging.info(f"{intensity.mean()}")
-            # Add datetime index
-            start_time, end_time = FLAGS.datetime_range[period_idx].split("|")
-            datetime_index = pd.date_range(start=start_time, end=end_time, freq="h")
-            intensity.index = datetime_index
-            # Save each emission type to a separate CSV file
-            intensity.to_csv(
-                result_dir / f"{emission_type}_EI_{period}.csv",
-                encoding="utf-8-sig",
-                index=True,
-            )
-        logging.info("\n---")
-
-    # Create figures
-    for fuel_type in FLAGS.fuel_type:
-        create_figure_CF(
-            result_dir=result_dir,
+        return written_files([result_store])
+
+    store.artifact(
+        "store",
+        "all",
+        compute=write_results,
+        params=[
+            str(result_store),
+            data_digest([intensities, capacity_factors, generation, emissions]),
+        ],
+        validate=files_unchanged,
+    ).value
+
+    # Create figures; unchanged figures are skipped with the stage cache
+    render_figures(
+        figure_jobs(
+            result_dir,
             data_period_list=FLAGS.data_period_list,
-            fuel_type=fuel_type,
-            target="region_capacity_factor",
-        )
+            fuel_types=FLAGS.fuel_type,
+            limits=FLAGS.figure_limits,
+            results=results,
+        ),
+        store,
+        workers=FLAGS.figure_workers,
+    )
 
-    create_figure_EI_total(
-        result_dir=result_dir,
-        data_period_list=FLAGS.data_period_list,
-        targets=["CO2e_EI", "SOx_EI", "NOx_EI", "PM_EI"],
-        limits=FLAGS.figure_limits,
+    report_stages(
+        [event for result in results for event in result.events]
+        + store.events[first_event:]
     )
 
+    if FLAGS.profile:
+        profiling.log_report()
+        if FLAGS.profile_report:
+            profiling.write_report(result_dir / "run_report.json")
 
 if __name__ == "__main__":
     app.run(main)
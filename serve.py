@@ -0,0 +1,33 @@
+"""Local HTTP service for hourly emission intensity lookups.
+
+Usage:
+    python serve.py --result_dir=results/2024 --lookup_port=8765
+    curl "localhost:8765/point?region=North&time=2024-07-01T18:00"
+"""
+
+from absl import app, logging
+
+from app.config.settings import FLAGS
+from app.core.lookup import IntensityLookup, LookupServer
+
+
+def main(argv):
+    lookup = IntensityLookup.from_results(
+        FLAGS.result_dir, cache_dir=FLAGS.cache_dir or None
+    )
+    meta = lookup.describe()
+    logging.info(
+        f"Serving {len(meta['regions'])} regions from {meta['start']} to {meta['end']} "
+        f"on http://{FLAGS.lookup_host}:{FLAGS.lookup_port}."
+    )
+    server = LookupServer(lookup, host=FLAGS.lookup_host, port=FLAGS.lookup_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    app.run(main)
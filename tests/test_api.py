@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from app.module import calculate_air_pollution_intensities
+
+
+def test_zero_generation_bitmask():
+    generation = pd.DataFrame({"北部": [10.0, 0.0, 5.0], "南部": [0.0, 0.0, 2.0]})
+    emissions = {"CO2e": generation * 500, "SOx": generation * 0.1}
+
+    intensities, zero_generation = calculate_air_pollution_intensities(
+        emissions, generation, scale="regional"
+    )
+
+    assert intensities["CO2e"]["北部"].tolist() == [500.0, 0.0, 500.0]
+    unpacked = np.unpackbits(zero_generation, axis=1, count=len(generation))
+    np.testing.assert_array_equal(unpacked, [[0, 1, 0], [1, 1, 0]])
+
+    _, national = calculate_air_pollution_intensities(
+        emissions, generation, scale="national"
+    )
+    np.testing.assert_array_equal(
+        np.unpackbits(national, axis=1, count=len(generation)), [[0, 1, 0]]
+    )
@@ -0,0 +1,84 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.module import ChargingEvaluator, charging_windows
+
+HOURS = pd.date_range("2024-07-01 20:00", periods=12, freq="h")
+
+
+def _evaluator(seed: int = 0) -> ChargingEvaluator:
+    rng = np.random.default_rng(seed)
+    intensity = rng.uniform(300, 700, (2, len(HOURS), 2))
+    return ChargingEvaluator(HOURS, ["北部", "南部"], ["CO2e", "SOx"], intensity)
+
+
+def _brute_force(load, session, score, cap):
+    """Cheapest integer allocation of the session energy, by enumeration."""
+    best, best_cost = None, np.inf
+    hours = np.flatnonzero(session)
+    energy = int(load[hours].sum())
+    for allocation in itertools.product(range(int(cap) + 1), repeat=len(hours)):
+        if sum(allocation) != energy:
+            continue
+        cost = np.dot(allocation, score[hours])
+        if cost < best_cost:
+            best, best_cost = allocation, cost
+    result = load.copy()
+    result[hours] = best
+    return result
+
+
+def test_emissions_match_direct_sum():
+    evaluator = _evaluator()
+    loads = np.random.default_rng(1).uniform(0, 5, (4, len(HOURS), 2))
+
+    expected = np.einsum("fhr,ehr->fe", loads, evaluator.intensity)
+    np.testing.assert_allclose(evaluator.emissions(loads), expected)
+    np.testing.assert_allclose(
+        evaluator.emissions(loads, by_region=True).sum(axis=-1), expected
+    )
+
+
+@pytest.mark.parametrize("per_fleet", [False, True])
+def test_capped_reallocation_matches_brute_force(per_fleet):
+    evaluator = _evaluator()
+    rng = np.random.default_rng(2)
+    loads = rng.integers(0, 3, (3, len(HOURS), 2)).astype(float)
+    windows = charging_windows(HOURS, 22, 3)  # one session, 22:00-03:00
+    if per_fleet:
+        windows = np.stack([windows, charging_windows(HOURS, 23, 2), windows])
+    cap = 3
+
+    shifted = evaluator.reallocate(loads, windows, max_power=cap)
+
+    score = evaluator.intensity[0]
+    for f, r in itertools.product(range(len(loads)), range(2)):
+        session = np.atleast_2d(windows)[f if per_fleet else 0] > 0
+        expected = _brute_force(loads[f, :, r], session, score[:, r], cap)
+        np.testing.assert_allclose(shifted[f, :, r], expected, atol=1e-9)
+    np.testing.assert_allclose(shifted.sum(axis=1), loads.sum(axis=1))
+
+
+def test_unlimited_reallocation_fills_the_cleanest_hour():
+    evaluator = _evaluator()
+    loads = np.ones((2, len(HOURS), 2))
+    windows = charging_windows(HOURS, 22, 3)
+
+    shifted = evaluator.reallocate(loads, windows)
+
+    session = np.flatnonzero(windows)
+    for r in range(2):
+        cleanest = session[np.argmin(evaluator.intensity[0, session, r])]
+        assert shifted[0, cleanest, r] == len(session)
+    np.testing.assert_array_equal(shifted[:, windows == 0], loads[:, windows == 0])
+
+
+def test_sessions_above_max_power_are_rejected():
+    evaluator = _evaluator()
+    loads = np.full((1, len(HOURS), 2), 2.0)
+
+    with pytest.raises(ValueError):
+        evaluator.reallocate(loads, charging_windows(HOURS, 22, 3), max_power=1.0)
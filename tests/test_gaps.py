@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from app.data import GenerationCube, load_cached_cube, save_cached_cube
+from app.module import calculate_capacity_factors, calculate_power_flow_balance
+
+
+def _cube(missing_invalid: bool) -> GenerationCube:
+    values = np.array(
+        [
+            [100.0, np.nan, 100.0],  # 北部, missing in hour 1
+            [50.0, 50.0, 50.0],  # 北部
+            [80.0, 80.0, 80.0],  # 南部
+        ]
+    )
+    return GenerationCube(
+        values=values,
+        regions=["北部", "北部", "南部"],
+        fuels=["風力", "風力", "風力"],
+        units=["a", "b", "c"],
+        missing_invalid=missing_invalid,
+    )
+
+
+def test_missing_unit_hours_propagate_to_regions():
+    cube = _cube(missing_invalid=True)
+
+    generation = cube.region_sum()
+    assert np.isnan(generation.loc[1, "北部"])
+    assert generation.loc[1, "南部"] == 80.0
+    assert generation.loc[0, "北部"] == 150.0
+    np.testing.assert_array_equal(cube.missing_hours(), [False, True, False])
+
+    regional, national = calculate_capacity_factors(
+        cube, {"a": 200.0, "b": 100.0, "c": 100.0}, "風力"
+    )
+    assert np.isnan(regional.loc[1, "北部"]) and np.isnan(national[1])
+    assert regional.loc[1, "南部"] == 0.8
+    assert regional.loc[0, "北部"] == 0.5
+
+
+def test_positional_cubes_count_missing_as_zero(tmp_path):
+    cube = _cube(missing_invalid=False)
+
+    assert cube.region_sum().loc[1, "北部"] == 50.0
+    assert not cube.missing_hours().any()
+
+    save_cached_cube(tmp_path, "key", _cube(missing_invalid=True), max_bytes=1 << 20)
+    assert load_cached_cube(tmp_path, "key").missing_invalid
+
+
+def test_missing_hours_are_missing_after_power_flow():
+    regions = ["北部", "南部"]
+    pg = pd.DataFrame({"北部": [10.0, 10.0, 10.0], "南部": [20.0, 20.0, 20.0]})
+    emissions = {"CO2e": pg * 500}
+    flow = {
+        "南北": {"from_": "南部", "to": "北部", "powerkWh": [5.0, 5.0, np.nan]},
+    }
+
+    generation, adjusted = calculate_power_flow_balance(
+        pg=pg,
+        flow=flow,
+        intensities={"CO2e": emissions["CO2e"] / pg},
+        emissions=emissions,
+        missing=np.array([True, False, False]),
+    )
+
+    assert generation.iloc[[0, 2]].isna().all().all()
+    assert adjusted["CO2e"].iloc[[0, 2]].isna().all().all()
+    assert generation.loc[1, regions].tolist() == [15.0, 15.0]
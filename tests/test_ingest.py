@@ -0,0 +1,36 @@
+import logging
+
+from app import profiling
+from app.core.ingest import call_buffered, replay_buffered
+
+
+@profiling.profiled("test.work")
+def _work(n: int) -> int:
+    logging.getLogger("test.ingest").warning("working on %d", n)
+    return n * 2
+
+
+def test_call_buffered_returns_log_and_stage_records(caplog):
+    try:
+        result, records, stage_records = call_buffered(
+            _work, profile=True, trace_memory=True, n=3
+        )
+        assert result == 6
+        assert [record.getMessage() for record in records] == ["working on 3"]
+        assert [record.stage for record in stage_records] == ["test.work"]
+
+        profiling.reset()
+        with caplog.at_level(logging.WARNING, logger="test.ingest"):
+            replay_buffered(records, stage_records)
+        assert "working on 3" in caplog.text
+        assert [record.stage for record in profiling.records()] == ["test.work"]
+    finally:
+        profiling.disable()
+        profiling.reset()
+
+
+def test_call_buffered_without_profiling_records_no_stages():
+    result, records, stage_records = call_buffered(_work, n=1)
+    assert result == 2
+    assert len(records) == 1
+    assert stage_records == []
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from app.module import IntensityIndex
+
+
+def _index(seed: int = 0) -> IntensityIndex:
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range("2024-05-01", "2024-05-31 23:00", freq="h")
+    generation = rng.uniform(1, 10, (len(timestamps), 3))
+    generation[:48, 2] = 0  # no generation in the first two days of one region
+    emissions = rng.uniform(0, 5000, (2, len(timestamps), 3)) * (generation > 0)
+    return IntensityIndex(
+        timestamps=timestamps,
+        regions=["北部", "中部", "南部"],
+        emission_types=["CO2e", "SOx"],
+        emissions=emissions,
+        generation=generation,
+    )
+
+
+def test_windows_match_direct_sums():
+    index = _index()
+    starts = pd.DatetimeIndex(
+        ["2024-05-01 00:00", "2024-05-03 05:00", "2024-05-10 00:00"]
+    )
+    ends = pd.DatetimeIndex(
+        ["2024-05-02 12:00", "2024-05-20 00:00", "2024-05-10 01:00"]
+    )
+
+    intensity = index.windows(starts, ends)
+
+    for w, (start, end) in enumerate(zip(starts, ends)):
+        hours = (index.timestamps >= start) & (index.timestamps < end)
+        g = index.generation[hours].sum(axis=0)
+        e = index.emissions[:, hours].sum(axis=1)
+        with np.errstate(invalid="ignore"):
+            np.testing.assert_allclose(intensity[w], e / g, rtol=1e-9)
+    np.testing.assert_allclose(
+        index.window(starts[1], ends[1]).to_numpy(), intensity[1], rtol=1e-12
+    )
+
+
+def test_calendar_matches_direct_sums():
+    index = _index()
+    hours = (index.timestamps.weekday < 5) & (index.timestamps.hour >= 18)
+
+    intensity = index.calendar(weekdays=range(5), hours=range(18, 24)).to_numpy()
+
+    e = index.emissions[:, hours].sum(axis=1)
+    g = index.generation[hours].sum(axis=0)
+    np.testing.assert_allclose(intensity, e / g, rtol=1e-9)
+
+
+def test_uncovered_or_zero_generation_windows_are_nan():
+    index = _index()
+
+    assert np.isnan(index.window("2024-08-03", "2024-08-17").to_numpy()).all()
+    assert np.isnan(index.window("2024-05-02", "2024-05-02").to_numpy()).all()
+    assert np.isnan(index.calendar(months=[7]).to_numpy()).all()
+
+    zero = index.window("2024-05-01", "2024-05-02")
+    assert zero["南部"].isna().all()
+    assert zero[["北部", "中部"]].notna().all().all()
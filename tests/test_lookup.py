@@ -0,0 +1,92 @@
+import json
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from app.core.lookup import IntensityLookup, LookupServer
+
+RESULTS = Path(__file__).resolve().parents[1] / "results"
+
+
+@pytest.mark.parametrize(
+    "result_dir", sorted(RESULTS.iterdir()), ids=lambda path: path.name
+)
+def test_lookup_checked_in_results(result_dir, tmp_path):
+    lookup = IntensityLookup.from_results(result_dir, cache_dir=tmp_path)
+
+    assert "北部" in lookup.regions
+    assert lookup.point("North", lookup.start) == lookup.point("北部", lookup.start)
+
+
+def _get(port: int, path: str) -> dict:
+    with socket.create_connection(("127.0.0.1", port)) as connection:
+        connection.sendall(f"GET {path} HTTP/1.0\r\n\r\n".encode("utf-8"))
+        response = b""
+        while chunk := connection.recv(4096):
+            response += chunk
+    return json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+
+def test_server_accepts_raw_and_encoded_regions(tmp_path):
+    lookup = IntensityLookup.from_results(RESULTS / "2024", cache_dir=tmp_path)
+    server = LookupServer(lookup, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_address[1]
+        raw = _get(port, "/point?region=北部&time=2024-07-01T18:00")
+        encoded = _get(port, "/point?region=%E5%8C%97%E9%83%A8&time=2024-07-01T18:00")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert raw == encoded
+    assert raw["value"] == lookup.point("北部", "2024-07-01T18:00")
+
+
+def _post(port: int, body: bytes) -> tuple:
+    with socket.create_connection(("127.0.0.1", port)) as connection:
+        connection.sendall(
+            b"POST /batch HTTP/1.0\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+        )
+        response = b""
+        while chunk := connection.recv(4096):
+            response += chunk
+    head, payload = response.split(b"\r\n\r\n", 1)
+    return int(head.split()[1]), json.loads(payload)
+
+
+def test_server_validates_batch_requests(tmp_path):
+    lookup = IntensityLookup.from_results(RESULTS / "2024", cache_dir=tmp_path)
+    server = LookupServer(lookup, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    times = ["2024-07-01T18:00", "2024-07-01T19:00"]
+    try:
+        port = server.server_address[1]
+        broadcast = _post(
+            port, json.dumps({"regions": "北部", "times": times}).encode("utf-8")
+        )
+        listed = _post(
+            port, json.dumps({"regions": ["北部"], "times": times}).encode("utf-8")
+        )
+        invalid = [
+            _post(port, body)
+            for body in (
+                b"[]",
+                b'"regions"',
+                b'{"regions": {"a": 1}, "times": []}',
+                b'{"regions": ["\\u5317\\u90e8"], "times": "2024-07-01T18:00"}',
+                b'{"regions": [1], "times": ["2024-07-01T18:00"]}',
+                b'{"times": ["2024-07-01T18:00"]}',
+                b"{not json",
+            )
+        ]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert broadcast == listed
+    assert broadcast[0] == 200 and len(broadcast[1]["values"]) == 2
+    assert [status for status, _ in invalid] == [400] * len(invalid)
+    assert all("error" in body for _, body in invalid)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.module import marginal_emission_factors, rolling_marginal_emission_factors
+
+SLOPES = {"北部": 500.0, "南部": 800.0}
+
+
+def _balance(index: pd.Index, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    generation = pd.DataFrame(
+        rng.uniform(1e5, 1e6, (len(index), len(SLOPES))),
+        index=index,
+        columns=list(SLOPES),
+    )
+    co2e = generation * pd.Series(SLOPES) + 1e7
+    emissions = {"CO2e": co2e, "SOx": co2e / 1000}
+    return generation, emissions
+
+
+def test_known_slopes_across_a_gap():
+    hours = pd.date_range("2024-01-01", periods=24 * 20, freq="h")
+    gap = (hours >= "2024-01-05 03:00") & (hours < "2024-01-05 09:00")
+    generation, emissions = _balance(hours[~gap])
+    # A jump across the gap would bias the slope if it were counted as a change.
+    after = generation.index >= "2024-01-05 09:00"
+    for frame in emissions.values():
+        frame.loc[after] += 1e9
+
+    mef = marginal_emission_factors(
+        generation, emissions, by_hour=False, by_season=False
+    )
+
+    np.testing.assert_allclose(mef.to_frame("CO2e").loc["all"], list(SLOPES.values()))
+    np.testing.assert_allclose(
+        mef.to_frame("SOx").loc["all"], [s / 1000 for s in SLOPES.values()]
+    )
+    np.testing.assert_allclose(mef.r2, 1.0)
+    assert (mef.samples == len(generation) - 2).all()
+
+    by_hour = marginal_emission_factors(generation, emissions, by_season=False)
+    np.testing.assert_allclose(by_hour.to_frame("CO2e")["南部"], 800.0)
+
+    rolling = rolling_marginal_emission_factors(
+        generation, emissions, window_days=7, min_samples=5
+    )
+    assert rolling["CO2e"].index.equals(generation.index)
+    fitted = rolling["CO2e"].dropna()
+    # The first day has no change at midnight; five changes per hour take 5-6 days.
+    assert fitted.index[0] >= pd.Timestamp("2024-01-05")
+    assert len(fitted) > len(generation) // 2
+    np.testing.assert_allclose(fitted["北部"], 500.0)
+
+
+def test_groups_without_samples_are_nan():
+    hours = pd.date_range("2024-07-01", periods=24 * 3, freq="h")
+    generation, emissions = _balance(hours)
+
+    mef = marginal_emission_factors(generation, emissions, by_hour=False)
+    summer = mef.groups.get_loc("summer")
+    assert (mef.samples[summer] == len(hours) - 1).all()
+    others = np.delete(np.arange(len(mef.groups)), summer)
+    assert (mef.samples[others] == 0).all()
+    assert np.isnan(mef.factors[:, others]).all()
+
+    # Three days hold three changes per hour of the day, below min_samples.
+    rolling = rolling_marginal_emission_factors(generation, emissions)
+    assert rolling["CO2e"].isna().all().all()
+
+
+def test_positional_index_is_rejected():
+    generation, emissions = _balance(pd.RangeIndex(48))
+
+    with pytest.raises(TypeError):
+        marginal_emission_factors(generation, emissions)
+    with pytest.raises(TypeError):
+        rolling_marginal_emission_factors(generation, emissions)
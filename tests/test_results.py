@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from app.data import ResultStore, convert_csv_results
+
+RESULTS = Path(__file__).resolve().parents[1] / "results"
+
+
+@pytest.mark.parametrize(
+    "result_dir", sorted(RESULTS.iterdir()), ids=lambda path: path.name
+)
+def test_convert_checked_in_results(result_dir, tmp_path):
+    store = ResultStore(convert_csv_results(result_dir, tmp_path / "results.eistore"))
+
+    starts = [int(period.split("~")[0]) for period in store.periods]
+    assert starts == sorted(starts)
+    assert set(store.emission_types) == {"CO2e", "SOx", "NOx", "PM"}
+    for period in store.periods:
+        expected = pd.read_csv(
+            result_dir / f"CO2e_EI_{period}.csv",
+            index_col=0,
+            parse_dates=True,
+            encoding="utf-8-sig",
+        )
+        intensity = store.intensity("CO2e", period)
+        pd.testing.assert_frame_equal(
+            intensity[expected.columns],
+            expected,
+            check_index_type=False,
+            check_freq=False,
+        )
+        for emission_type in store.emission_types:
+            assert store.intensity(emission_type, period).index.equals(intensity.index)
+
+
+def test_convert_skips_other_csv_files(tmp_path):
+    index = pd.date_range("2024-02-01", periods=3, freq="h")
+    frame = pd.DataFrame({"北部": [1.0, 2.0, 3.0]}, index=index)
+    for period in ["10~12", "2~4"]:
+        frame.to_csv(tmp_path / f"CO2e_EI_{period}.csv", encoding="utf-8-sig")
+        (frame / 1000).to_csv(tmp_path / f"CO2e_EI_{period}_kg.csv")
+        # Row-numbered intensities take the hours of their period.
+        frame.reset_index(drop=True).to_csv(tmp_path / f"SOx_EI_{period}.csv")
+
+    store = ResultStore(convert_csv_results(tmp_path))
+
+    assert store.periods == ["2~4", "10~12"]
+    assert store.emission_types == ["CO2e", "SOx"]
+    assert list(store.intensity("SOx", "2~4").index) == list(index)
+    assert store.intensity("CO2e", "10~12")["北部"].tolist() == [1.0, 2.0, 3.0]
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.module import sweep_capacity_scenarios
+from app.module.constants import UNIT_NAME_TO_LOCATION
+
+REGIONS = ["北部", "中部", "南部", "東部"]
+HOURS = 48
+
+
+def _inputs():
+    rng = np.random.default_rng(0)
+    base = pd.DataFrame(rng.uniform(1e6, 2e6, (HOURS, 4)), columns=REGIONS)
+    units = [
+        pd.DataFrame(rng.uniform(0, 1e5, (HOURS, 4)), columns=REGIONS)
+        for _ in range(2)
+    ]
+    emissions = {e: base * rng.uniform(100, 500) for e in ["CO2e", "SOx"]}
+    flow = {
+        name: {**corridor, "powerkWh": rng.uniform(0, 1e5, HOURS)}
+        for name, corridor in UNIT_NAME_TO_LOCATION.items()
+    }
+    targets = rng.uniform(0, 10, (10, 2))
+    return base, units, emissions, targets, flow
+
+
+def test_hourly_sweep_writes_into_memmap(tmp_path):
+    base, units, emissions, targets, flow = _inputs()
+    expected = sweep_capacity_scenarios(
+        base, units, emissions, targets, flow=flow, aggregate="hourly", chunk_size=3
+    )
+
+    out = np.lib.format.open_memmap(
+        tmp_path / "sweep.npy", mode="w+", dtype=np.float32, shape=(10, 2, HOURS, 5)
+    )
+    sweep = sweep_capacity_scenarios(
+        base,
+        units,
+        emissions,
+        targets,
+        flow=flow,
+        aggregate="hourly",
+        chunk_size=3,
+        out=out,
+    )
+    assert sweep.intensity is out
+    out.flush()
+    np.testing.assert_allclose(
+        np.load(tmp_path / "sweep.npy"), expected.intensity, rtol=1e-6
+    )
+
+
+def test_sweep_stores_requested_dtype():
+    base, units, emissions, targets, _ = _inputs()
+    sweep = sweep_capacity_scenarios(
+        base, units, emissions, targets, aggregate="mean", dtype=np.float32
+    )
+    assert sweep.intensity.dtype == np.float32
+    assert sweep.intensity.shape == (10, 2, 5)
+
+
+def test_sweep_rejects_out_of_the_wrong_shape():
+    base, units, emissions, targets, _ = _inputs()
+    with pytest.raises(ValueError, match="out must have shape"):
+        sweep_capacity_scenarios(
+            base,
+            units,
+            emissions,
+            targets,
+            aggregate="hourly",
+            out=np.empty((10, 2, 5)),
+        )
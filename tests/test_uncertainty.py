@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from app.data import GWP, GenerationCube, get_regional_emissions
+from app.module import calculate_power_flow_balance, propagate_uncertainty
+from app.module.constants import UNIT_NAME_TO_LOCATION
+
+REGIONS = ["北部", "中部", "南部", "東部"]
+EMISSIONS = ["CO2e", "SOx", "NOx", "PM"]
+HOURS = 24
+
+
+def _inputs():
+    rng = np.random.default_rng(0)
+    units = [f"{region}{fuel}" for region in REGIONS for fuel in ("燃煤", "燃氣")]
+    cube = GenerationCube(
+        values=rng.uniform(1e5, 5e5, (len(units), HOURS)),
+        regions=[unit[:2] for unit in units],
+        fuels=[unit[2:] for unit in units],
+        units=units,
+    )
+    emission_data = pd.DataFrame(
+        {
+            "能源別": cube.fuels,
+            "CO2e (g/kWh)": rng.uniform(400, 900, len(units)),
+            "SOx (g/kWh)": rng.uniform(0.01, 0.2, len(units)),
+            "NOx (g/kWh)": rng.uniform(0.05, 0.3, len(units)),
+            "PM (g/kWh)": rng.uniform(0.001, 0.02, len(units)),
+        },
+        index=units,
+    )
+    shares = rng.dirichlet(np.ones(len(GWP)), len(units))
+    ghg_shares = pd.DataFrame(shares, columns=list(GWP), index=units)
+    ghg_shares.insert(0, "Type", ["Coal" if "煤" in u else "Gas" for u in units])
+    base = cube.region_sum()[REGIONS]
+    solar = pd.DataFrame(rng.uniform(0, 1e5, (HOURS, 4)), columns=REGIONS)
+    flow = {
+        name: {**corridor, "powerkWh": rng.uniform(0, 5e4, HOURS)}
+        for name, corridor in UNIT_NAME_TO_LOCATION.items()
+    }
+    return cube, emission_data, ghg_shares, base, solar, flow
+
+
+def _propagate(workers=1, uncertainty=None, n_samples=40):
+    cube, emission_data, ghg_shares, base, solar, flow = _inputs()
+    return propagate_uncertainty(
+        cube,
+        emission_data,
+        ghg_shares,
+        base_generation=base,
+        fuel_generation=[solar],
+        flow=flow,
+        n_samples=n_samples,
+        uncertainty=uncertainty,
+        chunk_size=8,
+        workers=workers,
+    )
+
+
+def test_zero_sigmas_reproduce_the_deterministic_intensities():
+    cube, emission_data, _, base, solar, flow = _inputs()
+    generation = base + solar
+    emissions = get_regional_emissions(cube, emission_data, EMISSIONS)
+    adjusted_generation, adjusted_emissions = calculate_power_flow_balance(
+        pg=generation,
+        flow=flow,
+        intensities={e: emissions[e] / generation for e in EMISSIONS},
+        emissions=emissions,
+    )
+
+    bands = _propagate(
+        uncertainty={
+            "carbon_dioxide": 0,
+            "methane": 0,
+            "nitrous_oxide": 0,
+            "GWP": 0,
+            "SOx": 0,
+            "NOx": 0,
+            "PM": 0,
+            "capacity_factor": 0,
+        },
+        n_samples=4,
+    )
+
+    for i, emission_type in enumerate(EMISSIONS):
+        expected = (adjusted_emissions[emission_type] / adjusted_generation).to_numpy()
+        for q in range(len(bands.percentiles)):
+            np.testing.assert_allclose(bands.bands[q, i], expected, rtol=6e-8)
+        np.testing.assert_allclose(bands.mean[i], expected, rtol=6e-8)
+
+
+def test_bands_do_not_depend_on_the_number_of_workers():
+    serial = _propagate(workers=1)
+    parallel = _propagate(workers=2)
+
+    np.testing.assert_array_equal(serial.bands, parallel.bands)
+    np.testing.assert_array_equal(serial.mean, parallel.mean)
+    assert np.ptp(serial.bands, axis=0).max() > 0